@@ -0,0 +1,80 @@
+"""
+Date parsing cost of the old dateutil-only DateHandler.parse_datetime against the
+fast path, cold (empty cache) and warm (the same dates seen again next cycle), on a
+corpus of published dates in the shapes real feeds send.
+
+    python -m benchmarks.bench_dates --dates 5000 --rounds 5
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+from dateutil import parser as dateutil_parser
+
+from util.datehandler import DateHandler
+
+SHAPES = [
+    lambda date: date.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+    lambda date: date.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+    lambda date: date.astimezone(timezone(timedelta(hours=-3))).strftime('%a, %d %b %Y %H:%M:%S -0300'),
+    lambda date: date.strftime('%d %b %Y %H:%M:%S +0100'),
+    lambda date: date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    lambda date: date.astimezone(timezone(timedelta(hours=-3))).isoformat(),
+    lambda date: date.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00'),
+    lambda date: date.strftime('%Y-%m-%d %H:%M:%S'),
+    lambda date: date.strftime('%A, %B %d, %Y %I:%M %p'),  # only dateutil reads this one
+]
+
+
+def legacy_parse_datetime(date_time):
+    """ DateHandler.parse_datetime before the fast path """
+    result = dateutil_parser.parse(date_time)
+    if result.tzinfo is None:
+        result = pytz.utc.localize(result).astimezone(pytz.timezone("America/Belem"))
+    return result
+
+
+def corpus(size, seed=1):
+    generator = random.Random(seed)
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    return [generator.choice(SHAPES)(start + timedelta(seconds=generator.randrange(365 * 86400)))
+            for _ in range(size)]
+
+
+def measure(function, dates, rounds, before_round=None):
+    total = 0
+    for _ in range(rounds):
+        if before_round:
+            before_round()
+        time_started = time.perf_counter()
+        for date in dates:
+            function(date)
+        total += time.perf_counter() - time_started
+    return total / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dates', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    dates = corpus(args.dates)
+    mismatches = [date for date in dates if legacy_parse_datetime(date) != DateHandler.parse_datetime(date)]
+    print(f'{len(dates)} dates, {len(mismatches)} parsed to a different instant')
+
+    runs = (('dateutil', legacy_parse_datetime, None),
+            ('fast cold', DateHandler.parse_datetime, DateHandler.parse_datetime.cache_clear),
+            ('fast warm', DateHandler.parse_datetime, None))
+    baseline = None
+    for label, function, before_round in runs:
+        duration = measure(function, dates, args.rounds, before_round)
+        baseline = baseline or duration
+        print(f'{label:<10}{duration * 1000:>9.1f} ms {len(dates) / duration:>10.0f} dates/s '
+              f'{baseline / duration:>6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Cycle time of fetching feeds one by one (the old ThreadPool(1) path) against the
+concurrent FeedFetcher, on a local server serving fast and slow feeds.
+
+    python -m benchmarks.bench_fetch --fast 100 --slow 10 --delay 1
+"""
+import argparse
+import time
+
+import feedparser
+
+from benchmarks.feedserver import start_server
+from util.feedhandler import FeedHandler
+from util.fetcher import FeedFetcher
+
+
+def sequential(urls):
+    return [feedparser.parse(url) for url in urls]
+
+
+def concurrent(fetcher, urls):
+    return [FeedHandler.parse_response(response) for response in fetcher.fetch_many([(url, None, None)
+                                                                                    for url in urls])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fast', type=int, default=100)
+    parser.add_argument('--slow', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--per-host', type=int, default=50)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.delay)
+    urls = [f'{base_url}/fast/{feed}.xml' for feed in range(args.fast)] + \
+           [f'{base_url}/slow/{feed}.xml' for feed in range(args.slow)]
+    fetcher = FeedFetcher(concurrency=args.concurrency, per_host=args.per_host)
+
+    for label, run in (('sequential', lambda: sequential(urls)), ('concurrent', lambda: concurrent(fetcher, urls))):
+        time_started = time.perf_counter()
+        results = run()
+        duration = time.perf_counter() - time_started
+        entries = sum(len(result.entries) for result in results)
+        print(f'{label:<12}{len(urls):>6} feeds {entries:>7} entries {duration:>8.2f}s')
+
+    fetcher.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Round trips and latency of the subscription lifecycle: Lua scripts against the
+client side implementation they replaced.
+
+    python -m benchmarks.bench_lifecycle --db 15 --chats 50 --urls 20
+
+The data base given in --db is flushed before each run, never point it to the bots data.
+"""
+import argparse
+import time
+
+from redis import StrictRedis
+
+from util.database import DatabaseHandler
+
+
+class CountingRedis(StrictRedis):
+    """ StrictRedis that counts round trips, a pipeline execute counts as one """
+    round_trips = 0
+
+    def execute_command(self, *args, **options):
+        self.round_trips += 1
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction=transaction, shard_hint=shard_hint)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            self.round_trips += 1
+            return execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+class LegacyDatabaseHandler(DatabaseHandler):
+    """ Lifecycle operations as they ran before the Lua scripts, one command per round trip """
+
+    def _index_remove(self, name):
+        user_id, chat_id, url = self._split_name_url_chat(name)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.srem(self._index_url(url), name)
+        pipe.srem(self._index_user(user_id), name)
+        pipe.srem(self._index_chat(chat_id), name)
+        pipe.execute()
+
+    def update_owner(self, chat_id, user_id):
+        names = self.redis.smembers(self._index_chat(chat_id))
+        for name in names:
+            _, chat_id_db, url = self._split_name_url_chat(name)
+            name_update = self._name_url_chat(user_id, chat_id_db, url)
+            if name_update == name:
+                continue
+            self._index_remove(name)
+            self.redis.rename(name, name_update)
+            self.redis.hset(name_update, 'user_id', str(user_id))
+            self._index_add(name_update)
+
+    def update_group(self, chat_id, chat_name, chat_title, user_id, update_owner=None):
+        name = 'group:' + str(chat_id)
+        mapping = {'chat_adm': str(user_id),
+                   'chat_id': str(chat_id),
+                   'chat_lock': 'True',
+                   'chat_name': chat_name,
+                   'chat_title': str(chat_title)}
+        if update_owner:
+            self.update_owner(chat_id, user_id)
+
+        return True if self.set_name_key(name=name, mapping=mapping) else False
+
+    def set_url_to_chat(self, chat_id, chat_name, url, user_id):
+        if not self.exist_url(url):
+            self.update_url(url=url)
+
+        if not self.exist_url_to_chat(user_id, chat_id, url):
+            name = self._name_url_chat(user_id, chat_id, url)
+            mapping = {'chat_id': str(chat_id), 'chat_name': chat_name, 'user_id': str(user_id), 'disable': 'False'}
+            result = self.set_name_key(name=name, mapping=mapping)
+            self._index_add(name)
+            self.redis.sadd(self.INDEX_URLS_ACTIVATED, url)
+            return True if result else False
+        return False
+
+    def disable_url_chat(self, chat_id):
+        names = self.redis.smembers(self._index_chat(chat_id))
+        disables = [self.set_name_key(name=name, mapping={'disable': 'True'}) for name in names]
+        for url in self.extract_url_from_names(names):
+            self._index_url_activated(url)
+        return disables
+
+    def del_url_for_chat(self, chat_id, url):
+        names = [name for name in self.redis.smembers(self._index_chat(chat_id))
+                 if self._split_name_url_chat(name)[2] == url]
+        result = self.del_names(names)
+        for name in names:
+            self._index_remove(name)
+        self._index_url_activated(url)
+        return True if result and result[0] == 1 else None
+
+
+def counting(handler_class, db):
+    handler = handler_class(db)
+    handler.redis = CountingRedis(connection_pool=handler.redis.connection_pool)
+    handler._register_scripts()
+    return handler
+
+
+def run(handler, chats, urls):
+    handler.redis.flushdb()
+    chat_ids = [-1000 - chat for chat in range(chats)]
+    url_list = [f'http://feed{url}.example.com/rss' for url in range(urls)]
+    operations = [
+        ('subscribe', lambda: [handler.set_url_to_chat(chat_id, '@chat', url, 1)
+                               for chat_id in chat_ids for url in url_list]),
+        ('register group', lambda: [handler.update_group(chat_id, '@chat', 'chat', 2, update_owner=True)
+                                    for chat_id in chat_ids]),
+        ('disable chat', lambda: [handler.disable_url_chat(chat_id) for chat_id in chat_ids]),
+        ('unsubscribe', lambda: [handler.del_url_for_chat(chat_id, url) for chat_id in chat_ids for url in url_list]),
+    ]
+
+    results = []
+    for name, operation in operations:
+        handler.redis.round_trips = 0
+        time_started = time.perf_counter()
+        calls = len(operation())
+        duration = time.perf_counter() - time_started
+        results.append((name, calls, handler.redis.round_trips, duration))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--urls', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'operation':<16}{'implementation':<16}{'calls':>8}{'round trips':>14}{'ms/call':>10}")
+    for label, handler_class in (('client side', LegacyDatabaseHandler), ('lua script', DatabaseHandler)):
+        handler = counting(handler_class, args.db)
+        for name, calls, round_trips, duration in run(handler, args.chats, args.urls):
+            print(f'{name:<16}{label:<16}{calls:>8}{round_trips:>14}{duration * 1000 / calls:>10.3f}')
+        handler.redis.flushdb()
+
+
+if __name__ == '__main__':
+    main()
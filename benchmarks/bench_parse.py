@@ -0,0 +1,66 @@
+"""
+Feed parsing throughput of ParsePool for a growing number of worker processes,
+on a corpus of local feed files. 0 workers parses in the calling thread.
+
+    python -m benchmarks.bench_parse --feeds 3000 --items 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.feedserver import feed_body
+from util.parsepool import ParsePool
+
+
+def write_corpus(directory, feeds, items):
+    paths = []
+    for feed in range(feeds):
+        path = os.path.join(directory, f'{feed}.xml')
+        with open(path, 'wb') as file:
+            file.write(feed_body(feed, items))
+        paths.append(path)
+    return paths
+
+
+def load_responses(paths):
+    """ Reads the corpus as FeedFetcher would have returned it """
+    responses = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            responses.append({'url': f'file://{path}', 'status': 200, 'content': file.read(),
+                              'headers': {'content-type': 'application/rss+xml; charset=utf-8'},
+                              'etag': None, 'modified': None})
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--feeds', type=int, default=3000)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='*', default=None,
+                        help='worker counts to measure, defaults to 0, 1, 2, 4 ... up to the cpu count')
+    args = parser.parse_args()
+
+    workers = args.workers
+    if workers is None:
+        workers = [0] + [2 ** power for power in range((os.cpu_count() or 1).bit_length())]
+        if workers[-1] != os.cpu_count():
+            workers.append(os.cpu_count() or 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        responses = load_responses(write_corpus(directory, args.feeds, args.items))
+        for count in workers:
+            pool = ParsePool(workers=count)
+            pool.parse_many(responses[:count * 8])  # start the workers outside the timing
+            time_started = time.perf_counter()
+            results = pool.parse_many(responses)
+            duration = time.perf_counter() - time_started
+            pool.close()
+            entries = sum(len(result.entries) for result in results)
+            print(f'{count:>3} workers {len(results):>6} feeds {entries:>7} entries {duration:>8.2f}s '
+                  f'{len(results) / duration:>8.0f} feeds/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Sends a burst of messages to private chats and groups of a local stand-in Bot API
+that enforces the Telegram flood limits, with a plain Bot and with RateLimitedBot,
+and reports delivered messages, 429 answers and msgs/s.
+
+    python -m benchmarks.bench_sends --chats 60 --groups 3 --messages 3 --threads 8
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.utils.request import Request
+
+from benchmarks.botapi import start_server
+from util.ratelimit import RateLimitedBot
+
+TOKEN = '123456:STAND-IN'
+
+
+def send(bot, chat_id, text):
+    try:
+        bot.send_message(chat_id=chat_id, text=text)
+        return 'sent'
+    except RetryAfter:
+        return 'lost'
+
+
+def run(bot, chat_ids, messages, threads):
+    jobs = [(chat_id, f'message {message}') for message in range(messages) for chat_id in chat_ids]
+    time_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda job: send(bot, *job), jobs))
+    return results, time.perf_counter() - time_started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=60)
+    parser.add_argument('--groups', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    chat_ids = list(range(1, args.chats + 1)) + [-1000 - group for group in range(args.groups)]
+    for label, bot_class in (('plain', Bot), ('limited', RateLimitedBot)):
+        server, flood, base_url = start_server()
+        bot = bot_class(TOKEN, base_url=base_url, request=Request(con_pool_size=args.threads + 4))
+        results, duration = run(bot, chat_ids, args.messages, args.threads)
+        refused = sum(count for key, count in flood.stats.items() if key.startswith('429'))
+        print(f'{label:<8}{results.count("sent"):>6} sent {results.count("lost"):>6} lost {refused:>6} 429 '
+              f'{duration:>7.2f}s {results.count("sent") / duration:>7.1f} msgs/s')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
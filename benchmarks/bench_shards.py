@@ -0,0 +1,153 @@
+"""
+Cycle time of the feed engine split over worker processes holding shard leases,
+for a growing number of workers, and how long the shards of a killed worker take
+to be taken over by the others. Every worker is a BatchProcess with a
+LeaseManager, fetching from a local server serving slow feeds.
+
+    python -m benchmarks.bench_shards --db 15 --feeds 200 --workers 1 2 4 --shards 16
+
+The workers only meet in redis, so STORAGE=memory does not apply here. The data
+base given in --db is flushed before the run, never point it to the bots data.
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from benchmarks.feedserver import start_server
+from util.database import DatabaseHandler
+from util.fetcher import FeedFetcher
+from util.leases import LeaseManager
+from util.processing import BatchProcess
+
+GO = 'bench:go'
+DONE = 'bench:done'
+STOP = 'bench:stop'
+
+
+class BenchBot(object):
+    """ Only the identity is asked, the messages stay queued in the outbox """
+
+    def get_me(self):
+        return SimpleNamespace(first_name='bench')
+
+
+def worker(db, worker_name, shards, ttl, concurrency):
+    logging.basicConfig(level=logging.ERROR)
+    db = DatabaseHandler(db)
+    leases = LeaseManager(db, worker=worker_name, shards=shards, ttl=ttl)
+    leases.start()
+    fetcher = FeedFetcher(concurrency=concurrency, per_host=concurrency)
+    engine = BatchProcess(db, BenchBot(), fetcher=fetcher, leases=leases)
+    while not db.redis.exists(GO, STOP):
+        time.sleep(0.05)
+    while not db.redis.exists(STOP):
+        engine.parse_parallel()
+        fetched = sum(engine.responses.values())
+        if fetched:
+            db.redis.incrby(DONE, fetched)
+        else:
+            time.sleep(0.05)
+    engine.stop()
+    fetcher.close()
+    leases.stop()
+    leases.join()
+
+
+def lease_owners(db, shards):
+    return Counter(owner for owner in db.redis.mget([db._name_lease(shard) for shard in range(shards)]) if owner)
+
+
+def wait_balanced(db, shards, workers):
+    """ Waits until every shard is leased and no worker holds more than its fair share """
+    target = math.ceil(shards / len(workers))
+    while True:
+        owners = lease_owners(db, shards)
+        if set(owners) == set(workers) and sum(owners.values()) == shards and max(owners.values()) <= target:
+            return owners
+        time.sleep(0.05)
+
+
+def start_workers(args, count, label):
+    context = multiprocessing.get_context('spawn')
+    processes = {f'{label}-{index}': context.Process(target=worker, args=(args.db, f'{label}-{index}', args.shards,
+                                                                          args.ttl, args.concurrency))
+                 for index in range(count)}
+    for process in processes.values():
+        process.start()
+    return processes
+
+
+def stop_workers(db, processes):
+    db.redis.set(STOP, '1')
+    for process in processes.values():
+        process.join()
+    db.redis.delete(GO, DONE, STOP)
+
+
+def run(db, args, urls, count):
+    """ Seconds for count workers to poll every url once, with the shards balanced beforehand """
+    for url in urls:
+        db.update_url_validators(url)
+    processes = start_workers(args, count, f'run{count}')
+    owners = wait_balanced(db, args.shards, list(processes))
+    db.redis.zadd(db.INDEX_URLS_DUE, {url: 0 for url in urls})
+    time_started = time.perf_counter()
+    db.redis.set(GO, '1')
+    while int(db.redis.get(DONE) or 0) < len(urls):
+        time.sleep(0.02)
+    duration = time.perf_counter() - time_started
+    stop_workers(db, processes)
+    return duration, sorted(owners.values())
+
+
+def takeover(db, args, count):
+    """ Kills one of count workers without releasing its leases, returns the seconds until the rest hold them """
+    processes = start_workers(args, count, f'crash{count}')
+    wait_balanced(db, args.shards, list(processes))
+    killed = next(iter(processes))
+    processes.pop(killed).kill()
+    time_started = time.perf_counter()
+    wait_balanced(db, args.shards, list(processes))
+    duration = time.perf_counter() - time_started
+    stop_workers(db, processes)
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--feeds', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--ttl', type=float, default=3.0)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.delay)
+    db = DatabaseHandler(args.db)
+    db.redis.flushdb()
+    urls = [f'{base_url}/slow/{feed}.xml' for feed in range(args.feeds)]
+    for url in urls:
+        db.set_url_to_chat(chat_id=1, chat_name='bench', url=url, user_id=1)
+
+    print(f"{'workers':>8}{'shards each':>14}{'feeds':>8}{'seconds':>10}{'feeds/s':>10}")
+    for count in args.workers:
+        duration, shares = run(db, args, urls, count)
+        shares = f'{shares[0]}-{shares[-1]}' if shares[0] != shares[-1] else str(shares[0])
+        print(f'{count:>8}{shares:>14}{len(urls):>8}{duration:>10.2f}{len(urls) / duration:>10.1f}')
+
+    count = max(max(args.workers), 2)
+    print(f'shards of a killed worker taken over by {count - 1} others in {takeover(db, args, count):.2f}s '
+          f'(lease ttl {args.ttl}s)')
+
+    db.redis.flushdb()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
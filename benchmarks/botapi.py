@@ -0,0 +1,93 @@
+"""
+Local stand-in for the Telegram Bot API that enforces the flood limits: 30
+messages/s per bot, 1/s per chat and 20/min per group. A message over a limit is
+refused with 429 and retry_after, as Telegram does. Answers getMe and sendMessage.
+"""
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LIMITS = {'global': (30, 1.0), 'chat': (1, 1.0), 'group': (20, 60.0)}
+
+
+class FloodControl(object):
+    """ Sliding window counters per bot, chat and group. slack forgives network jitter """
+
+    def __init__(self, slack=0.05):
+        self.slack = slack
+        self.lock = threading.Lock()
+        self.windows = defaultdict(deque)
+        self.stats = Counter()
+        self.chats = Counter()
+
+    def allow(self, chat_id):
+        keys = [('global', None), ('chat', chat_id)]
+        if str(chat_id).startswith(('-', '@')):
+            keys.append(('group', chat_id))
+        with self.lock:
+            now = time.monotonic()
+            for kind, key in keys:
+                limit, period = LIMITS[kind]
+                window = self.windows[kind, key]
+                while window and window[0] <= now - period + self.slack:
+                    window.popleft()
+                if len(window) >= limit:
+                    self.stats[f'429 {kind}'] += 1
+                    return max(1, int(window[0] + period - now + 1))
+            for kind, key in keys:
+                self.windows[kind, key].append(now)
+            self.stats['sent'] += 1
+            self.chats[chat_id] += 1
+            return 0
+
+
+class BotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    flood = None
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or b'{}')
+        if method == 'getMe':
+            self.reply(200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'StandIn',
+                                                    'username': 'standin_bot'}})
+        elif method == 'sendMessage':
+            retry_after = self.flood.allow(data.get('chat_id'))
+            if retry_after:
+                self.reply(429, {'ok': False, 'error_code': 429,
+                                 'description': f'Too Many Requests: retry after {retry_after}',
+                                 'parameters': {'retry_after': retry_after}})
+            else:
+                self.reply(200, {'ok': True, 'result': {
+                    'message_id': self.flood.stats['sent'], 'date': int(time.time()), 'text': data.get('text'),
+                    'chat': {'id': data.get('chat_id'), 'type': 'private'}}})
+        else:
+            self.reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class BotApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_server(slack=0.05):
+    """ Starts the stand-in on a free local port, returns (server, flood control, base url for Bot) """
+    flood = FloodControl(slack)
+    handler = type('FloodBotApiHandler', (BotApiHandler,), {'flood': flood})
+    server = BotApiServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, flood, f'http://127.0.0.1:{server.server_address[1]}/bot'
@@ -0,0 +1,59 @@
+"""
+Local stand-in feed server for the benchmarks. /fast/<n>.xml answers at once,
+/slow/<n>.xml after --delay seconds; both send an ETag and honour If-None-Match.
+"""
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ITEM = """<item><title>Post {feed}-{item}</title><link>http://example.com/{feed}/{item}</link>
+<guid>http://example.com/{feed}/{item}</guid><pubDate>{date}</pubDate>
+<description>Summary of post {item} of feed {feed}.</description></item>"""
+
+
+def feed_body(feed, items=10):
+    posts = ''.join(ITEM.format(feed=feed, item=item, date=formatdate(1700000000 + item * 3600, usegmt=True))
+                    for item in range(items))
+    return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+            f'<title>Feed {feed}</title><link>http://example.com/{feed}</link>'
+            f'<description>Benchmark feed</description>{posts}</channel></rss>').encode()
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 1.0
+
+    def do_GET(self):
+        if self.path.startswith('/slow/'):
+            time.sleep(self.delay)
+        body = feed_body(self.path)
+        etag = f'"{hash(body) & 0xffffffff:x}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class FeedServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_server(delay=1.0):
+    """ Starts the server on a free local port, returns (server, base url) """
+    handler = type('DelayedFeedRequestHandler', (FeedRequestHandler,), {'delay': delay})
+    server = FeedServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
@@ -1,23 +1,28 @@
 from telegram.error import Unauthorized, BadRequest
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, run_async
 from telegram import ParseMode
+from telegram.utils.request import Request
 import logging
+import signal
+import threading
 from html import escape
 from decouple import config
 from emoji import emojize
 
+from util.bots import BOTS, bot_names
+from util.connection import pool_stats
 from util.database import DatabaseHandler
+from util.datehandler import DateHandler
 from util.feedhandler import FeedHandler
-from util.processing import BatchProcess
+from util.feedworker import FeedWorker
+from util.pollhandler import PollHandler
+from util.outbox import OutboxSender
+from util.ratelimit import RateLimitedBot, SharedRateLimiter
 
 # Configuration
 LOG = config('LOG')
 CHAT_ID = config('CHAT_ID')
-TOKEN = config('TOKEN')
-updater = Updater(TOKEN, use_context=True)
-dp = updater.dispatcher
-job_queue = updater.job_queue
-db = DatabaseHandler(0)
+WORKERS = config('WORKERS', default=4, cast=int)
 
 logging.basicConfig(level=LOG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -57,6 +62,8 @@ help_text_feed = "RSS Management\n" \
                  "/remove <url> - Removes an exisiting subscription from your list.\n" \
                  "/remove @chanel <url> - Removes url in Your chanel.\n" \
                  "/remove @group <url> - Removes url in Your group.\n" \
+                 "/digest <minutes> [posts] - Joins the new posts of <minutes> in one message when they are " \
+                 "[posts] or more (2 by default). /digest off sends each post again\n" \
                  "Other\n" \
                  "/help - Shows the help menu  :)"
 
@@ -66,11 +73,12 @@ def send_async(context, chat_id, text, **kwargs):
     context.bot.sendMessage(chat_id, text, **kwargs)
 
 
-def _check(update, _, override_lock=None):
+def _check(update, context, override_lock=None):
     """
     Perform some hecks on the update. If checks were successful, returns True,
     else sends an error message to the chat and returns False.
     """
+    db = context.bot_data['db']
     chat_id = update.message.chat.id
     user_id = update.message.from_user.id
 
@@ -92,8 +100,9 @@ def _check(update, _, override_lock=None):
 
 
 # Welcome a user to the chat
-def _welcome(update, _, member=None):
+def _welcome(update, context, member=None):
     """ Welcomes a user to the chat """
+    db = context.bot_data['db']
     chat_id = update.message.chat.id
     chat_title = update.message.chat.title
     first_name = member.first_name
@@ -124,9 +133,10 @@ def _introduce(update, context):
     Introduces the bot to a chat its been added to and saves the user id of the
     user who invited us.
     """
+    db = context.bot_data['db']
     me = context.bot
     if me.username == 'LiturgiaDiaria_bot':
-        _set_daily_liturgy(update)
+        _set_daily_liturgy(update, context)
         return
 
     chat_title = update.message.chat.title
@@ -145,7 +155,8 @@ def _introduce(update, context):
     update.message.reply_text(text=text, parse_mode=ParseMode.HTML)
 
 
-def _set_daily_liturgy(update):
+def _set_daily_liturgy(update, context):
+    db = context.bot_data['db']
     chat_id = update.message.chat.id
     chat_name = '@' + update.message.chat.username or '@' + update.message.from_user.username \
                 or update.message.from_user.first_name
@@ -166,9 +177,10 @@ help_text = help_text + help_text_feed
 # Print help text
 def start(update, context):
     """ Prints help text """
+    db = context.bot_data['db']
     me = context.bot
     if me.username == 'LiturgiaDiaria_bot':
-        _set_daily_liturgy(update)
+        _set_daily_liturgy(update, context)
         return
 
     chat_id = update.message.chat.id
@@ -198,8 +210,9 @@ def left_chat_member(update, context):
 
 
 # Welcome a user to the chat
-def goodbye(update, _):
+def goodbye(update, context):
     """ Sends goodbye message when a user left the chat """
+    db = context.bot_data['db']
     chat_id = update.message.chat.id
     chat_title = update.message.chat.title
     first_name = update.message.left_chat_member.first_name
@@ -225,6 +238,7 @@ def goodbye(update, _):
 # Set custom message
 def set_welcome(update, context):
     """ Sets custom welcome message """
+    db = context.bot_data['db']
     args = context.args
     chat_id = update.message.chat.id
 
@@ -250,6 +264,7 @@ def set_welcome(update, context):
 # Set custom message
 def set_goodbye(update, context):
     """ Enables and sets custom goodbye message """
+    db = context.bot_data['db']
     args = context.args
     chat_id = update.message.chat_id
 
@@ -272,6 +287,41 @@ def set_goodbye(update, context):
     update.message.reply_text(text='Got it!')
 
 
+def set_digest(update, context):
+    """ Sets the digest mode of the chat, kept in the group hash """
+    db = context.bot_data['db']
+    args = context.args
+    chat_id = update.message.chat.id
+
+    # private chats choose for themselves, groups need the admin privilege
+    if chat_id < 0 and not _check(update, context):
+        return
+
+    usage = '<code>/digest 30 3</code> - Joins the posts of 30 minutes in one message when they are 3 or more\n' \
+            '<code>/digest off</code> - Sends each post as it comes'
+    if not args:
+        settings = db.get_digest_settings([chat_id]).get(chat_id)
+        text = f'Digest every {settings[0] // 60} minutes from {settings[1]} posts' if settings else 'Digest is off'
+        update.message.reply_text(text=text + '\n\n' + usage, parse_mode=ParseMode.HTML)
+        return
+
+    if args[0] == 'off':
+        mapping = {'digest_window': '0'}
+    else:
+        try:
+            minutes = int(args[0])
+            threshold = int(args[1]) if len(args) > 1 else 2
+        except ValueError:
+            minutes = threshold = 0
+        if minutes < 1 or threshold < 2:
+            update.message.reply_text(text=usage, parse_mode=ParseMode.HTML)
+            return
+        mapping = {'digest_window': str(minutes * 60), 'digest_threshold': str(threshold)}
+
+    if db.set_name_key('group:' + str(chat_id), mapping):
+        update.message.reply_text(text='Got it!')
+
+
 def disable_welcome(update, context):
     """ Disables the goodbye message """
     command_control(update, context, 'disable_welcome')
@@ -304,6 +354,7 @@ def unquiet(update, context):
 
 def command_control(update, context, command):
     """ Disables the goodbye message """
+    db = context.bot_data['db']
     chat_id = update.message.chat_id
 
     # _check admin privilege and group context
@@ -499,7 +550,8 @@ def get_id(update, context):
 #         update.message.reply_text(text=text, parse_mode=ParseMode.HTML)
 
 
-def feed_url(update, url, **chat_info):
+def feed_url(update, context, url, **chat_info):
+    db = context.bot_data['db']
     arg_url = FeedHandler.format_url_string(string=url)
 
     # _check if argument matches url format
@@ -554,7 +606,7 @@ def add_url(update, context):
             update.reply_text(text=text, quote=False)
         else:
             chat_info = {'chat_id': chat_info['id'], 'chat_name': chat_info['username']}
-            feed_url(update, url, **chat_info)
+            feed_url(update, context, url, **chat_info)
 
     else:
         url = args[0]
@@ -566,13 +618,14 @@ def add_url(update, context):
         user_id = update.message.from_user.id
         chat_info = {'chat_id': chat_id, 'chat_name': chat_name, 'user_id': user_id}
 
-        feed_url(update, url, **chat_info)
+        feed_url(update, context, url, **chat_info)
 
 
 def list_url(update, context):
     """
     Displays a list of all user subscriptions
     """
+    db = context.bot_data['db']
     user_id = update.message.from_user.id
     chat_id = update.message.chat.id
 
@@ -596,6 +649,7 @@ def all_url(update, context):
     """
     Displays a list of all user subscriptions
     """
+    db = context.bot_data['db']
     chat_id = update.message.chat_id
 
     # _check admin privilege and group context
@@ -620,6 +674,7 @@ def remove_url(update, context):
     """
     Removes an rss subscription from user
     """
+    db = context.bot_data['db']
     args = context.args
 
     text = "Sorry! I could not remove the entry! " \
@@ -666,6 +721,7 @@ def remove_url(update, context):
 
 
 def get_key(update, context):
+    db = context.bot_data['db']
     args = context.args
     if len(args) == 1:
         keys = db.find_names(args[0])
@@ -675,6 +731,7 @@ def get_key(update, context):
 
 
 def remove_key(update, context):
+    db = context.bot_data['db']
     args = context.args
     text = 'I removed '
     if len(args) == 1:
@@ -683,6 +740,50 @@ def remove_key(update, context):
             update.message.reply_text(text=str(text + key), parse_mode=ParseMode.HTML)
 
 
+def _is_admin(update):
+    """ Only the bot administrator (CHAT_ID) can run maintenance commands """
+    return str(update.message.from_user.id) == str(CHAT_ID)
+
+
+def show_pool_stats(update, _):
+    """ Shows the redis connection pool usage against the dispatcher workers """
+    if not _is_admin(update):
+        return
+
+    text = f'workers: {WORKERS}\n'
+    for db_index, stats in pool_stats().items():
+        text += f'\ndb {db_index}\n' + '\n'.join(f'{k}: {v}' for k, v in stats.items()) + '\n'
+    update.message.reply_text(text=text)
+
+
+def poll_info(update, context):
+    """ Shows the learned poll interval of a url, or of every activated url """
+    db = context.bot_data['db']
+    if not _is_admin(update):
+        return
+
+    urls = [db.resolve_url(url) for url in context.args] or db.get_urls_activated()
+    lines = []
+    for url in urls:
+        poll = db.get_url_poll(url)
+        history = PollHandler.parse_history(poll['publish_history'])
+        gaps = ', '.join(str(gap) for gap in PollHandler.gaps(history)) or '-'
+        due = DateHandler.datetime.fromtimestamp(poll['due']).strftime('%Y-%m-%d %H:%M:%S') if poll['due'] else '-'
+        lines.append(f"<code>{escape(url)}</code>\ninterval: {poll['poll_interval'] or PollHandler.INTERVAL}s "
+                     f"next: {due}\ngaps: {gaps}")
+
+    if not lines:
+        update.message.reply_text(text='No activated urls')
+    text = ''
+    for line in lines:
+        if len(text) + len(line) > 4000:
+            update.message.reply_text(text=text, parse_mode=ParseMode.HTML)
+            text = ''
+        text += line + '\n\n'
+    if text:
+        update.message.reply_text(text=text, parse_mode=ParseMode.HTML)
+
+
 def stop(update, context):
     """
     Stops the bot from working
@@ -700,14 +801,16 @@ def stop(update, context):
     update.message.reply_text(message)
 
 
-def loop_parse(_):
-    bp = BatchProcess(db=db, bot=dp.bot)
-    bp.run()
-    job_queue.run_once(callback=loop_parse, when=15, name='loop_feed')
-
+def build_updater(name, request):
+    """ Updater of one bot of BOTS, its data base is kept in bot_data for the handlers """
+    db_index, token = BOTS[name]
+    db = DatabaseHandler(db_index)
+    # the rate limits are kept in the bot's data base, shared with its feed workers and senders
+    bot = RateLimitedBot(config(token), request=request, limiter=SharedRateLimiter(db))
+    updater = Updater(bot=bot, workers=WORKERS, use_context=True)
+    dp = updater.dispatcher
+    dp.bot_data['db'] = db
 
-def main():
-    # Create the Updater and pass it your bot's token.
     dp.add_handler(CommandHandler(['start', 'help'], start))
     dp.add_handler(CommandHandler('welcome', set_welcome, pass_args=True))
     dp.add_handler(CommandHandler('goodbye', set_goodbye, pass_args=True))
@@ -726,8 +829,11 @@ def main():
     dp.add_handler(CommandHandler('removekey', remove_key, pass_args=True))
     dp.add_handler(CommandHandler('getuser', get_chat_by_username, pass_args=True))
     dp.add_handler(CommandHandler('listurl', list_url))
+    dp.add_handler(CommandHandler('digest', set_digest, pass_args=True))
     dp.add_handler(CommandHandler('allurl', all_url))
     dp.add_handler(CommandHandler('owner', _introduce))
+    dp.add_handler(CommandHandler('poolstats', show_pool_stats))
+    dp.add_handler(CommandHandler('pollinfo', poll_info, pass_args=True))
 
     dp.add_handler(CommandHandler('stop', stop))
 
@@ -739,10 +845,36 @@ def main():
 
     # dp.add_error_handler(error)
 
-    loop_parse(dp)
+    return updater
 
-    updater.start_polling()
-    updater.idle()
+
+def main(names=None):
+    """
+    Runs the bots named, BOTS in .env by default, in this process. Their updaters share
+    the Telegram connection pool; the feed fetcher, parser and render cache are
+    process wide, so co-hosted bots share them too.
+    """
+    names = names or bot_names()
+    # per bot: the dispatcher workers, the outbox delivery threads and 4 for updater, dispatcher and job queue
+    request = Request(con_pool_size=len(names) * (WORKERS + OutboxSender.DELIVERY_WORKERS + 4))
+    updaters = [build_updater(name, request) for name in names]
+
+    workers = []
+    for updater in updaters:
+        # the feed engine and the outbox sender run for the life of the process, or in feedworker.py
+        if FeedWorker.embedded():
+            workers.append(FeedWorker(db=updater.dispatcher.bot_data['db'], bot=updater.bot).start())
+        updater.start_polling()
+    logger.info(f"Running bots {', '.join(names)}")
+
+    finished = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(signum, lambda *_: finished.set())
+    finished.wait()
+    for updater in updaters:
+        updater.stop()
+    for worker in workers:
+        worker.stop(timeout=OutboxSender.BLOCK / 1000 + 5)
 
 
 if __name__ == '__main__':
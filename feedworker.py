@@ -0,0 +1,43 @@
+import argparse
+import logging
+import signal
+import threading
+
+from decouple import config
+from telegram.utils.request import Request
+
+from util.bots import BOTS
+from util.database import DatabaseHandler
+from util.feedworker import FeedWorker
+from util.outbox import OutboxSender
+from util.ratelimit import RateLimitedBot, SharedRateLimiter
+
+logging.basicConfig(level=config('LOG', default='INFO'),
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feed pipeline of a bot without the Telegram polling, '
+                                                 'run the bot with FEED_ENGINE=external next to it')
+    parser.add_argument('bot', choices=sorted(BOTS))
+    parser.add_argument('--no-outbox', action='store_true',
+                        help='only queue the new posts, other processes deliver them')
+    args = parser.parse_args()
+
+    db_index, token = BOTS[args.bot]
+    db = DatabaseHandler(db_index)
+    bot = RateLimitedBot(config(token), request=Request(con_pool_size=OutboxSender.DELIVERY_WORKERS + 4),
+                         limiter=SharedRateLimiter(db))
+    worker = FeedWorker(db=db, bot=bot, outbox=not args.no_outbox).start()
+
+    finished = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: finished.set())
+    finished.wait()
+    logger.info(f'Stopping feed worker of {args.bot}')
+    worker.stop(timeout=OutboxSender.BLOCK / 1000 + 5)
+
+
+if __name__ == '__main__':
+    main()
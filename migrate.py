@@ -0,0 +1,40 @@
+import argparse
+import logging
+
+from util.database import DatabaseHandler
+
+logging.basicConfig(level='INFO', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def build_indexes(db, args):
+    """ Builds the subscription index sets from the user_url names already stored """
+    total = DatabaseHandler(db).build_indexes()
+    logger.info(f'Indexed {total} subscriptions on db {db}')
+
+
+def canonical_urls(db, args):
+    """ Rewrites the urls in their canonical spelling, merging the spellings of one feed and their subscribers """
+    feeds, merged, moved = DatabaseHandler(db).merge_urls(loose=args.loose)
+    logger.info(f'Merged {merged} url spellings into {feeds} feeds, moved {moved} subscriptions on db {db}')
+
+
+COMMANDS = {'indexes': build_indexes, 'urls': canonical_urls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='One-shot data migrations for the bots data bases')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--db', type=int, nargs='+', default=[0, 2],
+                        help='redis data bases to migrate (0 OiOlabot, 2 LiturgiaDiaria_bot)')
+    parser.add_argument('--loose', action='store_true',
+                        help='urls: also merge http/https, www and trailing slash spellings, '
+                             'check first that they serve the same feed')
+    args = parser.parse_args()
+
+    for db in args.db:
+        COMMANDS[args.command](db, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import os
+
+# the suite runs on the in-process backend, no redis server needed
+os.environ['STORAGE'] = 'memory'
+
+import pytest  # noqa: E402
+
+from util import storage  # noqa: E402
+from util.database import DatabaseHandler  # noqa: E402
+from util.storage import MemoryStorage  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """ DatabaseHandler on an empty MemoryStorage of its own """
+    memory = MemoryStorage()
+    monkeypatch.setattr(storage, 'get_storage', lambda _: memory)
+    return DatabaseHandler(15)
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    """
+    Two DatabaseHandlers, one on MemoryStorage with the python scripts and one on
+    fakeredis running the Lua scripts, to check both give the same results
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    handlers = []
+    for client in (MemoryStorage(), fakeredis.FakeStrictRedis(decode_responses=True)):
+        monkeypatch.setattr(storage, 'get_storage', lambda _, client=client: client)
+        handlers.append(DatabaseHandler(15))
+    return handlers
+
@@ -0,0 +1,64 @@
+from util.leases import LeaseManager
+from util.schema import KeySchema
+
+
+def subscribe(db, count):
+    urls = [f'http://feed{index}.example.com/rss' for index in range(count)]
+    for url in urls:
+        db.set_url_to_chat(1, 'me', url, 1)
+    return sorted(urls)
+
+
+def test_pop_due_reschedules_what_it_pops(db):
+    urls = subscribe(db, 3)
+    db.schedule_url(urls[2], 50)
+
+    assert sorted(db.pop_urls_due(now=10, next_due=100)) == urls[:2]
+    assert db.pop_urls_due(now=10, next_due=100) == []
+    assert db.get_url_poll(urls[0])['due'] == 100
+    assert sorted(db.pop_urls_due(now=100, next_due=200)) == urls
+
+
+def test_schedule_only_activated_urls(db):
+    assert db.schedule_url('http://gone.example.com/rss', 10) == 0
+    assert db.pop_urls_due(now=10, next_due=20) == []
+
+
+def test_shards_split_the_due_urls(db):
+    urls = subscribe(db, 60)
+    shards = 4
+
+    popped = [db.pop_urls_due_shards(now=0, next_due=100, shards=shards, owned=[shard]) for shard in range(shards)]
+
+    assert sorted(url for part in popped for url in part) == urls
+    for shard, part in enumerate(popped):
+        assert all(KeySchema._shard(url, shards) == shard for url in part)
+    assert db.pop_urls_due_shards(now=0, next_due=100, shards=shards, owned=range(shards)) == []
+    assert db.pop_urls_due_shards(now=0, next_due=100, shards=shards, owned=[]) == []
+
+
+def test_leases_are_exclusive(db):
+    assert db.acquire_leases('one', [0, 1], ttl=30) == [0, 1]
+    assert db.acquire_leases('two', [1, 2], ttl=30) == [2]
+    assert db.renew_leases('two', [0, 1, 2], ttl=30) == [2]
+    assert db.release_leases('two', [0, 1, 2]) == 1
+    assert db.acquire_leases('two', [2], ttl=30) == [2]
+
+
+def test_workers_balance_the_shards(db):
+    one = LeaseManager(db, worker='one', shards=8, ttl=30)
+    two = LeaseManager(db, worker='two', shards=8, ttl=30)
+
+    one.balance()
+    assert one.owned_shards() == list(range(8))
+
+    two.balance()
+    one.balance()
+    two.balance()
+    assert len(one.owned_shards()) == len(two.owned_shards()) == 4
+    assert set(one.owned_shards()).isdisjoint(two.owned_shards())
+
+    two.release()
+    one.balance()
+    one.balance()
+    assert one.owned_shards() == list(range(8))
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from util.fetchcache import FetchCache
+from util.schema import KeySchema
+from util.storage import MemoryStorage
+
+URL = 'http://feed.example.com/rss'
+
+
+class Fetcher(object):
+    """ Answers every url with status, records the requests and can hold a fetch until released """
+
+    def __init__(self, status=200, etag='"v1"'):
+        self.status = status
+        self.etag = etag
+        self.requests = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def fetch_many(self, requests):
+        self.requests.extend(requests)
+        self.started.set()
+        self.release.wait(5)
+        return [{'url': url, 'status': self.status, 'content': b'' if self.status == 304 else b'<rss/>',
+                 'headers': {'content-type': 'application/rss+xml'}, 'etag': self.etag, 'modified': None}
+                for url, _, _ in requests]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def memory():
+    return MemoryStorage()
+
+
+def cache(memory, fetcher):
+    return FetchCache(fetcher, memory, ttl=60, lock_ttl=30)
+
+
+def test_a_cached_fetch_is_a_hit(memory):
+    fetcher = Fetcher()
+    engine = cache(memory, fetcher)
+
+    miss, = engine.fetch_many([(URL, None, None)])
+    hit, = engine.fetch_many([(URL, None, None)])
+    fresh, = engine.fetch_many([(URL, '"v1"', None)])
+    assert (miss['cache'], hit['cache'], fresh['cache']) == ('miss', 'hit', 'hit')
+    assert hit['content'] == miss['content'] == b'<rss/>'
+    assert (fresh['status'], fresh['content']) == (304, b'')
+    assert len(fetcher.requests) == 1
+
+
+def fetch_while_another_fetches(memory, status):
+    """ Responses of an engine asking for URL while another engine holds its lock, and what each fetched """
+    first, second = Fetcher(status), Fetcher(status)
+    first.release.clear()
+    engine = cache(memory, second)
+    waiting = threading.Event()
+    read = engine._read
+
+    def read_once(keys):
+        results = read(keys)
+        waiting.set()
+        return results
+
+    engine._read = read_once
+    responses = {}
+    fetching = threading.Thread(target=lambda: cache(memory, first).fetch_many([(URL, None, None)]))
+    fetching.start()
+    assert first.started.wait(5)
+    waiter = threading.Thread(target=lambda: responses.update(waiter=engine.fetch_many([(URL, None, None)])))
+    waiter.start()
+    assert waiting.wait(5)
+    first.release.set()
+    fetching.join(5)
+    # well before the lock would expire, so the waiter saw it released
+    waiter.join(5)
+    assert not waiter.is_alive()
+    return responses['waiter'][0], first.requests, second.requests
+
+
+def test_a_waiter_is_served_by_the_fetch_of_another_engine(memory):
+    response, fetched, refetched = fetch_while_another_fetches(memory, 200)
+
+    assert response['cache'] == 'shared' and response['content'] == b'<rss/>'
+    assert len(fetched) == 1 and refetched == []
+
+
+def test_a_failed_fetch_releases_its_waiters(memory):
+    response, fetched, refetched = fetch_while_another_fetches(memory, 503)
+
+    assert response['cache'] == 'miss'
+    assert len(fetched) == 1 and refetched == [(URL, None, None)]
+    assert not memory.exists(KeySchema._name_fetch_lock(URL))
+
+
+def test_a_cached_304_only_answers_the_same_validators(memory):
+    first, second = Fetcher(304), Fetcher(200, etag='"v3"')
+    cache(memory, first).fetch_many([(URL, '"v1"', None)])
+    engine = cache(memory, second)
+
+    same, = engine.fetch_many([(URL, '"v1"', None)])
+    other, = engine.fetch_many([(URL, '"v2"', None)])
+    assert (same['cache'], same['status']) == ('hit', 304)
+    assert (other['cache'], other['status'], other['content']) == ('miss', 200, b'<rss/>')
+    assert second.requests == [(URL, '"v2"', None)]
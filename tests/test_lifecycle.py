@@ -0,0 +1,70 @@
+A = 'http://a.example.com/feed'
+B = 'http://b.example.com/feed'
+
+
+def test_subscribe_indexes_the_subscription(db):
+    assert db.set_url_to_chat(1, 'me', A, 10) is True
+    assert db.set_url_to_chat(1, 'me', A, 10) is False
+
+    name = db._name_url_chat(10, 1, A)
+    assert db.redis.smembers(db._index_url(A)) == {name}
+    assert db.redis.smembers(db._index_user(10)) == {name}
+    assert db.redis.smembers(db._index_chat(1)) == {name}
+    assert db.get_urls_activated() == [A]
+    assert db.redis.zscore(db.INDEX_URLS_DUE, A) == 0
+    assert db.get_update_url(A)['last_update'] == db.DEFAULT_LAST_UPDATE
+    assert db.get_chat_urls(10) == [{'user_id': '10', 'chat_name': 'me', 'url': A, 'chat_id': '1'}]
+
+
+def test_disable_chat_deactivates_urls_without_enabled_subscriptions(db):
+    db.set_url_to_chat(1, 'me', A, 10)
+    db.set_url_to_chat(-2, 'group', A, 10)
+    db.set_url_to_chat(-2, 'group', B, 10)
+
+    assert sorted(db.disable_url_chat(-2)) == [db._name_url_chat(10, -2, A), db._name_url_chat(10, -2, B)]
+    assert db.get_urls_activated() == [A]
+    assert db.redis.zscore(db.INDEX_URLS_DUE, B) is None
+    assert db.get_chat_ids_activated(A) == [1]
+
+
+def test_unsubscribe_drops_the_url_with_its_last_subscription(db):
+    db.set_url_to_chat(1, 'me', A, 10)
+    db.set_url_to_chat(-2, 'group', A, 10)
+    db.add_seen_items(A, ['entry'], seen_at=1.0)
+
+    assert db.del_url_for_chat(1, A) is True
+    assert db.del_url_for_chat(1, A) is None
+    assert db.get_urls_activated() == [A]
+    assert db.get_seen_items(A, ['entry']) == [True]
+
+    assert db.del_url_for_chat(-2, A) is True
+    assert db.get_urls_activated() == []
+    assert db.redis.zscore(db.INDEX_URLS_DUE, A) is None
+    assert db.get_seen_items(A, ['entry']) is None
+    assert db.redis.smembers(db._index_user(10)) == set()
+
+
+def test_register_group_moves_subscriptions_to_the_new_owner(db):
+    db.set_url_to_chat(-2, 'group', A, 10)
+    db.set_url_to_chat(-2, 'group', B, 10)
+
+    assert db.update_group(-2, 'group', 'Group', 20) is True
+    assert db.redis.smembers(db._index_user(20)) == set()
+
+    assert db.update_group(-2, 'group', 'Group', 20, update_owner=True) is True
+    assert db.redis.smembers(db._index_user(20)) == {db._name_url_chat(20, -2, A), db._name_url_chat(20, -2, B)}
+    assert db.redis.smembers(db._index_user(10)) == set()
+    assert db.get_value_name_key(db._name_url_chat(20, -2, A), 'user_id') == '20'
+    assert db.update_owner(-2, 20) == 0
+
+
+def test_active_chat_ids_are_listed_once_in_order(db):
+    db.set_url_to_chat(-2, 'group', A, 10)
+    db.set_url_to_chat(-2, 'group', A, 20)
+    db.set_url_to_chat(1, 'me', A, 10)
+    db.set_url_to_chat(3, 'other', A, 30)
+    db.disable_url_chat(3)
+
+    assert sorted(db.get_chat_ids_activated(A)) == [-2, 1]
+    assert db._active_chat_ids([('False', '5'), ('True', '6'), ('False', '4'), ('False', '5'), ('False', None)]) \
+        == [5, 4]
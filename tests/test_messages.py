@@ -0,0 +1,58 @@
+import re
+from html import unescape
+
+import pytest
+
+from util.feedhandler import HTML_TAG, FeedHandler
+
+
+def balanced(message):
+    opened = []
+    for slash, name in HTML_TAG.findall(message):
+        if slash:
+            assert opened.pop() == name
+        else:
+            opened.append(name)
+    return not opened
+
+
+def visible(message):
+    return re.sub(r'\s+', ' ', unescape(re.sub(r'<[^>]*>', '', message))).strip()
+
+
+LITURGY = '<b>Primeira leitura</b>\n' + '\n\n'.join(
+    f'<i>Versículo {index}</i>: &quot;Palavra&quot; <a href="http://example.com/{index}">ler &amp; ouvir</a> ' * 3
+    for index in range(40))
+
+
+@pytest.mark.parametrize('text', [
+    LITURGY,
+    '<b>' + 'negrito &amp; longo ' * 60 + '</b>',
+    '<pre>' + 'x' * 2000 + '</pre>',
+])
+def test_split_message_keeps_the_markup_valid(text):
+    parts = FeedHandler.split_message(text, limit=300)
+
+    assert len(parts) > 1
+    for part in parts:
+        assert len(part) <= 300
+        assert balanced(part)
+        assert not re.search(r'&#?\w*$', re.sub(r'<[^>]*>$', '', part))
+    assert visible(' '.join(parts)).replace(' ', '') == visible(text).replace(' ', '')
+
+
+def test_split_message_prefers_paragraph_breaks():
+    paragraphs = ['<b>title</b> ' + 'word ' * 30 for _ in range(6)]
+    parts = FeedHandler.split_message('\n\n'.join(paragraphs), limit=400)
+
+    assert parts == ['\n\n'.join(paragraphs[:2]).strip(), '\n\n'.join(paragraphs[2:4]).strip(),
+                     '\n\n'.join(paragraphs[4:]).strip()]
+
+
+def test_digest_messages_join_posts_up_to_the_limit():
+    posts = [f'<b>post {index}</b>\nhttp://example.com/{index}' for index in range(10)]
+    messages = FeedHandler.digest_messages(posts, limit=100)
+
+    assert all(len(message) <= 100 for message in messages)
+    assert '\n\n'.join(messages) == '\n\n'.join(posts)
+    assert FeedHandler.digest_messages([LITURGY], limit=4096) == FeedHandler.split_message(LITURGY)
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from util.outbox import OutboxSender
+
+URL = 'http://feed.example.com/rss'
+
+
+class Bot(object):
+    """ Fails the chats given in errors with their error, sends to the others """
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def outbox(db):
+    db.create_outbox_group()
+    return db
+
+
+def sender(db, bot, consumer='one'):
+    return OutboxSender(db, bot, consumer=consumer, workers=2)
+
+
+def test_queued_messages_are_read_once(outbox):
+    outbox.queue_messages(URL, 'post', [1, 2])
+
+    messages = outbox.read_outbox('one', 10)
+    assert [fields['chat_id'] for _, fields in messages] == ['1', '2']
+    assert messages[0][1] == {'chat_id': '1', 'text': 'post', 'url': URL, 'attempts': '0'}
+    assert outbox.read_outbox('two', 10) == []
+    assert outbox.read_outbox('one', 10, start='0') == messages
+
+
+def test_drain_acks_the_sent_messages(outbox):
+    bot = Bot()
+    outbox.queue_messages(URL, 'post', [1, 2])
+
+    sender(outbox, bot).drain(outbox.read_outbox('one', 10))
+    assert sorted(bot.sent) == [(1, 'post'), (2, 'post')]
+    assert outbox.get_outbox_length() == {'queued': 0, 'dead': 0, 'retrying': 0}
+    assert outbox.read_outbox('one', 10, start='0') == []
+
+
+def test_transient_failures_are_retried_later_then_dead_lettered(outbox, monkeypatch):
+    monkeypatch.setattr(OutboxSender, 'MAX_ATTEMPTS', 2)
+    worker = sender(outbox, Bot({1: NetworkError('timed out')}))
+    outbox.queue_messages(URL, 'post', [1])
+
+    time_started = time.time()
+    worker.drain(outbox.read_outbox('one', 10))
+    assert outbox.read_outbox('one', 10) == []
+    assert outbox.get_outbox_length() == {'queued': 0, 'dead': 0, 'retrying': 1}
+    assert outbox.requeue_outbox(time_started) == 0
+    assert outbox.requeue_outbox(time_started + OutboxSender.RETRY_DELAY + 1) == 1
+    messages = outbox.read_outbox('one', 10)
+    assert [fields['attempts'] for _, fields in messages] == ['1']
+    assert outbox.get_outbox_length() == {'queued': 1, 'dead': 0, 'retrying': 0}
+
+    worker.drain(messages)
+    assert outbox.get_outbox_length() == {'queued': 0, 'dead': 1, 'retrying': 0}
+    assert worker.deliveries['retry'] == 2
+
+
+def test_retry_delay_doubles_and_respects_retry_after(outbox):
+    worker = sender(outbox, Bot())
+    delays = [worker.retry_delay({'attempts': str(attempts)}, NetworkError('timed out')) for attempts in range(4)]
+
+    assert delays == [OutboxSender.RETRY_DELAY * 2 ** attempts for attempts in range(4)]
+    assert worker.retry_delay({'attempts': '30'}, None) == OutboxSender.RETRY_MAX
+    assert worker.retry_delay({'attempts': '0'}, RetryAfter(120)) == 120
+
+
+def test_bad_requests_go_to_the_dead_letters(outbox):
+    worker = sender(outbox, Bot({1: BadRequest("Can't parse entities")}))
+    outbox.queue_messages(URL, 'post', [1, 2])
+
+    worker.drain(outbox.read_outbox('one', 10))
+    assert outbox.get_outbox_length() == {'queued': 0, 'dead': 1, 'retrying': 0}
+    assert worker.deliveries == {'sent': 1, 'failed': 1}
+    dead = outbox.redis.xrange(outbox.STREAM_DEAD)
+    assert dead[0][1]['chat_id'] == '1' and "Can't parse entities" in dead[0][1]['error']
+
+
+def test_pending_messages_of_a_stopped_consumer_are_claimed(outbox):
+    outbox.queue_messages(URL, 'post', [1, 2])
+    read = outbox.read_outbox('one', 10)
+
+    assert outbox.claim_outbox('two', 60000, 10) == []
+    assert outbox.claim_outbox('two', 0, 10) == read
+    assert outbox.read_outbox('one', 10, start='0') == []
+    assert outbox.read_outbox('two', 10, start='0') == read
@@ -0,0 +1,38 @@
+from util.pollhandler import PollHandler
+
+
+def test_history_round_trip():
+    history = PollHandler.add_published([1000, 2000], [3000, 2000.5, 1500])
+    assert history == [1000, 1500, 2000, 3000]
+    assert PollHandler.parse_history(PollHandler.format_history(history)) == history
+    assert PollHandler.parse_history(None) == []
+
+
+def test_history_keeps_the_newest(monkeypatch):
+    monkeypatch.setattr(PollHandler, 'HISTORY', 3)
+    assert PollHandler.add_published([1, 2, 3], [4, 5]) == [3, 4, 5]
+
+
+def test_new_posts_poll_faster_down_to_the_median_gap():
+    assert PollHandler.next_interval(600, [], new_posts=True) == 300
+    assert PollHandler.next_interval(600, [1000, 1100, 1200, 1500], new_posts=True) == 100
+    default = max(PollHandler.MIN_INTERVAL, PollHandler.INTERVAL // 2)
+    assert PollHandler.next_interval(None, [], new_posts=True) == default
+
+
+def test_quiet_feed_backs_off_exponentially_despite_a_past_burst():
+    history = [1000, 1060, 1120, 1180]
+    interval = 60
+    intervals = []
+    for _ in range(10):
+        interval = PollHandler.next_interval(interval, history, new_posts=False)
+        intervals.append(interval)
+
+    assert intervals[:5] == [120, 240, 480, 960, 1920]
+    assert intervals[-1] == PollHandler.MAX_INTERVAL
+
+
+def test_interval_stays_within_bounds():
+    assert PollHandler.next_interval(PollHandler.MIN_INTERVAL, [], new_posts=True) == PollHandler.MIN_INTERVAL
+    assert PollHandler.next_interval(PollHandler.MAX_INTERVAL, [], new_posts=False) == PollHandler.MAX_INTERVAL
+    assert PollHandler.next_interval(600, [1000, 1001], new_posts=True) == PollHandler.MIN_INTERVAL
@@ -0,0 +1,90 @@
+import pytest
+
+from util.ratelimit import RateLimiter, SharedRateLimiter, TokenBucket
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2)
+    now = bucket.stamp
+
+    assert bucket.delay(now) == 0
+    bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    bucket.take()
+    assert bucket.delay(now) == pytest.approx(1)
+    assert bucket.delay(now + 1) == pytest.approx(0)
+    assert bucket.idle(now + 2)
+
+
+def test_token_bucket_block():
+    bucket = TokenBucket(rate=10)
+    now = bucket.stamp
+
+    bucket.block(now + 5)
+    bucket.block(now + 1)
+    assert bucket.delay(now) == pytest.approx(5)
+    assert not bucket.idle(now + 1)
+    assert bucket.idle(now + 5)
+
+
+def reserve(limiter, chat_ids):
+    return [limiter.reserve(chat_id) for chat_id in chat_ids]
+
+
+@pytest.fixture(params=['local', 'shared'])
+def limiter(request, db):
+    if request.param == 'local':
+        return RateLimiter(rate_global=10, rate_chat=2, rate_group=60)
+    return SharedRateLimiter(db, rate_global=10, rate_chat=2, rate_group=60)
+
+
+def test_chat_limit_paces_each_chat(limiter):
+    waits = reserve(limiter, [1, 1, 1, 2])
+
+    assert waits[0] == 0
+    assert waits[1] == pytest.approx(0.5, abs=0.05)
+    assert waits[2] == pytest.approx(1, abs=0.05)
+    assert waits[3] == pytest.approx(0.3, abs=0.05)
+
+
+def test_global_limit_paces_every_chat(limiter):
+    waits = reserve(limiter, range(1, 6))
+
+    assert waits == pytest.approx([0, 0.1, 0.2, 0.3, 0.4], abs=0.05)
+
+
+def test_group_limit_per_minute(limiter):
+    waits = reserve(limiter, ['-100', '-100', '@channel'])
+
+    assert waits == pytest.approx([0, 1, 0.2], abs=0.05)
+
+
+def test_retry_after_blocks_only_that_chat(limiter):
+    limiter.backoff(1, 30)
+
+    assert limiter.reserve(1) == pytest.approx(30, abs=0.05)
+    assert limiter.reserve(2) == pytest.approx(0.1, abs=0.05)
+
+
+def test_retry_after_without_chat_blocks_the_bot(limiter):
+    limiter.backoff(None, 30)
+
+    assert limiter.reserve(2) == pytest.approx(30, abs=0.05)
+
+
+def test_shared_limiters_of_one_bot_share_the_buckets(db):
+    one, two = SharedRateLimiter(db, rate_chat=2), SharedRateLimiter(db, rate_chat=2)
+
+    assert one.reserve(1) == 0
+    assert two.reserve(1) == pytest.approx(0.5, abs=0.05)
+    assert 0 < db.redis.pttl(db._name_rate('chat:1')) <= 2000
+
+
+def test_rate_scripts_match_lua(backends):
+    for db in backends:
+        limiter = SharedRateLimiter(db, rate_global=10, rate_chat=2, rate_group=60)
+        limiter.backoff('-100', 30)
+        waits = reserve(limiter, ['-100', 1, 1])
+
+        assert waits == pytest.approx([30, 0.1, 0.5], abs=0.05)
+        assert sorted(db.redis.keys('rate:*')) == ['rate:chat:-100', 'rate:chat:1', 'rate:global', 'rate:group:-100']
@@ -0,0 +1,225 @@
+"""
+The Lua scripts of util/scripts.py and their python versions in MemoryStorage
+run the same steps on fakeredis and on the memory backend, both must answer
+and leave the data base alike after every step. AsyncDatabaseHandler runs them
+too and must agree with DatabaseHandler.
+"""
+import asyncio
+import inspect
+import re
+
+import pytest
+
+from util import storage
+from util.asyncdatabase import AsyncDatabaseHandler
+from util.database import DatabaseHandler
+from util.schema import KeySchema
+from util.storage import AsyncMemoryStorage, MemoryStorage
+
+A = 'http://a.example.com/feed'
+B = 'https://b.example.com/rss?x=1'
+
+
+STREAM_ID = re.compile(r'\d{13}-\d+')
+
+
+def snapshot(client):
+    """
+    Every key with its value, the stream ids in names and members masked and the
+    expiries left out as they differ per run
+    """
+    values = []
+    for name in client.keys('*'):
+        kind = client.type(name)
+        if kind == 'string':
+            value = client.get(name)
+        elif kind == 'hash':
+            value = client.hgetall(name)
+        elif kind == 'set':
+            value = sorted(client.smembers(name))
+        elif kind == 'list':
+            value = client.lrange(name, 0, -1)
+        elif kind == 'zset':
+            value = [(STREAM_ID.sub('<id>', member), score)
+                     for member, score in client.zrangebyscore(name, '-inf', '+inf', withscores=True)]
+        else:
+            value = [fields for _, fields in client.xrange(name)]
+        values.append((STREAM_ID.sub('<id>', name), value))
+    return sorted(values, key=repr)
+
+
+def run_both(backends, steps):
+    for step in steps:
+        memory, lua = (step(db) for db in backends)
+        assert memory == lua, step
+        assert snapshot(backends[0].redis) == snapshot(backends[1].redis), step
+
+
+LIFECYCLE = [
+    lambda db: db.set_url_to_chat(1, 'me', A, 10),
+    lambda db: db.set_url_to_chat(1, 'me', A, 10),
+    lambda db: db.set_url_to_chat(-2, 'group', A, 10),
+    lambda db: db.set_url_to_chat(-2, 'group', B, 10),
+    lambda db: db.set_url_to_chat(3, 'other', B, 30),
+    lambda db: db.update_group(-2, 'group', 'Group', 20),
+    lambda db: db.update_group(-2, 'group', 'Group', 20, update_owner=True),
+    lambda db: db.update_owner(-2, 40),
+    lambda db: db.update_owner(-2, 40),
+    lambda db: db.add_seen_items(B, ['one', 'two'], seen_at=1.0),
+    lambda db: sorted(db.disable_url_chat(-2)),
+    lambda db: db.get_urls_activated(),
+    lambda db: db.del_url_for_chat(1, A),
+    lambda db: db.del_url_for_chat(1, A),
+    lambda db: db.del_url_for_chat(3, B),
+    lambda db: db.del_url_for_chat(-2, B),
+    lambda db: db.del_url_for_chat(-2, A),
+]
+
+
+def test_lifecycle_scripts(backends):
+    run_both(backends, LIFECYCLE)
+
+
+def due_urls(db):
+    urls = [f'http://feed{index}.example.com/rss' for index in range(40)]
+    for url in urls:
+        db.set_url_to_chat(1, 'me', url, 1)
+    return db.redis.zadd(db.INDEX_URLS_DUE, {url: index % 3 for index, url in enumerate(urls)}, xx=True)
+
+
+POP_DUE = [
+    due_urls,
+    lambda db: db.pop_urls_due(now=0, next_due=100),
+    lambda db: db.pop_urls_due(now=0, next_due=100),
+    lambda db: db.pop_urls_due_shards(now=1, next_due=200, shards=4, owned=[1, 3]),
+    lambda db: db.pop_urls_due_shards(now=2, next_due=300, shards=4, owned=[0, 1, 2, 3]),
+    lambda db: db.pop_urls_due(now=250, next_due=400),
+]
+
+
+def test_pop_due_scripts(backends):
+    run_both(backends, POP_DUE)
+
+
+LEASES = [
+    lambda db: db.acquire_leases('one', [0, 1, 2], ttl=30),
+    lambda db: db.acquire_leases('two', [1, 2, 3], ttl=30),
+    lambda db: db.renew_leases('one', [0, 1, 2, 3], ttl=30),
+    lambda db: db.renew_leases('two', [0, 1, 2, 3], ttl=30),
+    lambda db: db.release_leases('one', [1, 3]),
+    lambda db: db.release_leases('two', [0, 1, 2, 3]),
+    lambda db: db.renew_leases('one', [0, 1, 2], ttl=30),
+]
+
+
+def test_lease_scripts(backends):
+    run_both(backends, LEASES)
+
+
+DIGESTS = [
+    lambda db: db.buffer_digests(A, 'first', {-2: 60, 3: 600}, now=0),
+    lambda db: db.buffer_digests(B, '<b>second</b>', {-2: 60}, now=10),
+    lambda db: db.pop_digests_due(now=30),
+    lambda db: db.pop_digests_due(now=60),
+    lambda db: db.pop_digests_due(now=600),
+    lambda db: db.pop_digests_due(now=600),
+]
+
+
+def test_pop_digests_script(backends):
+    run_both(backends, DIGESTS)
+
+
+def retry(db, chat_id, due):
+    db.create_outbox_group()
+    db.queue_messages(A, f'post {chat_id}', [chat_id])
+    (message_id, fields), = db.read_outbox('one', 1)
+    return db.retry_outbox(message_id, fields, due)[-1]
+
+
+RETRIES = [
+    lambda db: retry(db, 1, 10),
+    lambda db: retry(db, 2, 20),
+    lambda db: db.requeue_outbox(5),
+    lambda db: db.requeue_outbox(10),
+    lambda db: db.get_outbox_length(),
+    lambda db: db.requeue_outbox(30),
+    lambda db: [fields for _, fields in db.read_outbox('one', 10)],
+]
+
+
+def test_requeue_outbox_script(backends):
+    run_both(backends, RETRIES)
+
+
+MERGES = [
+    lambda db: db.set_url_to_chat(1, 'me', 'http://www.example.com/feed/', 1),
+    lambda db: db.set_url_to_chat(2, 'other', 'https://example.com/feed', 2),
+    lambda db: db.set_url_to_chat(-3, 'group', 'HTTP://Example.com/other#x', 3),
+    lambda db: db.update_url('http://www.example.com/feed/', last_update='2029-01-01 00:00:00+00:00'),
+    lambda db: db.add_seen_items('http://www.example.com/feed/', ['post'], seen_at=1.0),
+    lambda db: db.merge_urls(),
+    lambda db: db.merge_urls(loose=True),
+    lambda db: db.build_indexes(),
+    lambda db: db.resolve_url('http://example.com/feed/'),
+    lambda db: db.set_url_to_chat(4, 'new', 'http://example.com/feed', 4),
+    lambda db: db.get_chat_urls(4),
+    lambda db: db.del_url_for_chat(2, 'http://www.example.com/feed'),
+]
+
+
+def test_merge_urls_scripts(backends):
+    run_both(backends, MERGES)
+
+
+class Awaited(object):
+    """ AsyncDatabaseHandler behind the sync API of the steps, each coroutine run to its end """
+
+    def __init__(self, handler, memory):
+        self.handler = handler
+        self.redis = memory
+        self.loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name):
+        value = getattr(self.handler, name)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            return self.loop.run_until_complete(result) if inspect.isawaitable(result) else result
+
+        return call
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """ DatabaseHandler and AsyncDatabaseHandler, each on a MemoryStorage of its own """
+    memory, memory_async = MemoryStorage(), MemoryStorage()
+    monkeypatch.setattr(storage, 'get_storage', lambda _: memory)
+    monkeypatch.setattr(storage, 'get_async_storage', lambda _: AsyncMemoryStorage(memory_async))
+    awaited = Awaited(AsyncDatabaseHandler(15), memory_async)
+    yield [DatabaseHandler(15), awaited]
+    awaited.loop.close()
+
+
+@pytest.mark.parametrize('steps', [LIFECYCLE, POP_DUE, LEASES, DIGESTS, RETRIES, MERGES],
+                         ids=['lifecycle', 'pop_due', 'leases', 'digests', 'retries', 'merges'])
+def test_async_handler_matches_the_sync_one(handlers, steps):
+    run_both(handlers, steps)
+
+
+def test_async_handler_raises_where_the_call_was_yielded(handlers):
+    _, awaited = handlers
+    assert awaited.create_outbox_group() is True
+    assert awaited.create_outbox_group() is False
+
+
+@pytest.mark.parametrize('url', [A, 'http://xn--ao-xia.example.com/ação', 'http://example.com/~a?b=1&c=%20'])
+def test_shard_hash_matches_lua(backends, url):
+    memory, lua = backends
+    for shards in (2, 7, 16):
+        owned = [KeySchema._shard(url, shards)]
+        for db in backends:
+            db.redis.zadd(db.INDEX_URLS_DUE, {url: 0})
+        assert memory.pop_urls_due_shards(0, 0, shards, owned) == lua.pop_urls_due_shards(0, 0, shards, owned) == [url]
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pytest
+
+from util.feedhandler import FeedHandler
+from util.parsepool import ParsePool
+from util.processing import BatchProcess
+
+URL = 'http://feed.example.com/rss'
+
+
+def test_seen_items(db):
+    assert db.get_seen_items(URL, ['a']) is None
+
+    db.add_seen_items(URL, ['a', 'b'], seen_at=1.0)
+    assert db.get_seen_items(URL, ['b', 'c', 'a']) == [True, False, True]
+
+
+def test_seen_items_keep_the_newest(db, monkeypatch):
+    monkeypatch.setattr(db, 'SEEN_ITEMS', 3)
+    db.add_seen_items(URL, ['a', 'b'], seen_at=1.0)
+    db.add_seen_items(URL, ['c', 'd'], seen_at=2.0)
+
+    assert db.get_seen_items(URL, ['a', 'b', 'c', 'd']) == [False, True, True, True]
+
+
+def response(count):
+    """ A fetched rss with count entries, newest first, one minute apart """
+    items = ''.join(f'<item><title>post {index}</title><link>http://feed.example.com/{index}</link>'
+                    f'<guid>post-{index}</guid><pubDate>Mon, 01 Jan 2029 {index // 60:02d}:{index % 60:02d}:00 GMT'
+                    f'</pubDate></item>' for index in reversed(range(count)))
+    content = f'<rss version="2.0"><channel><title>feed</title>{items}</channel></rss>'.encode()
+    return {'url': URL, 'status': 200, 'content': content, 'headers': {}, 'etag': None, 'modified': None}
+
+
+def feed(count):
+    return FeedHandler.parse_response(response(count))
+
+
+class Fetcher(object):
+    """ Answers every request with the response it was given last """
+
+    def __init__(self):
+        self.response = None
+
+    def fetch_many(self, requests):
+        return [dict(self.response, url=url) for url, _, _ in requests]
+
+
+@pytest.fixture
+def engine(db):
+    db.set_url_to_chat(1, 'me', URL, 1)
+    engine = BatchProcess(db, SimpleNamespace(get_me=lambda: SimpleNamespace(first_name='test')),
+                          fetcher=Fetcher(), parser=ParsePool(workers=0))
+    engine.sent = []
+    engine.queue_newest_messages = lambda message, *_: engine.sent.append(message)
+    yield engine
+    engine.pool.shutdown()
+
+
+def poll(engine, result):
+    engine.sent.clear()
+    assert engine.update_feed(URL, engine.db.get_update_url(URL), result) == (True, URL)
+    return len(engine.sent)
+
+
+def test_first_poll_sends_only_the_newest_posts(engine):
+    assert poll(engine, feed(10)) == BatchProcess.FIRST_POSTS
+    assert engine.db.redis.zcard(engine.db._name_seen(URL)) == 10
+    assert poll(engine, feed(10)) == 0
+
+
+def cycle(engine, count):
+    """ New posts queued by one whole feed cycle, fetch and parse included, over a feed of count entries """
+    engine.fetcher.response = response(count)
+    engine.db.schedule_url(URL, 0)
+    engine.sent.clear()
+    engine.parse_parallel()
+    return len(engine.sent)
+
+
+def test_every_new_entry_is_sent_after_a_burst(engine):
+    assert cycle(engine, 10) == BatchProcess.FIRST_POSTS
+    assert cycle(engine, 40) == 30
+    assert cycle(engine, 40) == 0
+
+
+@pytest.mark.parametrize('status', [None, 404, 503])
+def test_failed_fetch_keeps_the_feed_state(engine, status):
+    poll(engine, feed(3))
+    engine.db.update_url_validators(URL, etag='"v1"', digest='d1')
+    result = FeedHandler.parse_response({'url': URL, 'status': status, 'content': b'', 'headers': {},
+                                         'etag': None, 'modified': None})
+
+    assert engine.update_feed(URL, engine.db.get_update_url(URL), result) == (False, URL, 'fetch')
+    assert engine.failed == 1
+    info = engine.db.get_update_url(URL)
+    assert (info['etag'], info['digest']) == ('"v1"', 'd1')
+    assert poll(engine, feed(3)) == 0
+
+
+def test_a_bad_entry_fails_its_feed_not_the_cycle(engine):
+    bad = response(2)
+    engine.fetcher.response = dict(bad, content=bad['content'].replace(b'Mon, 01 Jan 2029', b'someday'))
+    engine.db.schedule_url(URL, 0)
+
+    engine.parse_parallel()
+    assert engine.failed == 1
+    assert engine.db.redis.zscore(engine.db.INDEX_URLS_DUE, URL) > 0
+    assert cycle(engine, 10) == BatchProcess.FIRST_POSTS
@@ -0,0 +1,97 @@
+import pytest
+
+from util.feedhandler import FeedHandler
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('HTTP://Example.COM:80/Feed?b=2&a=1#top', 'http://example.com/Feed?a=1&b=2'),
+    ('https://example.com:443/feed/', 'https://example.com/feed/'),
+    ('example.com/feed', 'http://example.com/feed'),
+    ('http://www.example.com:8080/feed', 'http://www.example.com:8080/feed'),
+])
+def test_canonical_url(url, canonical):
+    assert FeedHandler.canonical_url(url) == canonical
+
+
+def test_loose_identity_only_when_asked():
+    spellings = ['http://www.example.com/feed/', 'https://example.com/feed', 'HTTP://EXAMPLE.com/feed/']
+    assert len({FeedHandler.url_identity(url) for url in spellings}) == 3
+    assert {FeedHandler.url_identity(url, loose=True) for url in spellings} == {'example.com/feed'}
+
+
+def subscriptions(db, url):
+    return sorted(db.redis.smembers(db._index_url(url)))
+
+
+def test_merge_rewrites_spellings_in_canonical_form(db):
+    db.set_name_key(db._name_url_chat(1, 1, 'HTTP://Example.com/feed#x'), {'chat_id': 1, 'user_id': 1,
+                                                                           'disable': 'False'})
+    db.set_url_to_chat(2, 'other', 'http://example.com/feed/', 2)
+    db.build_indexes()
+
+    assert db.merge_urls() == (2, 1, 1)
+    assert subscriptions(db, 'http://example.com/feed') == [db._name_url_chat(1, 1, 'http://example.com/feed')]
+    assert subscriptions(db, 'http://example.com/feed/') == [db._name_url_chat(2, 2, 'http://example.com/feed/')]
+    assert db.merge_urls() == (2, 0, 0)
+
+
+def stored_apart(db, *subscriptions):
+    """ Subscribes each spelling as its own feed, as they were stored before new spellings were resolved """
+    for chat_id, url in subscriptions:
+        db.set_url_to_chat(chat_id, 'chat', url, chat_id)
+        db.redis.delete(db.INDEX_URL_LOOSE)
+
+
+def test_loose_merge_moves_the_feed_state_and_keeps_aliases(db):
+    stored_apart(db, (1, 'http://www.example.com/feed/'), (2, 'https://example.com/feed'))
+    db.update_url('http://www.example.com/feed/', last_update='2029-01-01 00:00:00+00:00', last_url='http://post')
+    db.add_seen_items('http://www.example.com/feed/', ['post'], seen_at=1.0)
+
+    assert db.merge_urls(loose=True) == (1, 1, 1)
+    target = 'https://example.com/feed'
+    assert subscriptions(db, target) == [db._name_url_chat(1, 1, target), db._name_url_chat(2, 2, target)]
+    assert db.get_urls_activated() == [target]
+    assert db.get_update_url(target)['last_url'] == 'http://post'
+    assert db.get_seen_items(target, ['post']) == [True]
+    merged = 'http://www.example.com/feed/'
+    assert not db.redis.exists(db._name_url(merged), db._index_url(merged))
+
+    assert db.resolve_url('HTTP://WWW.example.com/feed/') == target
+    assert db.set_url_to_chat(1, 'me', 'http://www.example.com/feed/', 1) is False
+    assert db.resolve_url('http://example.com/other') == 'http://example.com/other'
+
+
+def test_loose_aliases_survive_rebuilding_the_indexes(db):
+    stored_apart(db, (1, 'http://x.com/feed'), (2, 'https://www.x.com/feed/'))
+    db.merge_urls(loose=True)
+
+    db.build_indexes()
+    assert db.resolve_url('http://x.com/feed') == 'https://www.x.com/feed/'
+    assert db.set_url_to_chat(3, 'new', 'http://x.com/feed', 3) is True
+    assert db.get_urls_activated() == ['https://www.x.com/feed/']
+
+
+def test_new_spellings_join_the_stored_feed(db):
+    assert db.set_url_to_chat(1, 'me', 'http://www.example.com/feed/', 1) is True
+    assert db.set_url_to_chat(2, 'other', 'https://example.com/feed', 2) is True
+    assert db.exist_url_to_chat(2, 2, 'HTTPS://EXAMPLE.com/feed/') is True
+    assert db.get_urls_activated() == ['http://www.example.com/feed/']
+
+    db.build_indexes()
+    assert db.resolve_url('http://example.com/feed') == 'http://www.example.com/feed/'
+    assert db.del_url_for_chat(1, 'https://www.example.com/feed') is True
+    assert db.del_url_for_chat(2, 'http://example.com/feed') is True
+
+    assert db.set_url_to_chat(3, 'new', 'https://example.com/feed', 3) is True
+    assert db.get_urls_activated() == ['https://example.com/feed']
+
+
+def test_the_loose_index_prefers_https_then_subscriptions(db):
+    stored_apart(db, (1, 'http://example.com/feed'), (2, 'http://www.example.com/feed'),
+                 (3, 'http://www.example.com/feed'), (4, 'https://example.com/feed/'))
+    db.build_indexes()
+    assert db.resolve_url('http://example.com/feed/') == 'https://example.com/feed/'
+
+    db.del_url_for_chat(4, 'https://example.com/feed/')
+    db.build_indexes()
+    assert db.resolve_url('https://www.example.com/feed/') == 'http://www.example.com/feed'
@@ -1 +1 @@
-from util import database, feedhandler, datehandler
+from util import database, feedhandler, datehandler, scripts
@@ -0,0 +1,29 @@
+from util import storage
+from util.database import DatabaseHandler
+
+
+class AsyncDatabaseHandler(DatabaseHandler):
+    """
+    asyncio counterpart of DatabaseHandler on redis.asyncio, same public methods as coroutines.
+    The steps are DatabaseHandler's, only the calls they yield are awaited here
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.redis = storage.get_async_storage(db)
+        self._register_scripts()
+
+    '''await every call the steps yield and send its result back, an error is raised where the call was yielded'''
+    @staticmethod
+    async def _run(calls):
+        try:
+            call = next(calls)
+            while True:
+                try:
+                    result = await call
+                except Exception as e:
+                    call = calls.throw(e)
+                else:
+                    call = calls.send(result)
+        except StopIteration as stop:
+            return stop.value
@@ -0,0 +1,14 @@
+from decouple import Csv, config
+
+# name: (redis data base, setting holding the token)
+BOTS = {'oiolabot': (0, 'TOKEN'),
+        'liturgia': (2, 'TOKEN_LD')}
+
+
+def bot_names():
+    """ Bots a process hosts, from BOTS in .env (comma separated names of BOTS above) """
+    names = config('BOTS', default='oiolabot', cast=Csv())
+    unknown = [name for name in names if name not in BOTS]
+    if unknown:
+        raise ValueError(f'unknown bots {", ".join(unknown)}, expected some of {", ".join(sorted(BOTS))}')
+    return names
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from decouple import config
+from redis import BlockingConnectionPool, StrictRedis
+from redis import asyncio as aioredis
+from redis.connection import Connection, UnixDomainSocketConnection
+
+_pools = {}
+_async_pools = {}
+_pools_lock = threading.Lock()
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """
+    BlockingConnectionPool that records how long callers wait for a free connection
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def get_connection(self, *args, **options):
+        time_started = time.monotonic()
+        connection = super().get_connection(*args, **options)
+        waited = time.monotonic() - time_started
+        with self._stats_lock:
+            self.waits += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        return connection
+
+    def stats(self):
+        idle = len([connection for connection in list(self.pool.queue) if connection is not None])
+        created = len(self._connections)
+        with self._stats_lock:
+            waits, wait_time, max_wait_time = self.waits, self.wait_time, self.max_wait_time
+        return {'max_connections': self.max_connections,
+                'created': created,
+                'in_use': created - idle,
+                'idle': idle,
+                'checkouts': waits,
+                'avg_wait_ms': round(wait_time * 1000 / waits, 3) if waits else 0.0,
+                'max_wait_ms': round(max_wait_time * 1000, 3)}
+
+
+def pool_settings(connection_class=Connection, unix_connection_class=UnixDomainSocketConnection):
+    """
+    Connection pool settings read from the environment (.env). REDIS_SOCKET takes
+    precedence over REDIS_HOST and REDIS_PORT when it is set.
+    """
+    settings = {'password': config('REDIS', default=None) or None,
+                'encoding': 'utf-8',
+                'decode_responses': True,
+                'max_connections': config('REDIS_MAX_CONNECTIONS', default=20, cast=int),
+                'timeout': config('REDIS_POOL_TIMEOUT', default=5, cast=float),
+                'socket_timeout': config('REDIS_SOCKET_TIMEOUT', default=5, cast=float),
+                'health_check_interval': config('REDIS_HEALTH_CHECK_INTERVAL', default=30, cast=int)}
+
+    socket_path = config('REDIS_SOCKET', default='')
+    if socket_path:
+        settings.update({'connection_class': unix_connection_class, 'path': socket_path})
+    else:
+        settings.update({'connection_class': connection_class,
+                         'host': config('REDIS_HOST', default='localhost'),
+                         'port': config('REDIS_PORT', default=6379, cast=int),
+                         'socket_connect_timeout': config('REDIS_CONNECT_TIMEOUT', default=2, cast=float),
+                         'socket_keepalive': True})
+    return settings
+
+
+def get_pool(db):
+    """
+    Returns the process wide pool for a redis data base. Every handler on the same
+    data base shares it; handlers on other data bases get their own pool built from
+    the same settings, as a redis connection is bound to one data base.
+    """
+    with _pools_lock:
+        pool = _pools.get(db)
+        if pool is None:
+            pool = InstrumentedConnectionPool(db=db, **pool_settings())
+            _pools[db] = pool
+        return pool
+
+
+def get_redis(db):
+    return StrictRedis(connection_pool=get_pool(db))
+
+
+def get_async_redis(db):
+    """
+    Same as get_redis for redis.asyncio. The pool binds its connections to the event
+    loop that first uses them, so a process should run its async handlers on one loop.
+    """
+    with _pools_lock:
+        pool = _async_pools.get(db)
+        if pool is None:
+            settings = pool_settings(aioredis.Connection, aioredis.UnixDomainSocketConnection)
+            pool = aioredis.BlockingConnectionPool(db=db, **settings)
+            _async_pools[db] = pool
+        return aioredis.StrictRedis(connection_pool=pool)
+
+
+def pool_stats():
+    """
+    Returns the usage of every pool created in this process, by data base
+    """
+    with _pools_lock:
+        pools = dict(_pools)
+    return {db: pool.stats() for db, pool in sorted(pools.items())}
@@ -1,20 +1,172 @@
-from redis import StrictRedis
-from decouple import config
+from redis.exceptions import ResponseError
 
-password = config('REDIS')
+from util import storage
+from util.datehandler import DateHandler
+from util.feedhandler import FeedHandler
+from util.schema import KeySchema, steps
 
 
-class DatabaseHandler(object):
+class DatabaseHandler(KeySchema):
+    """
+    Every data base operation of the bot. The methods are written once as @steps
+    generators that yield the redis calls they need answered: _run answers them at
+    once here, AsyncDatabaseHandler awaits them instead
+    """
 
     def __init__(self, db):
+        self.db = db
+        self.redis = storage.get_storage(db)
+        self._register_scripts()
 
-        self.redis = StrictRedis(host='localhost',
-                                 port=6379,
-                                 password=password,
-                                 charset='utf-8',
-                                 decode_responses=True,
-                                 db=db
-                                 )
+    '''answer every call the steps yield with its result, return what the steps return'''
+    @staticmethod
+    def _run(calls):
+        try:
+            result = next(calls)
+            while True:
+                result = calls.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    '''register the lifecycle scripts, they run through EVALSHA'''
+    def _register_scripts(self):
+        self._subscribe = self.redis.register_script(self.SCRIPTS['subscribe'])
+        self._unsubscribe = self.redis.register_script(self.SCRIPTS['unsubscribe'])
+        self._disable_chat = self.redis.register_script(self.SCRIPTS['disable_chat'])
+        self._transfer_owner = self.redis.register_script(self.SCRIPTS['transfer_owner'])
+        self._register_group = self.redis.register_script(self.SCRIPTS['register_group'])
+        self._pop_due = self.redis.register_script(self.SCRIPTS['pop_due'])
+        self._pop_digests = self.redis.register_script(self.SCRIPTS['pop_digests'])
+        self._pop_due_shards = self.redis.register_script(self.SCRIPTS['pop_due_shards'])
+        self._renew_leases = self.redis.register_script(self.SCRIPTS['renew_leases'])
+        self._release_leases = self.redis.register_script(self.SCRIPTS['release_leases'])
+        self._requeue_outbox = self.redis.register_script(self.SCRIPTS['requeue_outbox'])
+        self._reserve_rate = self.redis.register_script(self.SCRIPTS['reserve_rate'])
+        self._block_rate = self.redis.register_script(self.SCRIPTS['block_rate'])
+
+    '''add a subscription to the url, user and chat indexes'''
+    def _index_add(self, name):
+        user_id, chat_id, url = self._split_name_url_chat(name)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.sadd(self._index_url(url), name)
+        pipe.sadd(self._index_user(user_id), name)
+        pipe.sadd(self._index_chat(chat_id), name)
+        yield pipe.execute()
+
+    '''keep url in index:urls_activated while any of its subscriptions is enabled'''
+    def _index_url_activated(self, url):
+        names = yield self.redis.smembers(self._index_url(url))
+        pipe = self.redis.pipeline(transaction=False)
+        if self._url_is_activated((yield from self._get_value_names_key(names, 'disable'))):
+            pipe.sadd(self.INDEX_URLS_ACTIVATED, url)
+            pipe.zadd(self.INDEX_URLS_DUE, {url: 0}, nx=True)
+        else:
+            pipe.srem(self.INDEX_URLS_ACTIVATED, url)
+            pipe.zrem(self.INDEX_URLS_DUE, url)
+        yield pipe.execute()
+
+    '''rebuild all index sets from the user_url names stored in data base'''
+    @steps
+    def build_indexes(self):
+        yield from self._del_names((yield from self._find('index:*')))
+        names = yield from self._find('user_url:*')
+        for name in names:
+            yield from self._index_add(name)
+        urls = self.extract_url_from_names(names)
+        for url in urls:
+            yield from self._index_url_activated(url)
+        yield from self._index_url_loose(urls)
+        return len(names)
+
+    '''the spelling a feed is preferred in: https when any spelling has it, then the one with most subscriptions'''
+    @staticmethod
+    def _preferred_url(url, subscriptions):
+        return FeedHandler.canonical_url(url).startswith('https:'), subscriptions, url
+
+    '''point the loose identity of the urls to the spelling new subscriptions of it resolve to'''
+    def _index_url_loose(self, urls):
+        pipe = self.redis.pipeline(transaction=False)
+        for url in urls:
+            pipe.scard(self._index_url(url))
+        subscriptions = dict(zip(urls, (yield pipe.execute())))
+        identities = {}
+        for url in sorted(urls, key=lambda url: self._preferred_url(url, subscriptions[url])):
+            identities[FeedHandler.url_identity(url, loose=True)] = url
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(self.INDEX_URL_LOOSE)
+        if identities:
+            pipe.hset(self.INDEX_URL_LOOSE, mapping=identities)
+        yield pipe.execute()
+
+    '''rewrite every url in its canonical spelling, merging the spellings of one feed, return (feeds, merged, moved);
+    loose also merges http/https, www and trailing slash spellings and keeps the merged ones as aliases'''
+    @steps
+    def merge_urls(self, loose=False):
+        names = yield from self._find('user_url:*')
+        urls = set(self.extract_url_from_names(names)) | \
+            {name[len('url:^'):-1] for name in (yield from self._find('url:^*'))}
+        stale = [alias for alias in (yield self.redis.hkeys(self.URL_ALIASES))
+                 if alias != FeedHandler.canonical_url(alias)]
+        if stale:
+            yield self.redis.hdel(self.URL_ALIASES, *stale)
+        spellings = {}
+        for url in urls:
+            spellings.setdefault(FeedHandler.url_identity(url, loose), []).append(url)
+        merged = moved = 0
+        for identity, group in sorted(spellings.items()):
+            pipe = self.redis.pipeline(transaction=False)
+            for url in group:
+                pipe.scard(self._index_url(url))
+            subscriptions = dict(zip(group, (yield pipe.execute())))
+            chosen = max(group, key=lambda url: self._preferred_url(url, subscriptions[url]))
+            target = FeedHandler.canonical_url(chosen)
+            for url in group:
+                if url != target:
+                    moved += yield from self._move_url(url, target)
+                    merged += 1
+                if FeedHandler.canonical_url(url) != target:
+                    yield self.redis.hset(self.URL_ALIASES, FeedHandler.canonical_url(url), target)
+        yield from self._index_url_loose(self.extract_url_from_names((yield from self._find('user_url:*'))))
+        return len(spellings), merged, moved
+
+    '''move the subscriptions, feed state and seen entries of url to target, return the subscriptions moved'''
+    def _move_url(self, url, target):
+        moved = 0
+        names = sorted((yield self.redis.smembers(self._index_url(url))))
+        # read them all first, unsubscribing a chat drops every subscription of url in that chat
+        subscriptions = zip(names, (yield from self._get_all_keys_for_names(names)))
+        for name, fields in subscriptions:
+            user_id, chat_id, _ = self._split_name_url_chat(name)
+            name_target = self._name_url_chat(user_id, chat_id, target)
+            if fields and not (yield self.redis.exists(name_target)):
+                keys, args = self._subscribe_call(chat_id, fields.get('chat_name', ''), target, user_id)
+                yield self._subscribe(keys=keys, args=args)
+                yield self.redis.hset(name_target, mapping=fields)
+                moved += 1
+        # before unsubscribing, the last unsubscription drops the seen set of url
+        seen = yield self.redis.zrangebyscore(self._name_seen(url), '-inf', '+inf', withscores=True)
+        if seen:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zadd(self._name_seen(target), dict(seen))
+            pipe.zremrangebyrank(self._name_seen(target), 0, -self.SEEN_ITEMS - 1)
+            yield pipe.execute()
+        for chat_id in sorted({self._split_name_url_chat(name)[1] for name in names}):
+            keys, args = self._unsubscribe_call(chat_id, url)
+            yield self._unsubscribe(keys=keys, args=args)
+
+        info, info_target = yield from self._get_all_keys_for_names([self._name_url(url), self._name_url(target)])
+        last_update = info.get('last_update', self.DEFAULT_LAST_UPDATE)
+        if not info_target or DateHandler.parse_datetime(last_update) > \
+                DateHandler.parse_datetime(info_target.get('last_update', self.DEFAULT_LAST_UPDATE)):
+            if info:
+                yield self.redis.hset(self._name_url(target), mapping=info)
+        yield from self._del_names([self._name_url(url), self._name_seen(url), self._index_url(url)])
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.srem(self.INDEX_URLS_ACTIVATED, url)
+        pipe.zrem(self.INDEX_URLS_DUE, url)
+        yield pipe.execute()
+        yield from self._index_url_activated(target)
+        return moved
 
     '''find names for argument in data base '''
     def _find(self, search):
@@ -23,167 +175,409 @@ class DatabaseHandler(object):
         while cursor != 0:
             if cursor is None:
                 cursor = 0
-            fined = self.redis.scan(cursor, str(search))
+            fined = yield self.redis.scan(cursor, str(search))
             cursor = fined[0]
             names.extend(fined[1])
         return names
 
+    @steps
     def find_names(self, find):
         search = '*' + find + '*'
-        return self._find(search)
+        return (yield from self._find(search))
 
+    @steps
     def exist_name(self, name):
-        return True if self.redis.exists(name) else False
+        return True if (yield self.redis.exists(name)) else False
 
+    @steps
     def exist_key(self, name, key):
-        return self.redis.hexists(name, key)
+        return (yield self.redis.hexists(name, key))
 
+    @steps
     def get_value_name_key(self, name, key):
-        return self.redis.hget(name, key)
+        return (yield self.redis.hget(name, key))
 
+    @steps
     def get_all_keys_for_name(self, name):
-        keys = self.redis.hgetall(name)
+        keys = yield self.redis.hgetall(name)
         return keys if keys else None
 
+    @steps
     def get_keys_for_name(self, name, *args):
-        keys = self.redis.hmget(name, *args)
+        keys = yield self.redis.hmget(name, *args)
         return keys if keys else None
 
+    '''read the same key from many names in one round trip'''
+    def _get_value_names_key(self, names, key):
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hget(name, key)
+        return (yield pipe.execute())
+
+    @steps
+    def get_value_names_key(self, names, key):
+        return (yield from self._get_value_names_key(names, key))
+
+    '''read many hashes in one round trip'''
+    def _get_all_keys_for_names(self, names):
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(name)
+        return (yield pipe.execute())
+
+    @steps
+    def get_all_keys_for_names(self, names):
+        return (yield from self._get_all_keys_for_names(names))
+
     '''set a name and key on database'''
+    def _set_name_key(self, name, mapping):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(name=name, mapping=mapping)
+        pipe.exists(name)
+        return bool((yield pipe.execute())[-1])
+
+    @steps
     def set_name_key(self, name, mapping: dict):
-        self.redis.hset(name=name, mapping=mapping)
-        return bool(self.exist_name(name))
+        return (yield from self._set_name_key(name, mapping))
 
-    '''set a name and key on database'''
+    '''delete names on database'''
+    def _del_names(self, names):
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.delete(name)
+        return (yield pipe.execute())
+
+    @steps
     def del_names(self, names: list):
-        return [self.redis.delete(name) for name in names]
+        return (yield from self._del_names(names))
 
     '''check if group exist'''
+    @steps
     def exist_group(self, chat_id):
-        name = 'group:' + str(chat_id)
-        return self.exist_name(name)
+        return True if (yield self.redis.exists(self._name_group(chat_id))) else False
 
+    '''move all subscriptions of a chat to a new owner, return how many were moved'''
+    @steps
     def update_owner(self, chat_id, user_id):
-        names = self._find('user_url:*' + str(chat_id) + '*')
-        for name in names:
-            name_update = name.split(':')
-            name_update[1] = str(user_id)
-            name_update = ';'.join(name_update)
-            self.redis.rename(name, name_update)
+        keys, args = self._transfer_owner_call(chat_id, user_id)
+        return (yield self._transfer_owner(keys=keys, args=args))
 
-    '''register or update a url with las_url and last_update'''
+    '''register or update a group and optionally move its subscriptions to the new owner'''
+    @steps
     def update_group(self, chat_id, chat_name, chat_title, user_id, update_owner=None):
-        name = 'group:' + str(chat_id)
-        mapping = {'chat_adm': str(user_id),
-                   'chat_id': str(chat_id),
-                   'chat_lock': 'True',
-                   'chat_name': chat_name,
-                   'chat_title': str(chat_title)}
-        if update_owner:
-            self.update_owner(chat_id, user_id)
-
-        return True if self.set_name_key(name=name, mapping=mapping) else False
+        keys, args = self._register_group_call(chat_id, chat_name, chat_title, user_id, update_owner)
+        return True if (yield self._register_group(keys=keys, args=args)) else False
 
     '''check if url exist'''
+    @steps
     def exist_url(self, url):
-        name = 'url:^' + str(url) + '^'
-        return self.exist_name(name)
+        name = self._name_url((yield from self._resolve_url(url)))
+        return True if (yield self.redis.exists(name)) else False
 
     '''register or update a url with las_url and last_update'''
-    def update_url(self, url, last_update='2000-01-01 00:00:00+00:00', last_url='http://www.exemplo.com'):
-        name = 'url:^' + str(url) + '^'
-        mapping = {'last_update': str(last_update), 'last_url': last_url}
-        return True if self.set_name_key(name=name, mapping=mapping) else False
+    @steps
+    def update_url(self, url, last_update=KeySchema.DEFAULT_LAST_UPDATE, last_url=KeySchema.DEFAULT_LAST_URL):
+        name = self._name_url(url)
+        mapping = self._url_mapping(last_update, last_url)
+        return (yield from self._set_name_key(name, mapping))
+
+    '''store the etag and modified validators and the body digest of the last fetch of a url'''
+    @steps
+    def update_url_validators(self, url, etag=None, modified=None, digest=None):
+        mapping = {'etag': etag or '', 'modified': modified or '', 'digest': digest or ''}
+        return (yield self.redis.hset(self._name_url(url), mapping=mapping))
 
     '''check if url exist in chat'''
+    @steps
     def exist_url_to_chat(self, user_id, chat_id, url):
-        name = 'user_url:' + str(user_id) + ':chat_id:' + str(chat_id) + ':^' + str(url) + '^'
-        return self.exist_name(name)
+        name = self._name_url_chat(user_id, chat_id, (yield from self._resolve_url(url)))
+        return True if (yield self.redis.exists(name)) else False
+
+    '''the spelling url is stored with: the feed a loose merge moved it to, the feed stored under its loose
+    identity, or its canonical form'''
+    def _resolve_url(self, url):
+        canonical = FeedHandler.canonical_url(url)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(self.URL_ALIASES, canonical)
+        pipe.hget(self.INDEX_URL_LOOSE, FeedHandler.url_identity(canonical, loose=True))
+        alias, loose = yield pipe.execute()
+        if alias:
+            return alias
+        # the loose index may still name a feed whose last subscription was dropped
+        if loose and loose != canonical and (yield self.redis.scard(self._index_url(loose))):
+            return loose
+        return canonical
+
+    @steps
+    def resolve_url(self, url):
+        return (yield from self._resolve_url(url))
 
     '''register a url for user or group'''
+    @steps
     def set_url_to_chat(self, chat_id, chat_name, url, user_id):
-        name_url = self.exist_url(url)
-        if not name_url:
-            self.update_url(url=url)
-
-        name_url_chat = self.exist_url_to_chat(user_id, chat_id, url)
-        if not name_url_chat:
-            name = 'user_url:' + str(user_id) + ':chat_id:' + str(chat_id) + ':^' + str(url) + '^'
-            mapping = {'chat_id': str(chat_id), 'chat_name': chat_name, 'user_id': str(user_id), 'disable': 'False'}
-            return True if self.set_name_key(name=name, mapping=mapping) else False
-        else:
-            return False
-
-    '''extract url for name'''
-    @staticmethod
-    def extract_url_from_names(names):
-        if names:
-            uncompress_name = [name.split('^') for name in names]
-            urls = sorted(set(['{}'.format(url[1]) for url in uncompress_name]))
-            return urls
-        return ()
+        url = yield from self._resolve_url(url)
+        keys, args = self._subscribe_call(chat_id, chat_name, url, user_id)
+        subscribed = yield self._subscribe(keys=keys, args=args)
+        yield self.redis.hset(self.INDEX_URL_LOOSE, FeedHandler.url_identity(url, loose=True), url)
+        return True if subscribed else False
 
     '''return all url for a chat_id'''
+    @steps
     def get_chat_urls(self, user_id):
-        names = self._find('user_url:' + str(user_id) + ':*')
-        chat_urls = []
-        for name in names:
-            keys = self.get_all_keys_for_name(name)
-            chat_id = keys.get('chat_id')
-            chat_name = keys.get('chat_name')
-            user_id = keys.get('user_id')
-            url = self.extract_url_from_names([name])[0]
-
-            mapping = {'user_id': str(user_id), 'chat_name': chat_name, 'url': url, 'chat_id': str(chat_id)}
-            chat_urls.append(mapping)
-        return chat_urls
+        names = sorted((yield self.redis.smembers(self._index_user(user_id))))
+        return self._chat_urls(names, (yield from self._get_all_keys_for_names(names)))
 
     '''return info about last update url'''
+    @steps
     def get_update_url(self, url):
-        name = 'url:^' + str(url) + '^'
-        if self.exist_name(name):
-            keys = self.get_all_keys_for_name(name)
-            last_update = keys.get('last_update')
-            last_url = keys.get('last_url')
-            return {'last_update': last_update, 'last_url': last_url}
-        return False
+        return self._update_url_info((yield self.redis.hgetall(self._name_url(url))))
+
+    '''return info about last update of many urls in one round trip'''
+    @steps
+    def get_update_urls(self, urls):
+        hashes = yield from self._get_all_keys_for_names([self._name_url(url) for url in urls])
+        return [self._update_url_info(keys) for keys in hashes]
 
     '''return all url activated'''
+    @steps
     def get_urls_activated(self):
-        names = self._find('user_url*')
-        active_keys = sorted(set([name for name in names if not self.get_value_name_key(name, 'disable') == 'True']))
-        return self.extract_url_from_names(active_keys)
-
-    '''return names for key 'disable' = 'True' from url'''
+        return sorted((yield self.redis.smembers(self.INDEX_URLS_ACTIVATED)))
+
+    '''return the activated urls due at now, they are pushed to next_due until rescheduled'''
+    @steps
+    def pop_urls_due(self, now, next_due):
+        keys, args = self._pop_due_call(now, next_due)
+        return (yield self._pop_due(keys=keys, args=args))
+
+    '''pop the due urls of the owned shards and schedule them to next_due'''
+    @steps
+    def pop_urls_due_shards(self, now, next_due, shards, owned):
+        if not owned:
+            return []
+        keys, args = self._pop_due_shards_call(now, next_due, shards, owned)
+        return (yield self._pop_due_shards(keys=keys, args=args))
+
+    '''record that worker is alive, return how many workers are'''
+    @steps
+    def heartbeat_worker(self, worker, now, ttl):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(self.LEASE_WORKERS, {worker: now})
+        pipe.zremrangebyscore(self.LEASE_WORKERS, '-inf', now - ttl)
+        pipe.zcard(self.LEASE_WORKERS)
+        return (yield pipe.execute())[-1]
+
+    @steps
+    def remove_worker(self, worker):
+        return (yield self.redis.zrem(self.LEASE_WORKERS, worker))
+
+    '''take the leases of the free shards among shards, return the ones taken'''
+    @steps
+    def acquire_leases(self, worker, shards, ttl):
+        pipe = self.redis.pipeline(transaction=False)
+        for shard in shards:
+            pipe.set(self._name_lease(shard), worker, nx=True, px=int(ttl * 1000))
+        return [shard for shard, acquired in zip(shards, (yield pipe.execute())) if acquired]
+
+    '''extend the leases worker still holds among shards, return those'''
+    @steps
+    def renew_leases(self, worker, shards, ttl):
+        if not shards:
+            return []
+        keys, args = self._leases_call(worker, shards, ttl)
+        return [shard for shard, owned in zip(shards, (yield self._renew_leases(keys=keys, args=args))) if owned]
+
+    @steps
+    def release_leases(self, worker, shards):
+        if not shards:
+            return 0
+        keys, args = self._leases_call(worker, shards)
+        return (yield self._release_leases(keys=keys, args=args))
+
+    '''take a turn in the (bucket, messages per second) rate limits of the bot, return the seconds to wait'''
+    @steps
+    def reserve_rate(self, limits):
+        keys, args = self._reserve_rate_call(limits)
+        return float((yield self._reserve_rate(keys=keys, args=args)))
+
+    '''hold every message of the rate buckets for seconds'''
+    @steps
+    def block_rate(self, buckets, seconds):
+        keys, args = self._block_rate_call(buckets, seconds)
+        return (yield self._block_rate(keys=keys, args=args))
+
+    '''schedule the next poll of an activated url'''
+    @steps
+    def schedule_url(self, url, due):
+        return (yield self.redis.zadd(self.INDEX_URLS_DUE, {url: float(due)}, xx=True))
+
+    '''store the learned poll interval and publish history of a url and schedule its next poll'''
+    @steps
+    def set_url_poll(self, url, poll_interval, publish_history, due):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._name_url(url), mapping={'poll_interval': str(poll_interval),
+                                                'publish_history': publish_history})
+        pipe.zadd(self.INDEX_URLS_DUE, {url: float(due)}, xx=True)
+        return (yield pipe.execute())
+
+    '''return poll interval, publish history and next due timestamp of a url'''
+    @steps
+    def get_url_poll(self, url):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(self._name_url(url), 'poll_interval', 'publish_history')
+        pipe.zscore(self.INDEX_URLS_DUE, url)
+        (poll_interval, publish_history), due = yield pipe.execute()
+        return {'poll_interval': poll_interval, 'publish_history': publish_history, 'due': due}
+
+    '''tell for each entry key whether it was seen for url, None while url has no seen items'''
+    @steps
+    def get_seen_items(self, url, keys):
+        pipe = self.redis.pipeline(transaction=False)
+        name = self._name_seen(url)
+        pipe.zcard(name)
+        for key in keys:
+            pipe.zscore(name, key)
+        return self._seen_items((yield pipe.execute()))
+
+    '''mark entry keys as seen for url, keeping only the newest SEEN_ITEMS'''
+    @steps
+    def add_seen_items(self, url, keys, seen_at):
+        pipe = self.redis.pipeline(transaction=False)
+        name = self._name_seen(url)
+        # entries later in keys rank newer, so the oldest are evicted first
+        pipe.zadd(name, {key: seen_at + index / 1000 for index, key in enumerate(keys)})
+        pipe.zremrangebyrank(name, 0, -self.SEEN_ITEMS - 1)
+        return (yield pipe.execute())
+
+    '''return names for key 'disable' = 'False' from url'''
+    @steps
     def get_names_for_user_activated(self, url):
-        names = self._find('user_url*' + url + '*')
-
-        # name = 'user_url:26072030:chat_id:26072030:^http://g1.globo.com/dynamo/economia/rss2.xml^'
-        # print(self.get_value_name_key(name, 'disable') == 'False')
-
-        active_names = sorted(set([name for name in names if self.get_value_name_key(name, 'disable') == 'False']))
-        return active_names
+        names = sorted((yield self.redis.smembers(self._index_url(url))))
+        return self._active_names(names, (yield from self._get_value_names_key(names, 'disable')))
+
+    '''return the digest window and threshold of the chats that have digest mode on'''
+    @steps
+    def get_digest_settings(self, chat_ids):
+        pipe = self.redis.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            pipe.hmget(self._name_group(chat_id), 'digest_window', 'digest_threshold')
+        return self._digest_settings(chat_ids, (yield pipe.execute()))
+
+    '''hold a post for the digest of chats, each digest is due a window after its first post'''
+    @steps
+    def buffer_digests(self, url, text, windows, now):
+        pipe = self.redis.pipeline(transaction=True)
+        for chat_id, window in windows.items():
+            pipe.rpush(self._name_digest(chat_id), self._digest_entry(url, text))
+            pipe.zadd(self.DIGESTS_DUE, {str(chat_id): now + window}, nx=True)
+        return (yield pipe.execute())
+
+    '''take the posts of every digest that is due'''
+    @steps
+    def pop_digests_due(self, now):
+        keys, args = self._pop_digests_call(now)
+        return self._digests((yield self._pop_digests(keys=keys, args=args)))
+
+    '''create the consumer group of the outbox stream, if it does not exist yet'''
+    @steps
+    def create_outbox_group(self):
+        try:
+            return (yield self.redis.xgroup_create(self.STREAM_OUTBOX, self.OUTBOX_GROUP, id='0', mkstream=True))
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+            return False
 
-    '''return all url activated'''
+    '''queue a message to every chat in the outbox stream'''
+    @steps
+    def queue_messages(self, url, text, chat_ids):
+        pipe = self.redis.pipeline(transaction=False)
+        for entry in self._outbox_entries(url, text, chat_ids):
+            pipe.xadd(self.STREAM_OUTBOX, entry)
+        return (yield pipe.execute())
+
+    '''read outbox messages for a consumer, start '>' for new ones or '0' for its own pending ones'''
+    @steps
+    def read_outbox(self, consumer, count, block=None, start='>'):
+        response = yield self.redis.xreadgroup(self.OUTBOX_GROUP, consumer, {self.STREAM_OUTBOX: start},
+                                               count=count, block=block)
+        return self._stream_messages(response[0][1] if response else [])
+
+    '''take over outbox messages left pending by another consumer for longer than min_idle ms'''
+    @steps
+    def claim_outbox(self, consumer, min_idle, count):
+        response = yield self.redis.xautoclaim(self.STREAM_OUTBOX, self.OUTBOX_GROUP, consumer, min_idle, count=count)
+        return self._stream_messages(response[1])
+
+    '''acknowledge delivered outbox messages and drop them from the stream'''
+    @steps
+    def ack_outbox(self, message_ids):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(self.STREAM_OUTBOX, self.OUTBOX_GROUP, *message_ids)
+        pipe.xdel(self.STREAM_OUTBOX, *message_ids)
+        return (yield pipe.execute())
+
+    '''hold an outbox message with one more attempt until due, when requeue_outbox queues it again'''
+    @steps
+    def retry_outbox(self, message_id, fields, due):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(self.STREAM_OUTBOX, self.OUTBOX_GROUP, message_id)
+        pipe.xdel(self.STREAM_OUTBOX, message_id)
+        pipe.hset(self._name_retry(message_id),
+                  mapping=dict(fields, attempts=str(int(fields.get('attempts', 0)) + 1)))
+        pipe.zadd(self.OUTBOX_RETRY, {message_id: float(due)})
+        return (yield pipe.execute())
+
+    '''queue again the outbox messages whose retry is due, return how many'''
+    @steps
+    def requeue_outbox(self, now):
+        keys, args = self._requeue_outbox_call(now)
+        return (yield self._requeue_outbox(keys=keys, args=args))
+
+    '''move an outbox message that can not be delivered to the dead letter stream'''
+    @steps
+    def dead_letter_outbox(self, message_id, fields, error):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(self.STREAM_OUTBOX, self.OUTBOX_GROUP, message_id)
+        pipe.xdel(self.STREAM_OUTBOX, message_id)
+        pipe.xadd(self.STREAM_DEAD, dict(fields, error=str(error)), maxlen=self.DEAD_LETTERS)
+        return (yield pipe.execute())
+
+    '''return the number of queued, dead letter and retrying outbox messages'''
+    @steps
+    def get_outbox_length(self):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xlen(self.STREAM_OUTBOX)
+        pipe.xlen(self.STREAM_DEAD)
+        pipe.zcard(self.OUTBOX_RETRY)
+        queued, dead, retrying = yield pipe.execute()
+        return {'queued': queued, 'dead': dead, 'retrying': retrying}
+
+    '''return the chat ids of the enabled subscriptions of a url, once each'''
+    @steps
+    def get_chat_ids_activated(self, url):
+        names = sorted((yield self.redis.smembers(self._index_url(url))))
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hmget(name, 'disable', 'chat_id')
+        return self._active_chat_ids((yield pipe.execute()))
 
+    '''return the chat_id of a chat_name subscribed by user'''
+    @steps
     def get_chat_id_for_chat_name(self, user_id, chat_name):
-        names = self._find('user_url:*' + str(user_id) + '*')
+        names = sorted((yield self.redis.smembers(self._index_user(user_id))))
+        pipe = self.redis.pipeline(transaction=False)
         for name in names:
-            chat_name_db = self.get_value_name_key(name, 'chat_name')
-            chat_id_db = self.get_value_name_key(name, 'chat_id')
-            if chat_name_db == chat_name and chat_id_db:
-                return chat_id_db
-        return None
+            pipe.hmget(name, 'chat_name', 'chat_id')
+        return self._chat_id_for_chat_name(chat_name, (yield pipe.execute()))
 
     '''disable url for chat'''
+    @steps
     def disable_url_chat(self, chat_id):
-        names = self._find('user_url:*chat_id:' + str(chat_id) + '*')
-        mapping = {'disable': 'True'}
-        disables = [self.set_name_key(name=name, mapping=mapping) for name in names] if names else []
-        return disables
-        # return [disable[1] for disable in disables if disable[0]]
+        keys, args = self._disable_chat_call(chat_id)
+        return (yield self._disable_chat(keys=keys, args=args))
 
+    @steps
     def del_url_for_chat(self, chat_id, url):
-        names = self._find('user_url:*' + str(chat_id) + '*' + url + '*')
-        result = self.del_names(names)
-        return True if result[0] == 1 else None
+        keys, args = self._unsubscribe_call(chat_id, (yield from self._resolve_url(url)))
+        result = yield self._unsubscribe(keys=keys, args=args)
+        return True if result else None
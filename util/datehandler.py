@@ -1,29 +1,59 @@
 import pytz
 import datetime
+import re
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
 from dateutil import parser
 
 
 class DateHandler:
     datetime = datetime.datetime
+    TIMEZONE = pytz.timezone("America/Belem")
+    RFC822 = re.compile(r'(?:[A-Za-z]{3}, *)?\d{1,2} [A-Za-z]{3} \d{2,4} \d{1,2}:\d{2}(?::\d{2})?(?: [+-]?\w+)?\Z')
 
     @staticmethod
     def get_datetime_now():
-        # Strip seconds from datetime
-        date_string = str(
-            datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
-        naive_date = datetime.datetime.utcnow().strptime(date_string, "%Y-%m-%d %H:%M:%S")
+        # Strip microseconds from datetime
+        naive_date = datetime.datetime.utcnow().replace(microsecond=0)
 
         # Make datetime aware of timezone
         aware_date = pytz.utc.localize(naive_date)
-        result = aware_date.astimezone(pytz.timezone("America/Belem"))
+        result = aware_date.astimezone(DateHandler.TIMEZONE)
         return result
 
     @staticmethod
+    def _parse_fast(date_time):
+        """
+        Parses the shapes feeds use almost always, ISO 8601 (Atom, and last_update as
+        stored in the data base) and RFC 822 (RSS). Returns None for anything else
+        """
+        if not isinstance(date_time, str):
+            return None
+        date_time = date_time.strip()
+        if date_time[:4].isdigit():
+            try:
+                if date_time.endswith(('Z', 'z')):
+                    date_time = date_time[:-1] + '+00:00'
+                return datetime.datetime.fromisoformat(date_time)
+            except ValueError:
+                return None
+        if not DateHandler.RFC822.match(date_time):
+            return None
+        try:
+            return parsedate_to_datetime(date_time)
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    @staticmethod
+    @lru_cache(maxsize=16384)
     def parse_datetime(date_time):
-        result = parser.parse(date_time)
+        result = DateHandler._parse_fast(date_time)
+        if result is None:
+            result = parser.parse(date_time)
 
         if result.tzinfo is None:
             aware_date = pytz.utc.localize(result)
-            result = aware_date.astimezone(pytz.timezone("America/Belem"))
+            result = aware_date.astimezone(DateHandler.TIMEZONE)
 
         return result
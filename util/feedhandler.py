@@ -1,34 +1,163 @@
 import logging
+from hashlib import blake2b
+from html import escape
 
 import feedparser
 import re
+from urllib.parse import urlsplit, urlunsplit
+
+# what a message can be cut between: tags, entities, breaks and runs of other characters
+MESSAGE_TOKENS = re.compile(r'<[^<>]*>|&#?\w+;|\n\n|\n| |[^<&\n ]{1,64}|.', re.DOTALL)
+HTML_TAG = re.compile(r'<(/?)([a-zA-Z][\w-]*)')
+# cuts after a paragraph break are preferred to cuts after a line break, then a space
+BREAK_LEVELS = {'\n\n': 3, '\n': 2, ' ': 1}
 
 
 class FeedHandler(object):
 
+    COMPACT_FIELDS = ('title', 'link', 'published', 'id', 'summary')
+    MESSAGE_LIMIT = 4096
+
     @staticmethod
-    def parse_feed(url, entries=4, modified=None):
-        """
-        Parses the given url, returns a list containing all available entries
-        """
-        if 1 <= entries <= 10:
-            feeds = feedparser.parse(url, modified=modified).entries[:entries]
-            if url == 'http://feeds.feedburner.com/evangelhoddia/dia':
-                for f in feeds:
-                    f['published'] = f['id'][:10] + ' ' + '06:00:00'
-                    f['link'] = f['link'] + f['id'][:10]
-                    f['daily_liturgy'] = f['summary']
-                feeds.reverse()
-                return feeds
-            else:
-                feed = feeds[:entries]
-                feed.reverse()
-                return feed
+    def parse_response(response):
+        """
+        Parses a response downloaded by FeedFetcher into a feedparser result, with
+        status, etag and modified set from the HTTP response
+        """
+        if response['status'] == 304 or not response['content']:
+            result = feedparser.FeedParserDict(entries=[], bozo=response['status'] is None)
         else:
-            feed = feedparser.parse(url, modified=modified).entries[:4]
+            result = feedparser.parse(response['content'], response_headers=response['headers'])
+        result['href'] = response['url']
+        if response['status'] is not None:
+            result['status'] = response['status']
+        for key in ('etag', 'modified'):
+            if response[key]:
+                result[key] = response[key]
+        return result
+
+    @staticmethod
+    def content_digest(content):
+        """
+        BLAKE2 digest of a fetched body, None when there is no body
+        """
+        return blake2b(content, digest_size=16).hexdigest() if content else None
+
+    @staticmethod
+    def entry_key(post):
+        """
+        Short stable key of an entry, from its id or else its link
+        """
+        return blake2b(str(post.get('id') or post.get('link')).encode(), digest_size=8).hexdigest()
+
+    @staticmethod
+    def compact_result(result, entries=None):
+        """
+        Keeps only what the feed cycle reads from a result: status, validators and
+        the COMPACT_FIELDS of the first entries (all when None), as plain dicts cheap to pickle
+        """
+        compact = {key: result[key] for key in ('href', 'status', 'etag', 'modified', 'bozo') if key in result}
+        compact['entries'] = [{field: entry[field] for field in FeedHandler.COMPACT_FIELDS if field in entry}
+                              for entry in result.entries[:entries]]
+        return compact
+
+    @staticmethod
+    def expand_result(compact):
+        """
+        Turns a compact result back into a feedparser result
+        """
+        result = feedparser.FeedParserDict(compact)
+        result['entries'] = [feedparser.FeedParserDict(entry) for entry in compact['entries']]
+        return result
+
+    @staticmethod
+    def parse_feed(url, entries=4, modified=None, result=None):
+        """
+        Parses the given url, returns its newest entries (all of them when entries is
+        None), oldest first. An already fetched result is used instead of fetching url again
+        """
+        if result is None:
+            result = feedparser.parse(url, modified=modified)
 
-        feed.reverse()
-        return feed
+        feeds = list(result.entries if entries is None else result.entries[:entries])
+        if url == 'http://feeds.feedburner.com/evangelhoddia/dia':
+            for f in feeds:
+                f['published'] = f['id'][:10] + ' ' + '06:00:00'
+                f['link'] = f['link'] + f['id'][:10]
+                f['daily_liturgy'] = f['summary']
+
+        feeds.reverse()
+        return feeds
+
+    @staticmethod
+    def render_post(post, variant):
+        """
+        Message text of a post for parse_mode html, variant liturgy carries the daily
+        liturgy text instead of the link
+        """
+        if variant == 'liturgy':
+            return escape(post.title) + '\n' + post.daily_liturgy
+        return escape(post.title) + '\n' + escape(post.link)
+
+    @staticmethod
+    def split_message(text, limit=MESSAGE_LIMIT):
+        """
+        Cuts an html message longer than limit into parts that fit, at a paragraph,
+        line or word break when one is close enough, never inside a tag or an entity.
+        The tags open at a cut are closed before it and opened again after it
+        """
+        if len(text) <= limit:
+            return [text]
+        tokens = []
+        opened = []
+        for token in MESSAGE_TOKENS.findall(text):
+            tag = HTML_TAG.match(token)
+            if tag and tag.group(1):
+                names = [name for name, _ in opened]
+                if tag.group(2).lower() in names:
+                    del opened[len(names) - 1 - names[::-1].index(tag.group(2).lower())]
+            elif tag and not token.endswith('/>'):
+                opened.append((tag.group(2).lower(), token))
+            tokens.append((token, list(opened)))
+
+        parts = []
+        start = 0
+        while start < len(tokens):
+            reopen = ''.join(tag for _, tag in (tokens[start - 1][1] if start else []))
+            size, end, cuts = len(reopen), start, []
+            while end < len(tokens):
+                token, opened = tokens[end]
+                close = sum(len(name) + 3 for name, _ in opened)
+                if end > start and size + len(token) + close > limit:
+                    break
+                size, end = size + len(token), end + 1
+                cuts.append((BREAK_LEVELS.get(token, 0) if size >= limit // 2 else 0, end))
+            if end < len(tokens):
+                end = max(cuts)[1]
+            body = ''.join(token for token, _ in tokens[start:end]).strip()
+            close = ''.join(f'</{name}>' for name, _ in reversed(tokens[end - 1][1]))
+            if body:
+                parts.append(reopen + body + close)
+            start = end
+        return parts
+
+    @staticmethod
+    def digest_messages(texts, limit=MESSAGE_LIMIT):
+        """
+        Joins post messages into as few messages as fit Telegram's length limit.
+        Posts are kept whole, only a single post longer than the limit is split
+        """
+        messages = []
+        current = ''
+        for text in texts:
+            for part in FeedHandler.split_message(text, limit):
+                if current and len(current) + 2 + len(part) > limit:
+                    messages.append(current)
+                    current = ''
+                current = current + '\n\n' + part if current else part
+        if current:
+            messages.append(current)
+        return messages
 
     @staticmethod
     def format_url_string(string):
@@ -43,6 +172,38 @@ class FeedHandler(object):
 
         return string
 
+    @staticmethod
+    def canonical_url(url):
+        """
+        The one spelling a feed url is stored and fetched with: a scheme (http when
+        missing), scheme and host in lower case, no default port or fragment and the
+        query parameters in order. The host and the path are kept as given, as a
+        server may answer www. or a trailing slash with another resource
+        """
+        url = str(url).strip()
+        parts = urlsplit(url if re.match(r'(?i)https?://', url) else 'http://' + url)
+        scheme, netloc = parts.scheme.lower(), parts.netloc.lower()
+        if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+            netloc = netloc.rsplit(':', 1)[0]
+        query = '&'.join(sorted(param for param in parts.query.split('&') if param))
+        return urlunsplit((scheme, netloc, parts.path, query, ''))
+
+    @staticmethod
+    def url_identity(url, loose=False):
+        """
+        The urls sharing it are one feed: canonical_url. Loose also ignores the scheme,
+        a leading www. and a trailing slash, which usually but not always lead to the
+        same feed: a new subscription joins the feed already stored under it, while
+        the url migration only merges stored spellings when asked to
+        """
+        identity = FeedHandler.canonical_url(url)
+        if not loose:
+            return identity
+        identity = identity.split('://', 1)[1]
+        identity = identity[4:] if identity.startswith('www.') else identity
+        path, separator, query = identity.partition('?')
+        return path.rstrip('/') + separator + query
+
     @staticmethod
     def is_parsable(url):
         """
@@ -65,3 +226,10 @@ class FeedHandler(object):
             if hasattr(post, "published") or hasattr(post, 'summary'):
                 return True
         return True
+
+
+def parse_compact(response, entries=None):
+    """
+    parse_response followed by compact_result, module level so worker processes can run it
+    """
+    return FeedHandler.compact_result(FeedHandler.parse_response(response), entries)
@@ -0,0 +1,48 @@
+import logging
+
+from decouple import config
+
+from util.leases import LeaseManager
+from util.outbox import OutboxSender
+from util.processing import BatchProcess
+
+logger = logging.getLogger(__name__)
+
+
+class FeedWorker(object):
+    """
+    The feed pipeline of one bot: BatchProcess polling the feeds, the LeaseManager
+    when sharding is on and the OutboxSender delivering what it queues. The bots
+    start it in their own process while FEED_ENGINE is embedded; with external,
+    they only handle updates and feedworker.py runs it headless.
+    """
+
+    ENGINE = config('FEED_ENGINE', default='embedded')
+
+    def __init__(self, db, bot, outbox=True):
+        self.db = db
+        self.bot = bot
+        self.leases = LeaseManager(db=db) if LeaseManager.enabled() else None
+        self.sender = OutboxSender(db=db, bot=bot) if outbox else None
+        self.engine = BatchProcess(db=db, bot=bot, leases=self.leases)
+
+    @classmethod
+    def embedded(cls):
+        """ True when the bot process runs the feed pipeline itself """
+        return cls.ENGINE != 'external'
+
+    def threads(self):
+        return [thread for thread in (self.sender, self.leases, self.engine) if thread is not None]
+
+    def start(self):
+        for thread in self.threads():
+            thread.start()
+        logger.info(f'Feed worker on db {self.db.db} running {", ".join(t.name for t in self.threads())}')
+        return self
+
+    def stop(self, timeout=None):
+        """ Stops the engine first, so nothing is queued after the sender and the leases are gone """
+        for thread in reversed(self.threads()):
+            thread.stop()
+            if thread.is_alive():
+                thread.join(timeout)
@@ -0,0 +1,162 @@
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+
+from decouple import config
+
+from util.feedhandler import FeedHandler
+from util.fetcher import FeedFetcher
+from util.schema import KeySchema
+from util.storage import MemoryStorage, get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class FetchCache(object):
+    """
+    Fetch results shared by every feed engine polling the same url, so a feed is
+    downloaded once per TTL however many bots or shards want it. With FETCH_CACHE
+    memory it serves the bots hosted in one process, with redis (data base
+    FETCH_CACHE_DB) every process of every bot. A miss is fetched by whoever takes
+    the url's lock first, the others wait for its result instead of fetching too.
+    Same fetch_many as FeedFetcher; each response tells how it was served in cache.
+    """
+
+    MODE = config('FETCH_CACHE', default='memory').lower()
+    DB = config('FETCH_CACHE_DB', default=3, cast=int)
+    TTL = config('FETCH_CACHE_TTL', default=60, cast=float)
+    LOCK_TTL = config('FETCH_CACHE_LOCK_TTL', default=30, cast=float)
+    WAIT = 0.05
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, fetcher, storage, ttl=None, lock_ttl=None):
+        self.fetcher = fetcher
+        self.storage = storage
+        self.ttl = ttl or self.TTL
+        self.lock_ttl = lock_ttl or self.LOCK_TTL
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+
+    @classmethod
+    def shared(cls):
+        """ Process wide cache over the shared FeedFetcher, None when FETCH_CACHE is off """
+        if cls.MODE == 'off':
+            return None
+        with cls._shared_lock:
+            if cls._shared is None:
+                storage = MemoryStorage() if cls.MODE == 'memory' else get_storage(cls.DB)
+                cls._shared = cls(FeedFetcher.shared(), storage)
+            return cls._shared
+
+    @staticmethod
+    def encode(response):
+        content = base64.b64encode(zlib.compress(response['content'])).decode() if response['content'] else ''
+        headers = {key: value for key, value in response['headers'].items() if key.startswith('content-')}
+        return json.dumps({'status': response['status'], 'etag': response['etag'],
+                           'modified': response['modified'], 'headers': headers, 'content': content})
+
+    @staticmethod
+    def decode(url, entry):
+        entry = json.loads(entry)
+        content = zlib.decompress(base64.b64decode(entry['content'])) if entry['content'] else b''
+        return {'url': url, 'status': entry['status'], 'content': content, 'headers': entry['headers'],
+                'etag': entry['etag'], 'modified': entry['modified']}
+
+    @staticmethod
+    def cacheable(response):
+        """ Only a feed or a not modified answer is worth sharing, a failure is retried by the next poll """
+        status = response['status']
+        return status is not None and (200 <= status < 300 or status == 304)
+
+    @classmethod
+    def serve(cls, request, response, cache):
+        """
+        The cached response as an answer to request, None when it cannot stand for one:
+        a 304 only answers the requests with the same validators
+        """
+        if response is None or not cls.cacheable(response):
+            return None
+        url, etag, modified = request
+        fresh = (etag and etag == response['etag']) or (modified and modified == response['modified'])
+        if fresh and response['status'] in (200, 304):
+            response = dict(response, status=304, content=b'')
+        elif response['status'] == 304:
+            return None
+        return dict(response, url=url, cache=cache)
+
+    def _read(self, keys):
+        pipe = self.storage.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(KeySchema._name_fetch(key))
+            pipe.exists(KeySchema._name_fetch_lock(key))
+        results = pipe.execute()
+        return [(self.decode(key, entry) if entry else None, bool(locked))
+                for key, entry, locked in zip(keys, results[::2], results[1::2])]
+
+    def _lock(self, keys):
+        pipe = self.storage.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(KeySchema._name_fetch_lock(key), self.owner, nx=True, px=int(self.lock_ttl * 1000))
+        return pipe.execute()
+
+    def _store(self, keys, responses):
+        """ Stores the cacheable responses and releases every lock, so the waiters of a failure fetch it themselves """
+        pipe = self.storage.pipeline(transaction=False)
+        for key, response in zip(keys, responses):
+            if self.cacheable(response):
+                pipe.set(KeySchema._name_fetch(key), self.encode(response), px=int(self.ttl * 1000))
+            pipe.delete(KeySchema._name_fetch_lock(key))
+        pipe.execute()
+
+    def fetch_many(self, requests):
+        """
+        Answers (url, etag, modified) requests from the cache, fetching the misses this
+        process could lock and waiting for the ones another is fetching. Responses come
+        in the same order, with cache set to hit, shared (waited for) or miss
+        """
+        requests = list(requests)
+        keys = [FeedHandler.canonical_url(url) for url, _, _ in requests]
+        responses = [None] * len(requests)
+        misses = []
+        for index, (request, (cached, _)) in enumerate(zip(requests, self._read(keys))):
+            responses[index] = self.serve(request, cached, 'hit')
+            if responses[index] is None:
+                misses.append(index)
+
+        locked = self._lock([keys[index] for index in misses])
+        fetching = [index for index, acquired in zip(misses, locked) if acquired]
+        waiting = [index for index, acquired in zip(misses, locked) if not acquired]
+        fetched = self.fetcher.fetch_many([requests[index] for index in fetching])
+        if fetched:
+            self._store([keys[index] for index in fetching], fetched)
+        for index, response in zip(fetching, fetched):
+            responses[index] = dict(response, cache='miss')
+
+        deadline = time.monotonic() + self.lock_ttl
+        missing = []
+        while waiting:
+            pending = []
+            expired = time.monotonic() >= deadline
+            for index, (cached, busy) in zip(waiting, self._read([keys[index] for index in waiting])):
+                responses[index] = self.serve(requests[index], cached, 'shared')
+                if responses[index] is None and busy and not expired:
+                    pending.append(index)
+                elif responses[index] is None:
+                    # the other fetch failed or stored a result this request cannot use
+                    missing.append(index)
+            waiting = pending
+            if waiting:
+                time.sleep(self.WAIT)
+
+        for index, response in zip(missing, self.fetcher.fetch_many([requests[index] for index in missing])):
+            responses[index] = dict(response, cache='miss')
+        return responses
+
+    def close(self):
+        self.fetcher.close()
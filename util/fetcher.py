@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import threading
+
+import aiohttp
+import feedparser
+from decouple import config
+from feedparser.http import ACCEPT_HEADER
+
+logger = logging.getLogger(__name__)
+
+
+class FeedFetcher(object):
+    """
+    asyncio fetch engine for the feed cycle. Downloads many feeds at once with a
+    global and a per host connection limit, conditional GET and keep-alive sessions
+    reused across cycles. The event loop runs in its own daemon thread, so the
+    threaded BatchProcess calls fetch_many and gets raw bodies back for feedparser.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, concurrency=None, per_host=None, connect_timeout=None, read_timeout=None):
+        self.concurrency = concurrency or config('FETCH_CONCURRENCY', default=50, cast=int)
+        self.per_host = per_host or config('FETCH_PER_HOST', default=4, cast=int)
+        self.connect_timeout = connect_timeout or config('FETCH_CONNECT_TIMEOUT', default=5, cast=float)
+        self.read_timeout = read_timeout or config('FETCH_READ_TIMEOUT', default=20, cast=float)
+
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='FeedFetcher', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls):
+        """ Process wide fetcher, its sessions are reused by every caller """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            headers = {'User-Agent': feedparser.USER_AGENT, 'Accept-Encoding': 'gzip, deflate',
+                       'Accept': ACCEPT_HEADER}
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+        return self._session
+
+    async def fetch(self, url, etag=None, modified=None):
+        """
+        Downloads url, returns a dict with url, status, content (bytes), headers,
+        etag and modified. status is 304 with empty content when the feed did not
+        change and None when the request failed
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+
+        try:
+            async with self._get_session().get(url, headers=headers, allow_redirects=True) as response:
+                content = await response.read() if response.status != 304 else b''
+                return {'url': url,
+                        'status': response.status,
+                        'content': content,
+                        'headers': {key.lower(): value for key, value in response.headers.items()},
+                        'etag': response.headers.get('ETag'),
+                        'modified': response.headers.get('Last-Modified')}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f'fetch {url} {type(e).__name__} {str(e)}')
+            return self.failed(url)
+
+    @staticmethod
+    def failed(url):
+        return {'url': url, 'status': None, 'content': b'', 'headers': {}, 'etag': None, 'modified': None}
+
+    async def fetch_all(self, requests):
+        # an unexpected error fails its own url, not the whole cycle
+        results = await asyncio.gather(*[self.fetch(url, etag, modified) for url, etag, modified in requests],
+                                       return_exceptions=True)
+        for index, ((url, _, _), result) in enumerate(zip(requests, results)):
+            if isinstance(result, BaseException):
+                logger.error(f'fetch {url} {type(result).__name__} {str(result)}')
+                results[index] = self.failed(url)
+        return results
+
+    def fetch_many(self, requests):
+        """
+        Fetches (url, etag, modified) requests concurrently from any thread, returns
+        the results in the same order
+        """
+        if not requests:
+            return []
+        return asyncio.run_coroutine_threadsafe(self.fetch_all(list(requests)), self._loop).result()
+
+    def close(self):
+        async def close_session():
+            if self._session is not None:
+                await self._session.close()
+
+        asyncio.run_coroutine_threadsafe(close_session(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
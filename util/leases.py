@@ -0,0 +1,96 @@
+import logging
+import math
+import os
+import random
+import socket
+import threading
+import time
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseManager(threading.Thread):
+    """
+    Holds this worker's share of the SHARDS slices of the urls, so several worker
+    processes on one data base each poll a disjoint part of them. A shard is owned
+    through a lease key with a TTL that is renewed every TTL/3; the leases of a
+    worker that stops renewing expire and the live workers take them over. Every
+    worker heartbeats in lease:workers and holds about SHARDS / live workers shards,
+    releasing the surplus when another worker joins.
+    """
+
+    SHARDS = config('FEED_SHARDS', default=1, cast=int)
+    TTL = config('FEED_LEASE_TTL', default=30, cast=float)
+
+    def __init__(self, db, worker=None, shards=None, ttl=None):
+        super().__init__(name=f'LeaseManager-{db.db}', daemon=True)
+        self._finished = threading.Event()
+        self._owned_lock = threading.Lock()
+        self.db = db
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+        self.shards = shards or self.SHARDS
+        self.ttl = ttl or self.TTL
+        self.owned = set()
+
+    @classmethod
+    def enabled(cls):
+        """ Sharding is on when FEED_SHARDS splits the urls in more than one slice """
+        return cls.SHARDS > 1
+
+    def owned_shards(self):
+        with self._owned_lock:
+            return sorted(self.owned)
+
+    def run(self):
+        logger.info(f'Start leasing {self.shards} shards as {self.worker}')
+        while not self._finished.isSet():
+            try:
+                self.balance()
+            except Exception as e:
+                # an unrenewed lease expires, so what this worker held is dropped until it can renew again
+                logger.error(f'leases {self.worker} {type(e).__name__} {str(e)}')
+                with self._owned_lock:
+                    self.owned = set()
+            self._finished.wait(self.ttl / 3)
+        self.release()
+
+    def balance(self):
+        """ Renews the owned leases, then takes free shards or releases the surplus to reach a fair share """
+        workers = self.db.heartbeat_worker(self.worker, time.time(), self.ttl)
+        owned = set(self.db.renew_leases(self.worker, self.owned_shards(), self.ttl))
+        target = math.ceil(self.shards / max(workers, 1))
+        if len(owned) > target:
+            surplus = sorted(owned)[target:]
+            self.db.release_leases(self.worker, surplus)
+            owned.difference_update(surplus)
+        elif len(owned) < target:
+            free = [shard for shard in range(self.shards) if shard not in owned]
+            # start at a random shard, so joining workers do not all race for the same ones
+            offset = random.randrange(len(free))
+            free = free[offset:] + free[:offset]
+            while free and len(owned) < target:
+                wanted, free = free[:target - len(owned)], free[target - len(owned):]
+                owned.update(self.db.acquire_leases(self.worker, wanted, self.ttl))
+        with self._owned_lock:
+            changed = owned != self.owned
+            self.owned = owned
+        if changed:
+            logger.info(f'leases {self.worker} holds {len(owned)}/{self.shards} shards '
+                        f'of {workers} workers: {sorted(owned)}')
+        return owned
+
+    def release(self):
+        """ Gives the shards back at once, instead of leaving them to expire """
+        with self._owned_lock:
+            owned, self.owned = sorted(self.owned), set()
+        try:
+            self.db.release_leases(self.worker, owned)
+            self.db.remove_worker(self.worker)
+        except Exception as e:
+            logger.error(f'leases {self.worker} release {type(e).__name__} {str(e)}')
+
+    def stop(self):
+        """Stop this thread"""
+        self._finished.set()
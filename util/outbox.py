@@ -0,0 +1,138 @@
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.vendor.ptb_urllib3.urllib3.exceptions import ConnectTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxSender(threading.Thread):
+    """
+    Delivers the messages BatchProcess queues in the outbox stream, as one consumer
+    of its consumer group. Delivered messages are acknowledged, transient failures
+    are queued again after a growing delay up to MAX_ATTEMPTS and the rest go to
+    the dead letter stream.
+    Entries left pending by a stopped consumer are resumed or claimed, so several
+    senders, in this or other processes, can drain the queue together.
+    """
+
+    DELIVERY_WORKERS = config('DELIVERY_WORKERS', default=8, cast=int)
+    BATCH = config('OUTBOX_BATCH', default=50, cast=int)
+    # well below REDIS_SOCKET_TIMEOUT, or the socket times out while XREADGROUP is blocking
+    BLOCK = config('OUTBOX_BLOCK', default=2000, cast=int)
+    CLAIM_IDLE = config('OUTBOX_CLAIM_IDLE', default=60000, cast=int)
+    MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+    RETRY_DELAY = config('OUTBOX_RETRY_DELAY', default=5, cast=float)
+    RETRY_MAX = config('OUTBOX_RETRY_MAX', default=300, cast=float)
+
+    def __init__(self, db, bot, consumer=None, workers=None):
+        super().__init__(name=f'OutboxSender-{db.db}', daemon=True)
+        self._finished = threading.Event()
+        self.db = db
+        self.bot = bot
+        # one per process, what a stopped one left pending is claimed after CLAIM_IDLE;
+        # set OUTBOX_CONSUMER apart for each process to resume them at once after a restart
+        self.consumer = consumer or config('OUTBOX_CONSUMER', default='') or \
+            f'{socket.gethostname()}:{os.getpid()}'
+        self.pool = ThreadPoolExecutor(max_workers=workers or self.DELIVERY_WORKERS,
+                                       thread_name_prefix=f'delivery-{db.db}')
+        self._deliveries_lock = threading.Lock()
+        self.deliveries = Counter()
+        self.delivery_failures = {}
+        self.delivery_time = 0
+
+    def run(self):
+        logger.info(f'Start sending as {self.consumer}')
+        resuming = True
+        while not self._finished.isSet():
+            try:
+                if resuming:
+                    # first what this consumer read before a restart but did not settle
+                    self.db.create_outbox_group()
+                    messages = self.db.read_outbox(self.consumer, self.BATCH, start='0')
+                    resuming = bool(messages)
+                else:
+                    self.db.requeue_outbox(time.time())
+                    messages = self.db.claim_outbox(self.consumer, self.CLAIM_IDLE, self.BATCH) or \
+                               self.db.read_outbox(self.consumer, self.BATCH, block=self.BLOCK)
+                self.drain(messages)
+            except Exception as e:
+                logger.error(f'outbox {self.consumer} {type(e).__name__} {str(e)}')
+                self._finished.wait(1)
+
+    def drain(self, messages):
+        """ Sends a batch of (id, fields) outbox messages and settles each of them """
+        if not messages:
+            return
+        time_started = time.perf_counter()
+        results = list(self.pool.map(lambda message: self.deliver(*message), messages))
+        duration = time.perf_counter() - time_started
+        with self._deliveries_lock:
+            self.delivery_time += duration
+        sent = [message_id for message_id, result in results if result == 'sent']
+        if sent:
+            self.db.ack_outbox(sent)
+        logger.info(f'outbox {self.consumer} sent {len(sent)}/{len(messages)} in {duration:.2f}s '
+                    f'({len(sent) / duration if duration else 0:.1f} msgs/s)')
+
+    def deliver(self, message_id, fields):
+        chat_id = int(fields['chat_id'])
+        result, error = self.send_message(chat_id, fields['text'])
+        if result == 'retry' and int(fields.get('attempts', 0)) + 1 < self.MAX_ATTEMPTS:
+            self.db.retry_outbox(message_id, fields, time.time() + self.retry_delay(fields, error))
+        elif result != 'sent':
+            logger.error(f'outbox dead letter {chat_id} {fields.get("url")} {str(error)}')
+            self.db.dead_letter_outbox(message_id, fields, error)
+        return message_id, result
+
+    def retry_delay(self, fields, error):
+        """ Seconds before the next attempt: doubling per attempt, at least what Telegram asked for """
+        delay = min(self.RETRY_MAX, self.RETRY_DELAY * 2 ** int(fields.get('attempts', 0)))
+        return max(delay, getattr(error, 'retry_after', 0) or 0)
+
+    def send_message(self, chat_id, message):
+        """ Sends message to one chat, records and returns the result (sent, retry or failed) and the error """
+        error = None
+        try:
+            self.bot.send_message(chat_id=chat_id, text=message, parse_mode='html')
+            result = 'sent'
+        except ConnectTimeoutError as e:
+            logger.error(f"{str(e)} {str(chat_id)}")
+            error, result = e, 'retry'
+        except TelegramError as e:
+            logger.error(f"{str(e.message)} {str(chat_id)}")
+            # BadRequest is a NetworkError too, but sending it again will not help
+            if isinstance(e, (NetworkError, RetryAfter)) and not isinstance(e, BadRequest):
+                error, result = e, 'retry'
+            else:
+                self.errors(chat_id=chat_id, error=e)
+                error, result = e, 'failed'
+        with self._deliveries_lock:
+            self.deliveries[result] += 1
+            if error is not None:
+                self.delivery_failures[chat_id] = str(error)
+        return result, error
+
+    def errors(self, chat_id, error):
+        """ Error handling """
+        try:
+            if error.message in ['Chat not found']:
+                logger.error(f"{str(self.db.disable_url_chat(chat_id))}")
+
+                logger.error('disable chat_id %s from chat list' % chat_id)
+
+        except ConnectTimeoutError as e:
+            logger.error(f"error ConnectTimeoutError {str(e)}")
+        except ValueError as e:
+            logger.error(f"error ValueError {str(e)}")
+
+    def stop(self):
+        """Stop this thread"""
+        self._finished.set()
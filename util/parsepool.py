@@ -0,0 +1,51 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from decouple import config
+
+from util.feedhandler import FeedHandler, parse_compact
+
+
+class ParsePool(object):
+    """
+    Parses fetched feeds in worker processes, so feedparser scales across cores
+    instead of serializing on the GIL. Only compact results cross the process
+    boundary. With PARSE_WORKERS=0 parsing runs in the calling thread.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, workers=None):
+        self.workers = config('PARSE_WORKERS', default=0, cast=int) if workers is None else workers
+        self._executor = None
+        if self.workers > 0:
+            # the bot process runs many threads, forking it could copy locks held by
+            # them, so workers start from a clean forkserver (spawn where unavailable)
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(method))
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def parse_many(self, responses, entries=None, chunksize=8):
+        """
+        Parses FeedFetcher responses, returns feedparser results with their first
+        entries (all when None) in the same order
+        """
+        if self._executor is None:
+            compacts = [parse_compact(response, entries) for response in responses]
+        else:
+            compacts = self._executor.map(partial(parse_compact, entries=entries), responses, chunksize=chunksize)
+        return [FeedHandler.expand_result(compact) for compact in compacts]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,51 @@
+from statistics import median
+
+from decouple import config
+
+
+class PollHandler(object):
+    """
+    Per feed poll interval learned from the publish history kept in the url hash.
+    The interval doubles while a feed has nothing new and halves when posts arrive,
+    then never exceeding the median gap between the last publications.
+    """
+
+    INTERVAL = config('FEED_POLL_INTERVAL', default=60, cast=int)
+    MIN_INTERVAL = config('FEED_POLL_MIN', default=30, cast=int)
+    MAX_INTERVAL = config('FEED_POLL_MAX', default=3600, cast=int)
+    HISTORY = config('FEED_POLL_HISTORY', default=10, cast=int)
+
+    @staticmethod
+    def parse_history(value):
+        return [int(timestamp) for timestamp in value.split(',') if timestamp] if value else []
+
+    @staticmethod
+    def format_history(history):
+        return ','.join(str(timestamp) for timestamp in history)
+
+    @staticmethod
+    def add_published(history, published):
+        """
+        Adds publish timestamps to the history, keeps the newest HISTORY ones
+        """
+        history = sorted(set(history) | set(int(timestamp) for timestamp in published))
+        return history[-PollHandler.HISTORY:]
+
+    @staticmethod
+    def gaps(history):
+        return [after - before for before, after in zip(history, history[1:]) if after > before]
+
+    @staticmethod
+    def next_interval(current, history, new_posts):
+        """
+        Returns the seconds until the feed is polled again
+        """
+        current = int(current) if current else PollHandler.INTERVAL
+        interval = current // 2 if new_posts else current * 2
+
+        # only new posts tie the interval to the publish rate, a quiet feed keeps backing off
+        gaps = PollHandler.gaps(history) if new_posts else []
+        if gaps:
+            interval = min(interval, int(median(gaps)))
+
+        return max(PollHandler.MIN_INTERVAL, min(PollHandler.MAX_INTERVAL, interval))
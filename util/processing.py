@@ -1,126 +1,257 @@
 import logging
-from datetime import timedelta
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from multiprocessing.dummy import Pool as ThreadPool
 from threading import Thread as RunningThread
 
 import threading
 
-from telegram.error import BadRequest, TelegramError
-from telegram.vendor.ptb_urllib3.urllib3.exceptions import ConnectTimeoutError
+from decouple import config
 
 from util.datehandler import DateHandler
 from util.feedhandler import FeedHandler
+from util.fetchcache import FetchCache
+from util.fetcher import FeedFetcher
+from util.parsepool import ParsePool
+from util.pollhandler import PollHandler
+from util.render import RenderCache
 
 logger = logging.getLogger(__name__)
 logging.getLogger('util.processing').setLevel(logging.ERROR)
 
 
 class BatchProcess(threading.Thread):
+    """
+    Feed engine, started once and running a cycle every CYCLE_INTERVAL seconds. A
+    cycle fetches the due feeds, finds their new posts and queues them in the outbox
+    stream, OutboxSender delivers them, so this never waits on Telegram. Worker
+    pools, HTTP sessions and the bot identity live as long as the engine. Given a
+    LeaseManager, it only polls the urls of the shards this worker holds.
+    """
 
-    def __init__(self, db, bot):
-        RunningThread.__init__(self)
+    CYCLE_INTERVAL = config('FEED_CYCLE_INTERVAL', default=15, cast=float)
+    UPDATE_WORKERS = config('FEED_UPDATE_WORKERS', default=1, cast=int)
+    FIRST_POSTS = 4
+
+    def __init__(self, db, bot, fetcher=None, parser=None, renders=None, leases=None):
+        RunningThread.__init__(self, name=f'BatchProcess-{db.db}', daemon=True)
 
         self._finished = threading.Event()
+        self._responses_lock = threading.Lock()
+        self._queued_lock = threading.Lock()
+        self._reset_counters()
+        self._bot_name = None
         self.db = db
         self.bot = bot
+        # with the fetch cache on, urls other bots or shards poll too are downloaded once for all
+        self.fetcher = fetcher or FetchCache.shared() or FeedFetcher.shared()
+        self.parser = parser or ParsePool.shared()
+        self.renders = renders or RenderCache.shared()
+        self.leases = leases
+        self.pool = ThreadPoolExecutor(max_workers=self.UPDATE_WORKERS, thread_name_prefix=f'update-{db.db}')
+
+    def _reset_counters(self):
+        self.responses = Counter()
+        self.queued = 0
+        self.digests = Counter()
+        self.failed = 0
+
+    @property
+    def bot_name(self):
+        """ first_name of the bot, asked to Telegram once """
+        if self._bot_name is None:
+            self._bot_name = self.bot.get_me().first_name
+        return self._bot_name
 
     def run(self):
-        logger.info(f'Start processing {self.bot.username}')
-        if self._finished.isSet():
-            return
-        self.parse_parallel()
+        # the bot name is asked within the cycle, a Telegram outage at start must not end the engine
+        logger.info(f'Start processing db {self.db.db}')
+        while not self._finished.isSet():
+            try:
+                self.parse_parallel()
+            except Exception as e:
+                # a failed cycle must not end the engine, the next one tries again
+                logger.error(f"parse_parallel {type(e).__name__} {str(e)}")
+            self._finished.wait(self.CYCLE_INTERVAL)
 
     def parse_parallel(self):
         if not self._finished.isSet():
             time_started = DateHandler.datetime.now()
-            urls = self.db.get_urls_activated()
-            threads = 1
-            pool = ThreadPool(threads)
-            pool.map(self.update_feed, urls)
-            pool.close()
-            pool.join()
+            now = time.time()
+            self._reset_counters()
+            renders_before = self.renders.stats()
+            self.flush_digests(now)
+            if self.leases is None:
+                urls = self.db.pop_urls_due(now, now + PollHandler.INTERVAL)
+            else:
+                urls = self.db.pop_urls_due_shards(now, now + PollHandler.INTERVAL,
+                                                   self.leases.shards, self.leases.owned_shards())
+            url_infos = self.db.get_update_urls(urls)
+            requests = [(url, (info or {}).get('etag'), (info or {}).get('modified'))
+                        for url, info in zip(urls, url_infos)]
+            responses = self.fetcher.fetch_many(requests)
+            for response in responses:
+                self.count_response(response)
+
+            # servers ignoring conditional GET send the same bytes again, those bodies are not parsed
+            digests = [FeedHandler.content_digest(response['content']) for response in responses]
+            unchanged = [bool(digest) and digest == (info or {}).get('digest')
+                         for info, digest in zip(url_infos, digests)]
+            parsed = iter(self.parser.parse_many([response for response, skip in zip(responses, unchanged)
+                                                  if not skip], entries=self.db.SEEN_ITEMS))
+            results = [None if skip else next(parsed) for skip in unchanged]
+            list(self.pool.map(self.update_feed, urls, url_infos, results, digests))
 
             time_ended = DateHandler.datetime.now()
             duration = time_ended - time_started
-            info_bot = self.bot.get_me()
-            bot = info_bot.first_name
-            logger.warning(f"Finished updating! Parsed {str(len(urls))} rss feeds in {str(duration)}! {bot}")
+            bot = self.bot_name
+            statuses = ', '.join(f'{status}: {count}' for status, count
+                                  in sorted(self.responses.items(), key=lambda item: str(item[0])))
+            bodies = sum(1 for digest in digests if digest)
+            hits = sum(unchanged)
+            cached = [response for response in responses if response.get('cache') in ('hit', 'shared')]
+            saved = sum(len(response['content']) for response in cached)
+            renders = {key: value - renders_before[key] for key, value in self.renders.stats().items()
+                       if key in ('hits', 'misses')}
+            logger.warning(f"Finished updating! Parsed {str(len(urls))} rss feeds in {str(duration)}! {bot} "
+                           f"responses {statuses or '-'} failed {self.failed} "
+                           f"fetch cache {len(cached)}/{len(responses)} "
+                           f"({len(cached) / len(responses) if responses else 0:.0%}, {saved / 1024:.0f} KiB saved) "
+                           f"unchanged bodies {hits}/{bodies} "
+                           f"({hits / bodies if bodies else 0:.0%}) messages queued {self.queued} "
+                           f"digests {self.digests['messages']} from {self.digests['posts']} posts "
+                           f"renders {renders['hits']} hits {renders['misses']} misses")
 
-    def update_feed(self, url):
+    def update_feed(self, url, get_url_info, result, digest=None):
         if not self._finished.isSet():
             try:
-                get_url_info = self.db.get_update_url(url)
+                if result is None or result.get('status') == 304:
+                    self.update_poll(url=url, url_info=get_url_info, published=[])
+                    return True, url
+                status = result.get('status')
+                if status is None or not 200 <= status < 300:
+                    # a failed fetch says nothing about the feed, keep its validators, digest and poll interval
+                    with self._responses_lock:
+                        self.failed += 1
+                    return False, url, 'fetch'
+
                 last_url = get_url_info['last_url']
                 date_last_url = DateHandler.parse_datetime(get_url_info['last_update'])
-                feed = FeedHandler.parse_feed(url, 4, date_last_url + timedelta(days=-1))
+                # every entry the seen set can hold, so a burst between two polls is not cut to the newest few
+                feed = FeedHandler.parse_feed(url, self.db.SEEN_ITEMS, result=result)
+                posts = []
                 for post in feed:
                     if not hasattr(post, "published") and not hasattr(post, "daily_liturgy"):
                         logger.warning('not published' + url)
                         continue
-                    # for index, post in enumerate(feed):
-                    date_published = DateHandler.parse_datetime(post.published)
-
-                    if hasattr(post, "daily_liturgy"):
-                        if date_published > date_last_url and post.link != last_url \
-                                and post.daily_liturgy != '':
-                            message = post.title + '\n' + post.daily_liturgy
-                            result = self.send_newest_messages(message, url)
-                            if post == feed[-1] and result:
-                                self.update_url(url=url, last_update=date_published, last_url=post.link)
-                    elif date_published > date_last_url and post.link != last_url:
-                        message = post.title + '\n' + post.link
-                        result = self.send_newest_messages(message, url)
-                        if result:
-                            self.update_url(url=url, last_update=date_published, last_url=post.link)
+                    posts.append(post)
+                keys = [FeedHandler.entry_key(post) for post in posts]
+                # None until the url has a seen set, then the last_update/last_url watermark decides once
+                seen_items = self.db.get_seen_items(url, keys)
+
+                published = []
+                seen = []
+                watermark = date_last_url
+                chat_ids = None
+                digests = None
+                for index, (post, key) in enumerate(zip(posts, keys)):
+                    if seen_items is None:
+                        date_published = DateHandler.parse_datetime(post.published)
+                        # a url polled for the first time sends its FIRST_POSTS newest posts, the rest is only seen
+                        is_new = date_published > date_last_url and post.link != last_url and \
+                            index >= len(posts) - self.FIRST_POSTS
                     else:
-                        pass
+                        is_new = not seen_items[index]
+                        date_published = DateHandler.parse_datetime(post.published) if is_new else None
+                    if not is_new:
+                        seen.append(key)
+                        continue
+                    variant = 'liturgy' if hasattr(post, "daily_liturgy") else 'post'
+                    if variant == 'liturgy' and post.daily_liturgy == '':
+                        continue
+                    message = self.renders.get(url, key, variant, lambda: FeedHandler.render_post(post, variant))
+                    published.append(date_published.timestamp())
+                    if chat_ids is None:
+                        chat_ids = self.db.get_chat_ids_activated(url)
+                        digests = self.db.get_digest_settings(chat_ids)
+                    self.queue_newest_messages(message, url, chat_ids, digests)
+                    seen.append(key)
+                    if date_published > watermark:
+                        watermark = date_published
+                        self.update_url(url=url, last_update=date_published, last_url=post.link)
+                if seen:
+                    self.db.add_seen_items(url, seen, seen_at=time.time())
+                self.db.update_url_validators(url, etag=result.get('etag'), modified=result.get('modified'),
+                                              digest=digest)
+                self.update_poll(url=url, url_info=get_url_info, published=published)
                 return True, url
-            except TypeError as e:
-                logger.error(f"TypeError {url} {str(e)}")
+            except Exception as e:
+                # a bad entry (a pubDate dateutil can not read, a broken link) fails its feed, not the cycle;
+                # pop_urls_due already scheduled the feed again
+                logger.error(f"update_feed {url} {type(e).__name__} {str(e)}")
+                with self._responses_lock:
+                    self.failed += 1
                 return False, url, 'update_feed'
 
-            except TelegramError as e:
-                logger.error(f"except update_feed TelegramError {url} {str(e)}")
-                return False, url, 'update_feed'
+    def count_response(self, response):
+        """ Counts the HTTP status of a fetch for the cycle summary """
+        with self._responses_lock:
+            self.responses[response.get('status') or 'error'] += 1
 
     def update_url(self, url, last_update, last_url):
         if not self._finished.isSet():
             self.db.update_url(url=url, last_update=last_update, last_url=last_url)
 
-    def send_newest_messages(self, message, url):
+    def update_poll(self, url, url_info, published):
+        """ Learns the next poll interval of url from the publish times of its new posts """
         if not self._finished.isSet():
-            names_url = self.db.get_names_for_user_activated(url)
-            for name in names_url:
-                chat_id = int(self.db.get_value_name_key(name, 'chat_id'))
-                if chat_id:
-                    try:
-                        self.bot.send_message(chat_id=chat_id, text=message, parse_mode='html')
-                        return True
-                    except ConnectTimeoutError as e:
-                        logger.error(f"{str(e)}")
-                        return False
-
-                    except TelegramError as e:
-                        logger.error(f"{str(e.message)} {str(chat_id)}")
-                        # logger.info('Error ' + e + ' when send message for chat_id ' + str(chat_id))
-                        self.errors(chat_id=chat_id, error=e)
-                        continue
-
-    def errors(self, chat_id, error):
-        """ Error handling """
-        try:
-            if error.message in ['Chat not found']:
-                logger.error(f"{str(self.db.disable_url_chat(chat_id))}")
+            history = PollHandler.parse_history(url_info.get('publish_history'))
+            history = PollHandler.add_published(history, published)
+            interval = PollHandler.next_interval(url_info.get('poll_interval'), history, new_posts=bool(published))
+            self.db.set_url_poll(url=url, poll_interval=interval, publish_history=PollHandler.format_history(history),
+                                 due=time.time() + interval)
 
-                logger.error('disable chat_id %s from chat list' % chat_id)
-                # logger.error("An error occurred: %s" % error)
+    def queue_newest_messages(self, message, url, chat_ids, digests=None):
+        """
+        Queues message to every chat subscribed to url in the outbox stream, chats in
+        digest mode hold it for their next digest instead
+        """
+        if not self._finished.isSet() and chat_ids:
+            digests = digests or {}
+            direct = [chat_id for chat_id in chat_ids if chat_id not in digests]
+            if direct:
+                self.db.queue_messages(url, message, direct)
+            windows = {chat_id: window for chat_id, (window, _) in digests.items()}
+            if windows:
+                self.db.buffer_digests(url, message, windows, time.time())
+            with self._queued_lock:
+                self.queued += len(direct)
 
-        except ConnectTimeoutError as e:
-            logger.error(f"error ConnectTimeoutError {str(e)}")
-        except ValueError as e:
-            logger.error(f"error ValueError {str(e)}")
+    def flush_digests(self, now):
+        """
+        Queues the digests that are due. A chat gets one digest when it collected at
+        least its threshold of posts, otherwise the posts go out one by one
+        """
+        due = self.db.pop_digests_due(now)
+        if not due:
+            return
+        settings = self.db.get_digest_settings([chat_id for chat_id, _ in due])
+        for chat_id, entries in due:
+            _, threshold = settings.get(chat_id, (0, len(entries) + 1))
+            if len(entries) >= threshold:
+                messages = FeedHandler.digest_messages([entry['text'] for entry in entries])
+                for message in messages:
+                    self.db.queue_messages('digest', message, [chat_id])
+                self.digests['messages'] += len(messages)
+                self.digests['posts'] += len(entries)
+                self.queued += len(messages)
+            else:
+                for entry in entries:
+                    self.db.queue_messages(entry['url'], entry['text'], [chat_id])
+                self.queued += len(entries)
 
     def stop(self):
         """Stop this thread"""
         self._finished.set()
+        self.pool.shutdown(wait=False)
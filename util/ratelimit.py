@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+
+from decouple import config
+from telegram import Bot
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    rate tokens per second up to capacity. Tokens are reserved ahead of time, so
+    callers that have to wait are served in the order they asked
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self, now):
+        """ Seconds until a token is available """
+        self._refill(now)
+        return max(0, (1 - self.tokens) / self.rate, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class RateLimiter(object):
+    """
+    Paces outgoing messages under the Telegram Bot API limits: RATE_GLOBAL per
+    second for the bot, RATE_CHAT per second for each chat and RATE_GROUP per
+    minute for each group or channel. A RetryAfter from Telegram blocks that chat
+    for the time it asks. The buckets live in this process, SharedRateLimiter
+    keeps them in the bot's data base for bots running several processes.
+    """
+
+    RATE_GLOBAL = config('TELEGRAM_RATE_GLOBAL', default=30, cast=float)
+    RATE_CHAT = config('TELEGRAM_RATE_CHAT', default=1, cast=float)
+    RATE_GROUP = config('TELEGRAM_RATE_GROUP', default=20, cast=float)
+    MAX_CHATS = 10000
+
+    def __init__(self, rate_global=None, rate_chat=None, rate_group=None):
+        self.rate_global = rate_global or self.RATE_GLOBAL
+        self.rate_chat = rate_chat or self.RATE_CHAT
+        self.rate_group = (rate_group or self.RATE_GROUP) / 60
+        self._lock = threading.Lock()
+        self._global = TokenBucket(self.rate_global)
+        self._chats = {}
+        self._groups = {}
+
+    @staticmethod
+    def is_group(chat_id):
+        """ Groups and channels have negative ids, channels may also be given as @username """
+        return str(chat_id).startswith(('-', '@'))
+
+    def _buckets(self, chat_id, now):
+        buckets = [self._global]
+        if chat_id is None:
+            return buckets
+        key = str(chat_id)
+        if len(self._chats) > self.MAX_CHATS:
+            self._prune(now)
+        if key not in self._chats:
+            self._chats[key] = TokenBucket(self.rate_chat)
+        buckets.append(self._chats[key])
+        if self.is_group(key):
+            if key not in self._groups:
+                self._groups[key] = TokenBucket(self.rate_group)
+            buckets.append(self._groups[key])
+        return buckets
+
+    def _limits(self, chat_id):
+        """ (bucket, messages per second) of every limit a message to chat_id counts against """
+        if chat_id is None:
+            return [('global', self.rate_global)]
+        key = str(chat_id)
+        limits = [('global', self.rate_global), ('chat:' + key, self.rate_chat)]
+        if self.is_group(key):
+            limits.append(('group:' + key, self.rate_group))
+        return limits
+
+    def _prune(self, now):
+        for buckets in (self._chats, self._groups):
+            for key in [key for key, bucket in buckets.items() if bucket.idle(now)]:
+                del buckets[key]
+
+    def reserve(self, chat_id=None):
+        """ Takes a token from every bucket of chat_id, returns the seconds to wait before sending """
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._buckets(chat_id, now)
+            wait = max(bucket.delay(now) for bucket in buckets)
+            for bucket in buckets:
+                bucket.take()
+            return wait
+
+    def acquire(self, chat_id=None):
+        wait = self.reserve(chat_id)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def backoff(self, chat_id, retry_after):
+        with self._lock:
+            now = time.monotonic()
+            for bucket in self._buckets(chat_id, now)[1:] or [self._global]:
+                bucket.block(now + retry_after)
+
+
+class RateLimitedBot(Bot):
+    """
+    Bot whose messages (send_*, edit_*, replies from the handlers) go through a
+    RateLimiter, and are sent again after the wait a RetryAfter asks for
+    """
+
+    RETRIES = config('TELEGRAM_RETRIES', default=3, cast=int)
+
+    def __init__(self, *args, limiter=None, retries=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or RateLimiter()
+        self.retries = self.RETRIES if retries is None else retries
+
+    def _message(self, endpoint, data, *args, **kwargs):
+        chat_id = data.get('chat_id')
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(chat_id)
+            try:
+                return super()._message(endpoint, data, *args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f'{endpoint} {chat_id} retry after {e.retry_after}s')
+                self.limiter.backoff(chat_id, e.retry_after)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter whose buckets are kept in the bot's data base, so the bot process,
+    its feed workers and outbox senders together stay under the bot's limits
+    """
+
+    def __init__(self, db, rate_global=None, rate_chat=None, rate_group=None):
+        super().__init__(rate_global, rate_chat, rate_group)
+        self.db = db
+
+    def reserve(self, chat_id=None):
+        return self.db.reserve_rate(self._limits(chat_id))
+
+    def backoff(self, chat_id, retry_after):
+        buckets = [bucket for bucket, _ in self._limits(chat_id)]
+        self.db.block_rate(buckets[1:] or buckets, retry_after)
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+from decouple import config
+
+
+class RenderCache(object):
+    """
+    Final message payloads of posts, keyed by (feed url, entry key, variant) and
+    encoded once, so every chat a post goes to shares the same buffer. The least
+    recently used payloads are dropped once they add up to more than SIZE bytes.
+    """
+
+    SIZE = config('RENDER_CACHE_BYTES', default=8 * 1024 * 1024, cast=int)
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, size=None):
+        self.size = size or self.SIZE
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def get(self, url, key, variant, render):
+        """ Returns the payload of a post, calling render() for its text only on a miss """
+        cache_key = (url, key, variant)
+        with self._lock:
+            payload = self._payloads.get(cache_key)
+            if payload is not None:
+                self._payloads.move_to_end(cache_key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+
+        payload = render().encode()
+        with self._lock:
+            if cache_key not in self._payloads:
+                self._payloads[cache_key] = payload
+                self._bytes += len(payload)
+            while self._bytes > self.size and len(self._payloads) > 1:
+                _, evicted = self._payloads.popitem(last=False)
+                self._bytes -= len(evicted)
+        return payload
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._payloads), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0}
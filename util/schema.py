@@ -0,0 +1,269 @@
+import functools
+import json
+
+from decouple import config
+
+from util import scripts
+
+
+def steps(method):
+    """
+    Runs a handler method written as a generator that yields its redis calls
+    (commands, pipeline executes, scripts) through the handler's _run, which answers
+    each call with its result. Steps of other methods are reached with yield from.
+    """
+    @functools.wraps(method)
+    def run(self, *args, **kwargs):
+        return self._run(method(self, *args, **kwargs))
+    return run
+
+
+class KeySchema(object):
+    """
+    Key names, script arguments and result shaping shared by DatabaseHandler and
+    AsyncDatabaseHandler, so both read and write the same data
+    """
+
+    INDEX_URLS_ACTIVATED = 'index:urls_activated'
+    INDEX_URLS_DUE = 'index:urls_due'
+    # spelling merged by migrate.py urls --loose -> feed it was merged into, kept out of index:*
+    # as build_indexes deletes and rebuilds those from the subscriptions
+    URL_ALIASES = 'alias:url'
+    # loose identity -> feed a new spelling of it is subscribed to, rebuilt with the other indexes
+    INDEX_URL_LOOSE = 'index:url_loose'
+    DEFAULT_LAST_UPDATE = '2000-01-01 00:00:00+00:00'
+    DEFAULT_LAST_URL = 'http://www.exemplo.com'
+    SEEN_ITEMS = config('FEED_SEEN_ITEMS', default=200, cast=int)
+    DIGESTS_DUE = 'digest:due'
+    LEASE_WORKERS = 'lease:workers'
+    STREAM_OUTBOX = 'stream:outbox'
+    STREAM_DEAD = 'stream:outbox:dead'
+    OUTBOX_RETRY = 'outbox:retry'
+    OUTBOX_GROUP = 'senders'
+    DEAD_LETTERS = config('OUTBOX_DEAD_LETTERS', default=10000, cast=int)
+
+    SCRIPTS = {'subscribe': scripts.SUBSCRIBE,
+               'unsubscribe': scripts.UNSUBSCRIBE,
+               'disable_chat': scripts.DISABLE_CHAT,
+               'transfer_owner': scripts.TRANSFER_OWNER,
+               'register_group': scripts.REGISTER_GROUP,
+               'pop_due': scripts.POP_DUE,
+               'pop_digests': scripts.POP_DIGESTS,
+               'pop_due_shards': scripts.POP_DUE_SHARDS,
+               'renew_leases': scripts.RENEW_LEASES,
+               'release_leases': scripts.RELEASE_LEASES,
+               'requeue_outbox': scripts.REQUEUE_OUTBOX,
+               'reserve_rate': scripts.RESERVE_RATE,
+               'block_rate': scripts.BLOCK_RATE}
+
+    '''name of the hash that keeps last_update and last_url for a url'''
+    @staticmethod
+    def _name_url(url):
+        return 'url:^' + str(url) + '^'
+
+    '''name of the shared fetch result of a url, in the fetch cache data base'''
+    @staticmethod
+    def _name_fetch(url):
+        return 'fetch:^' + str(url) + '^'
+
+    '''name of the key held by the one process fetching a url for everyone'''
+    @staticmethod
+    def _name_fetch_lock(url):
+        return 'fetch:lock:^' + str(url) + '^'
+
+    '''name of the sorted set with the entry keys already seen for a url, scored by when they were seen'''
+    @staticmethod
+    def _name_seen(url):
+        return 'seen:^' + str(url) + '^'
+
+    '''name of the list with the posts waiting for the digest of a chat'''
+    @staticmethod
+    def _name_digest(chat_id):
+        return 'digest:chat:' + str(chat_id)
+
+    '''name of the hash holding an outbox message that waits to be retried'''
+    @staticmethod
+    def _name_retry(message_id):
+        return 'outbox:retry:' + str(message_id)
+
+    '''name of the key holding when a rate bucket of the bot lets the next message go'''
+    @staticmethod
+    def _name_rate(bucket):
+        return 'rate:' + str(bucket)
+
+    '''name of the key holding the lease of a shard, its value is the worker'''
+    @staticmethod
+    def _name_lease(shard):
+        return 'lease:shard:' + str(shard)
+
+    '''shard of a url, the same hash as shard_of in the pop_due_shards script'''
+    @staticmethod
+    def _shard(url, shards):
+        hash_ = 0
+        for byte in str(url).encode():
+            hash_ = (hash_ * 31 + byte) % 2147483647
+        return hash_ % shards
+
+    '''name of the hash that subscribes a url for a chat'''
+    @staticmethod
+    def _name_url_chat(user_id, chat_id, url):
+        return 'user_url:' + str(user_id) + ':chat_id:' + str(chat_id) + ':^' + str(url) + '^'
+
+    '''split user_url:<user_id>:chat_id:<chat_id>:^<url>^ in user_id, chat_id and url'''
+    @staticmethod
+    def _split_name_url_chat(name):
+        _, user_id, _, chat_id, url = name.split(':', 4)
+        return user_id, chat_id, url.strip('^')
+
+    @staticmethod
+    def _name_group(chat_id):
+        return 'group:' + str(chat_id)
+
+    '''names of the sets indexing subscriptions by url, user and chat'''
+    @staticmethod
+    def _index_url(url):
+        return 'index:url:^' + str(url) + '^'
+
+    @staticmethod
+    def _index_user(user_id):
+        return 'index:user:' + str(user_id)
+
+    @staticmethod
+    def _index_chat(chat_id):
+        return 'index:chat:' + str(chat_id)
+
+    '''extract url for name'''
+    @staticmethod
+    def extract_url_from_names(names):
+        if names:
+            uncompress_name = [name.split('^') for name in names]
+            urls = sorted(set(['{}'.format(url[1]) for url in uncompress_name]))
+            return urls
+        return ()
+
+    '''keys and args of the lifecycle scripts'''
+    def _subscribe_call(self, chat_id, chat_name, url, user_id):
+        keys = [self._name_url(url),
+                self._name_url_chat(user_id, chat_id, url),
+                self._index_url(url),
+                self._index_user(user_id),
+                self._index_chat(chat_id),
+                self.INDEX_URLS_ACTIVATED,
+                self.INDEX_URLS_DUE]
+        args = [str(url), str(chat_id), chat_name, str(user_id), self.DEFAULT_LAST_UPDATE, self.DEFAULT_LAST_URL]
+        return keys, args
+
+    def _unsubscribe_call(self, chat_id, url):
+        return [self._index_chat(chat_id), self._index_url(url), self.INDEX_URLS_ACTIVATED], [str(url)]
+
+    def _disable_chat_call(self, chat_id):
+        return [self._index_chat(chat_id), self.INDEX_URLS_ACTIVATED], []
+
+    def _transfer_owner_call(self, chat_id, user_id):
+        return [self._index_chat(chat_id)], [str(user_id)]
+
+    def _register_group_call(self, chat_id, chat_name, chat_title, user_id, update_owner=None):
+        keys = [self._name_group(chat_id), self._index_chat(chat_id)]
+        args = [str(user_id), str(chat_id), chat_name, str(chat_title), '1' if update_owner else '0']
+        return keys, args
+
+    def _pop_due_call(self, now, next_due):
+        return [self.INDEX_URLS_DUE], [repr(float(now)), repr(float(next_due))]
+
+    def _pop_due_shards_call(self, now, next_due, shards, owned):
+        args = [repr(float(now)), repr(float(next_due)), str(shards)] + [str(shard) for shard in owned]
+        return [self.INDEX_URLS_DUE], args
+
+    def _leases_call(self, worker, shards, ttl=None):
+        args = [worker] if ttl is None else [worker, str(int(ttl * 1000))]
+        return [self._name_lease(shard) for shard in shards], args
+
+    def _pop_digests_call(self, now):
+        return [self.DIGESTS_DUE], [repr(float(now)), self._name_digest('')]
+
+    def _reserve_rate_call(self, limits):
+        return [self._name_rate(bucket) for bucket, _ in limits], [repr(1 / rate) for _, rate in limits]
+
+    def _block_rate_call(self, buckets, seconds):
+        return [self._name_rate(bucket) for bucket in buckets], [repr(float(seconds))]
+
+    def _requeue_outbox_call(self, now):
+        return [self.OUTBOX_RETRY, self.STREAM_OUTBOX], [repr(float(now)), self._name_retry('')]
+
+    '''shape query results read from the hashes'''
+    @staticmethod
+    def _url_mapping(last_update, last_url):
+        return {'last_update': str(last_update), 'last_url': last_url}
+
+    @staticmethod
+    def _update_url_info(keys):
+        if keys:
+            return {'last_update': keys.get('last_update'), 'last_url': keys.get('last_url'),
+                    'poll_interval': keys.get('poll_interval'), 'publish_history': keys.get('publish_history'),
+                    'etag': keys.get('etag'), 'modified': keys.get('modified'), 'digest': keys.get('digest')}
+        return False
+
+    def _chat_urls(self, names, hashes):
+        chat_urls = []
+        for name, keys in zip(names, hashes):
+            if not keys:
+                continue
+            url = self.extract_url_from_names([name])[0]
+            chat_urls.append({'user_id': str(keys.get('user_id')), 'chat_name': keys.get('chat_name'), 'url': url,
+                              'chat_id': str(keys.get('chat_id'))})
+        return chat_urls
+
+    @staticmethod
+    def _active_names(names, disables):
+        return [name for name, disable in zip(names, disables) if disable == 'False']
+
+    @staticmethod
+    def _active_chat_ids(values):
+        # dict keeps the first seen order while deduplicating in linear time
+        return list(dict.fromkeys(int(chat_id) for disable, chat_id in values if disable == 'False' and chat_id))
+
+    @staticmethod
+    def _digest_settings(chat_ids, values):
+        """ chat_id -> (window seconds, threshold) of the chats with digest mode on """
+        settings = {}
+        for chat_id, (window, threshold) in zip(chat_ids, values):
+            if window and int(window) > 0:
+                settings[chat_id] = (int(window), int(threshold or 2))
+        return settings
+
+    @staticmethod
+    def _digest_entry(url, text):
+        return json.dumps({'url': url, 'text': text.decode() if isinstance(text, bytes) else text})
+
+    @staticmethod
+    def _digests(response):
+        """ [(chat_id, [{url, text}, ...]), ...] from the flat reply of pop_digests """
+        return [(int(chat_id), [json.loads(entry) for entry in entries])
+                for chat_id, entries in zip(response[::2], response[1::2])]
+
+    @staticmethod
+    def _outbox_entries(url, text, chat_ids):
+        return [{'chat_id': str(chat_id), 'text': text, 'url': url, 'attempts': '0'} for chat_id in chat_ids]
+
+    @staticmethod
+    def _stream_messages(messages):
+        """ (id, fields) pairs of a stream reply, without the entries deleted meanwhile """
+        return [(message_id, fields) for message_id, fields in messages or [] if fields]
+
+    @staticmethod
+    def _seen_items(results):
+        count, scores = results[0], results[1:]
+        if not count:
+            return None
+        return [score is not None for score in scores]
+
+    @staticmethod
+    def _url_is_activated(disables):
+        return any(disable != 'True' for disable in disables)
+
+    @staticmethod
+    def _chat_id_for_chat_name(chat_name, values):
+        for chat_name_db, chat_id_db in values:
+            if chat_name_db == chat_name and chat_id_db:
+                return chat_id_db
+        return None
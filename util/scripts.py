@@ -0,0 +1,254 @@
+"""
+Lua scripts for the subscription lifecycle and the feed schedule.
+
+Each script runs a whole operation of DatabaseHandler on the server, so it costs one
+round trip and no other client can interleave with it. Index names built inside the
+scripts follow the same schema as DatabaseHandler:
+
+    user_url:<user_id>:chat_id:<chat_id>:^<url>^   subscription hash
+    index:url:^<url>^                              subscriptions of a url
+    index:user:<user_id>                           subscriptions of a user
+    index:chat:<chat_id>                           subscriptions of a chat
+    index:urls_activated                           urls with an enabled subscription
+    index:urls_due                                 activated urls scored by next due timestamp
+    digest:chat:<chat_id>                          posts waiting for the digest of a chat
+    digest:due                                     chats with a digest scored by when it is due
+    lease:shard:<shard>                            worker holding a shard of the urls, expires
+    lease:workers                                  workers scored by their last heartbeat
+"""
+
+_HELPERS = """
+local function split_name(name)
+    local user_id, chat_id, url = string.match(name, '^user_url:([^:]*):chat_id:([^:]*):%^(.*)%^$')
+    return user_id, chat_id, url
+end
+
+local function index_url(url)
+    return 'index:url:^' .. url .. '^'
+end
+
+local function url_activated(url, index_activated)
+    local names = redis.call('SMEMBERS', index_url(url))
+    for _, name in ipairs(names) do
+        if redis.call('HGET', name, 'disable') ~= 'True' then
+            redis.call('SADD', index_activated, url)
+            return 1
+        end
+    end
+    redis.call('SREM', index_activated, url)
+    redis.call('ZREM', 'index:urls_due', url)
+    return 0
+end
+
+local function transfer_owner(index_chat, user_id)
+    local moved = 0
+    for _, name in ipairs(redis.call('SMEMBERS', index_chat)) do
+        local user_id_db, chat_id, url = split_name(name)
+        local name_update = 'user_url:' .. user_id .. ':chat_id:' .. chat_id .. ':^' .. url .. '^'
+        if name_update ~= name then
+            redis.call('SREM', 'index:user:' .. user_id_db, name)
+            redis.call('SREM', index_url(url), name)
+            redis.call('SREM', index_chat, name)
+            redis.call('RENAME', name, name_update)
+            redis.call('HSET', name_update, 'user_id', user_id)
+            redis.call('SADD', 'index:user:' .. user_id, name_update)
+            redis.call('SADD', index_url(url), name_update)
+            redis.call('SADD', index_chat, name_update)
+            moved = moved + 1
+        end
+    end
+    return moved
+end
+"""
+
+# KEYS: url hash, subscription hash, index url, index user, index chat, index urls activated, index urls due
+# ARGV: url, chat_id, chat_name, user_id, default last_update, default last_url
+SUBSCRIBE = _HELPERS + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], 'last_update', ARGV[5], 'last_url', ARGV[6])
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'chat_id', ARGV[2], 'chat_name', ARGV[3], 'user_id', ARGV[4], 'disable', 'False')
+redis.call('SADD', KEYS[3], KEYS[2])
+redis.call('SADD', KEYS[4], KEYS[2])
+redis.call('SADD', KEYS[5], KEYS[2])
+redis.call('SADD', KEYS[6], ARGV[1])
+if not redis.call('ZSCORE', KEYS[7], ARGV[1]) then
+    redis.call('ZADD', KEYS[7], 0, ARGV[1])
+end
+return 1
+"""
+
+# KEYS: index chat, index url, index urls activated
+# ARGV: url
+UNSUBSCRIBE = _HELPERS + """
+local deleted = 0
+for _, name in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local user_id, chat_id, url = split_name(name)
+    if url == ARGV[1] then
+        deleted = deleted + redis.call('DEL', name)
+        redis.call('SREM', KEYS[1], name)
+        redis.call('SREM', KEYS[2], name)
+        redis.call('SREM', 'index:user:' .. user_id, name)
+    end
+end
+url_activated(ARGV[1], KEYS[3])
+if redis.call('SCARD', KEYS[2]) == 0 then
+    redis.call('DEL', 'seen:^' .. ARGV[1] .. '^')
+end
+return deleted
+"""
+
+# KEYS: index chat, index urls activated
+# returns the disabled subscription names
+DISABLE_CHAT = _HELPERS + """
+local names = redis.call('SMEMBERS', KEYS[1])
+local urls = {}
+for _, name in ipairs(names) do
+    redis.call('HSET', name, 'disable', 'True')
+    local _, _, url = split_name(name)
+    urls[url] = true
+end
+for url, _ in pairs(urls) do
+    url_activated(url, KEYS[2])
+end
+return names
+"""
+
+# KEYS: index chat
+# ARGV: new user_id
+TRANSFER_OWNER = _HELPERS + """
+return transfer_owner(KEYS[1], ARGV[1])
+"""
+
+# KEYS: group hash, index chat
+# ARGV: chat_adm, chat_id, chat_name, chat_title, transfer owner ('1' or '0')
+REGISTER_GROUP = _HELPERS + """
+redis.call('HSET', KEYS[1], 'chat_adm', ARGV[1], 'chat_id', ARGV[2], 'chat_lock', 'True',
+           'chat_name', ARGV[3], 'chat_title', ARGV[4])
+if ARGV[5] == '1' then
+    transfer_owner(KEYS[2], ARGV[1])
+end
+return redis.call('EXISTS', KEYS[1])
+"""
+
+# KEYS: index urls due
+# ARGV: now, next due
+# returns the urls due at now, each one rescheduled to next due so no other cycle takes it meanwhile
+POP_DUE = """
+local urls = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, url in ipairs(urls) do
+    redis.call('ZADD', KEYS[1], ARGV[2], url)
+end
+return urls
+"""
+
+# KEYS: outbox retries, outbox stream
+# ARGV: now, retry hash prefix
+# moves the retries due at now back to the outbox stream, returns how many
+REQUEUE_OUTBOX = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+    local name = ARGV[2] .. id
+    local fields = redis.call('HGETALL', name)
+    if #fields > 0 then
+        redis.call('XADD', KEYS[2], '*', unpack(fields))
+    end
+    redis.call('DEL', name)
+    redis.call('ZREM', KEYS[1], id)
+end
+return #ids
+"""
+
+POP_DIGESTS = """
+local chat_ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local digests = {}
+for _, chat_id in ipairs(chat_ids) do
+    local name = ARGV[2] .. chat_id
+    table.insert(digests, chat_id)
+    table.insert(digests, redis.call('LRANGE', name, 0, -1))
+    redis.call('DEL', name)
+    redis.call('ZREM', KEYS[1], chat_id)
+end
+return digests
+"""
+
+POP_DUE_SHARDS = """
+local function shard_of(url, shards)
+    local hash = 0
+    for i = 1, #url do
+        hash = (hash * 31 + string.byte(url, i)) % 2147483647
+    end
+    return hash % shards
+end
+
+local shards = tonumber(ARGV[3])
+local owned = {}
+for i = 4, #ARGV do
+    owned[tonumber(ARGV[i])] = true
+end
+local popped = {}
+for _, url in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])) do
+    if owned[shard_of(url, shards)] then
+        redis.call('ZADD', KEYS[1], ARGV[2], url)
+        table.insert(popped, url)
+    end
+end
+return popped
+"""
+
+RENEW_LEASES = """
+local owned = {}
+for i, name in ipairs(KEYS) do
+    if redis.call('GET', name) == ARGV[1] then
+        redis.call('PEXPIRE', name, ARGV[2])
+        owned[i] = 1
+    else
+        owned[i] = 0
+    end
+end
+return owned
+"""
+
+RELEASE_LEASES = """
+local released = 0
+for _, name in ipairs(KEYS) do
+    if redis.call('GET', name) == ARGV[1] then
+        released = released + redis.call('DEL', name)
+    end
+end
+return released
+"""
+
+# KEYS: rate buckets of a message (global, chat, group)
+# ARGV: seconds between two messages of each bucket
+# takes a turn in every bucket, returns the seconds to wait before sending; the clock is the
+# server's, so the processes of one bot share the buckets whatever their hosts' clocks say
+RESERVE_RATE = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local wait = 0
+for i, name in ipairs(KEYS) do
+    local next_at = math.max(tonumber(redis.call('GET', name) or '0'), now)
+    wait = math.max(wait, next_at - now)
+    next_at = next_at + tonumber(ARGV[i])
+    redis.call('SET', name, string.format('%.6f', next_at), 'PX', math.ceil((next_at - now) * 1000) + 1000)
+end
+return string.format('%.6f', wait)
+"""
+
+# KEYS: rate buckets to block
+# ARGV: seconds Telegram asked to wait
+BLOCK_RATE = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local until_at = now + tonumber(ARGV[1])
+for _, name in ipairs(KEYS) do
+    if tonumber(redis.call('GET', name) or '0') < until_at then
+        redis.call('SET', name, string.format('%.6f', until_at), 'PX', math.ceil(tonumber(ARGV[1]) * 1000) + 1000)
+    end
+end
+return #KEYS
+"""
@@ -0,0 +1,726 @@
+import asyncio
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+
+from decouple import config
+from redis.exceptions import ResponseError
+
+from util import connection
+from util.schema import KeySchema
+
+_memory = {}
+_memory_lock = threading.Lock()
+
+
+def backend():
+    """
+    Storage backend selected by STORAGE in .env: redis (default) or memory
+    """
+    return config('STORAGE', default='redis').lower()
+
+
+def get_storage(db):
+    """
+    Returns the client the handlers talk to for a data base. Both backends answer the
+    same subset of the redis client API that DatabaseHandler uses.
+    """
+    if backend() == 'memory':
+        return MemoryStorage.for_db(db)
+    return connection.get_redis(db)
+
+
+def get_async_storage(db):
+    if backend() == 'memory':
+        return AsyncMemoryStorage(MemoryStorage.for_db(db))
+    return connection.get_async_redis(db)
+
+
+@lru_cache(maxsize=512)
+def _compile_glob(pattern):
+    """ Translates a redis glob (*, ?, [abc], [^abc], \\x) to a compiled regex """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+            continue
+        if char == '*':
+            regex += '.*'
+        elif char == '?':
+            regex += '.'
+        elif char == '[' and pattern.find(']', i + 2) > 0:
+            end = pattern.find(']', i + 2)
+            body = pattern[i + 1:end]
+            negate = body.startswith('^')
+            body = body[1:] if negate else body
+            regex += '[' + ('^' if negate else '') + body.replace('\\', '\\\\') + ']'
+            i = end + 1
+            continue
+        else:
+            regex += re.escape(char)
+        i += 1
+    return re.compile(regex + r'\Z', re.DOTALL)
+
+
+class SortedSet(dict):
+    """ member -> score, kept apart from hashes for the WRONGTYPE checks """
+
+
+class Stream(object):
+    """ Entries by id and consumer groups of a stream key """
+
+    def __init__(self):
+        self.entries = {}
+        self.groups = {}
+        self.last = (0, 0)
+
+
+def _stream_id(value):
+    if isinstance(value, tuple):
+        return value
+    milliseconds, _, sequence = str(value).partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+def _format_stream_id(value):
+    return f'{value[0]}-{value[1]}'
+
+
+class MemoryScript(object):
+    """ Stand-in for a registered redis Script, runs the python version of a lifecycle script """
+
+    def __init__(self, storage, function):
+        self.storage = storage
+        self.function = function
+
+    def __call__(self, keys=None, args=None, client=None):
+        with self.storage.lock:
+            return self.function(list(keys or []), [str(arg) for arg in args or []])
+
+
+class MemoryPipeline(object):
+    """ Buffers commands and runs them in order on execute, like a redis pipeline """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.storage, name)
+
+        def buffer(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+
+        return buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.reset()
+
+    def reset(self):
+        self.commands = []
+
+    def execute(self):
+        with self.storage.lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.commands]
+        self.reset()
+        return results
+
+
+class MemoryStorage(object):
+    """
+    In-process storage with the semantics of the redis commands the handlers use,
+    including the glob matching of SCAN and the lifecycle scripts. Data lives only
+    as long as the process, one instance per data base index.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._changed = threading.Condition(self.lock)
+        self._data = {}
+        self._expires = {}
+        self._purge_at = 1024
+
+    @classmethod
+    def for_db(cls, db):
+        with _memory_lock:
+            if db not in _memory:
+                _memory[db] = cls()
+            return _memory[db]
+
+    def _expire(self, name):
+        """ Drops name once its expiry passed, redis expires lazily on access too """
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(name, None)
+            del self._expires[name]
+
+    def _live(self):
+        for name in list(self._expires):
+            self._expire(name)
+        return self._data
+
+    def _get(self, name, kind):
+        self._expire(name)
+        value = self._data.get(name)
+        if value is not None and type(value) is not kind:
+            raise ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _hash(self, name):
+        return self._get(name, dict)
+
+    def _set(self, name):
+        return self._get(name, set)
+
+    def _list(self, name):
+        return self._get(name, list)
+
+    def _zset(self, name):
+        return self._get(name, SortedSet)
+
+    def _stream(self, name):
+        return self._get(name, Stream)
+
+    def _group(self, name, groupname):
+        stream = self._stream(name)
+        if stream is None or groupname not in stream.groups:
+            raise ResponseError(f'NOGROUP No such key {name} or consumer group {groupname}')
+        return stream, stream.groups[groupname]
+
+    def _drop_empty(self, name):
+        if not self._data.get(name):
+            self._data.pop(name, None)
+
+    '''keys'''
+    def scan(self, cursor=0, match=None, count=None):
+        return 0, self.keys(match or '*')
+
+    def scan_iter(self, match=None, count=None):
+        return iter(self.keys(match or '*'))
+
+    def keys(self, pattern='*'):
+        regex = _compile_glob(str(pattern))
+        with self.lock:
+            return [name for name in self._live() if regex.match(name)]
+
+    def exists(self, *names):
+        with self.lock:
+            return sum(1 for name in names if name in self._live())
+
+    def type(self, name):
+        kinds = {str: 'string', dict: 'hash', set: 'set', list: 'list', SortedSet: 'zset', Stream: 'stream'}
+        with self.lock:
+            value = self._live().get(name)
+            return 'none' if value is None else kinds[type(value)]
+
+    def delete(self, *names):
+        with self.lock:
+            self._live()
+            for name in names:
+                self._expires.pop(name, None)
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def rename(self, src, dst):
+        with self.lock:
+            if src not in self._live():
+                raise ResponseError('no such key')
+            self._data[dst] = self._data.pop(src)
+            self._expires.pop(dst, None)
+            if src in self._expires:
+                self._expires[dst] = self._expires.pop(src)
+            return True
+
+    def pexpire(self, name, time_ms):
+        with self.lock:
+            if name not in self._live():
+                return False
+            self._expires[name] = time.monotonic() + int(time_ms) / 1000
+            return True
+
+    def pttl(self, name):
+        with self.lock:
+            if name not in self._live():
+                return -2
+            if name not in self._expires:
+                return -1
+            return int((self._expires[name] - time.monotonic()) * 1000)
+
+    def flushdb(self):
+        with self.lock:
+            self._data.clear()
+            self._expires.clear()
+            return True
+
+    '''strings'''
+    def get(self, name):
+        with self.lock:
+            return self._get(name, str)
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        with self.lock:
+            self._expire(name)
+            exists = name in self._data
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._data[name] = value.decode() if isinstance(value, bytes) else str(value)
+            self._expires.pop(name, None)
+            if ex is not None or px is not None:
+                self._expires[name] = time.monotonic() + (px / 1000 if px is not None else ex)
+                # keys nobody reads again would never expire lazily, sweep them once in a while as redis does
+                if len(self._expires) >= self._purge_at:
+                    self._live()
+                    self._purge_at = max(1024, 2 * len(self._expires))
+            return True
+
+    '''hashes'''
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self.lock:
+            hash_ = self._hash(name)
+            if hash_ is None:
+                hash_ = self._data[name] = {}
+            added = sum(1 for field in items if str(field) not in hash_)
+            hash_.update({str(field): str(value) for field, value in items.items()})
+            return added
+
+    def hget(self, name, key):
+        with self.lock:
+            return (self._hash(name) or {}).get(str(key))
+
+    def hmget(self, name, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        with self.lock:
+            hash_ = self._hash(name) or {}
+            return [hash_.get(str(key)) for key in keys + list(args)]
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self._hash(name) or {})
+
+    def hkeys(self, name):
+        with self.lock:
+            return list(self._hash(name) or {})
+
+    def hexists(self, name, key):
+        with self.lock:
+            return str(key) in (self._hash(name) or {})
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            hash_ = self._hash(name) or {}
+            deleted = sum(1 for key in keys if hash_.pop(str(key), None) is not None)
+            self._drop_empty(name)
+            return deleted
+
+    '''sets'''
+    def sadd(self, name, *values):
+        with self.lock:
+            set_ = self._set(name)
+            if set_ is None:
+                set_ = self._data[name] = set()
+            added = len(set(str(value) for value in values) - set_)
+            set_.update(str(value) for value in values)
+            return added
+
+    def srem(self, name, *values):
+        with self.lock:
+            set_ = self._set(name) or set()
+            removed = len(set_ & set(str(value) for value in values))
+            set_.difference_update(str(value) for value in values)
+            self._drop_empty(name)
+            return removed
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self._set(name) or set())
+
+    def sismember(self, name, value):
+        with self.lock:
+            return str(value) in (self._set(name) or set())
+
+    def scard(self, name):
+        with self.lock:
+            return len(self._set(name) or set())
+
+    '''lists'''
+    def rpush(self, name, *values):
+        with self.lock:
+            list_ = self._list(name)
+            if list_ is None:
+                list_ = self._data[name] = []
+            list_.extend(str(value) for value in values)
+            return len(list_)
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            list_ = self._list(name) or []
+            return list_[start:end + 1 if end != -1 else None]
+
+    def llen(self, name):
+        with self.lock:
+            return len(self._list(name) or [])
+
+    '''sorted sets'''
+    def zadd(self, name, mapping, nx=False, xx=False):
+        with self.lock:
+            zset = self._zset(name)
+            if zset is None:
+                zset = self._data[name] = SortedSet()
+            added = 0
+            for member, score in mapping.items():
+                member = str(member)
+                if (nx and member in zset) or (xx and member not in zset):
+                    continue
+                added += 0 if member in zset else 1
+                zset[member] = float(score)
+            self._drop_empty(name)
+            return added
+
+    def zrem(self, name, *values):
+        with self.lock:
+            zset = self._zset(name) or SortedSet()
+            removed = sum(1 for value in values if zset.pop(str(value), None) is not None)
+            self._drop_empty(name)
+            return removed
+
+    def zscore(self, name, value):
+        with self.lock:
+            return (self._zset(name) or SortedSet()).get(str(value))
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self._zset(name) or SortedSet())
+
+    def zremrangebyrank(self, name, start, end):
+        with self.lock:
+            zset = self._zset(name) or SortedSet()
+            ranked = sorted((score, member) for member, score in zset.items())
+            end = end + 1 if end != -1 else len(ranked)
+            removed = ranked[start:end]
+            for _, member in removed:
+                del zset[member]
+            self._drop_empty(name)
+            return len(removed)
+
+    def zremrangebyscore(self, name, min, max):
+        with self.lock:
+            zset = self._zset(name) or SortedSet()
+            removed = [member for member, score in zset.items() if float(min) <= score <= float(max)]
+            for member in removed:
+                del zset[member]
+            self._drop_empty(name)
+            return len(removed)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None, withscores=False):
+        with self.lock:
+            zset = self._zset(name) or SortedSet()
+            items = sorted((score, member) for member, score in zset.items()
+                           if float(min) <= score <= float(max))
+        if start is not None and num is not None:
+            items = items[start:start + num]
+        return [(member, score) if withscores else member for score, member in items]
+
+    '''streams'''
+    def xadd(self, name, fields, id='*', maxlen=None, approximate=True):
+        with self.lock:
+            stream = self._stream(name)
+            if stream is None:
+                stream = self._data[name] = Stream()
+            milliseconds = int(time.time() * 1000)
+            if id == '*':
+                id = (milliseconds, 0) if milliseconds > stream.last[0] else (stream.last[0], stream.last[1] + 1)
+            stream.last = _stream_id(id)
+            message_id = _format_stream_id(stream.last)
+            stream.entries[message_id] = {str(key): value.decode() if isinstance(value, bytes) else str(value)
+                                          for key, value in fields.items()}
+            while maxlen is not None and len(stream.entries) > maxlen:
+                del stream.entries[next(iter(stream.entries))]
+            self._changed.notify_all()
+            return message_id
+
+    def xlen(self, name):
+        with self.lock:
+            return len((self._stream(name) or Stream()).entries)
+
+    def xdel(self, name, *ids):
+        with self.lock:
+            entries = (self._stream(name) or Stream()).entries
+            return sum(1 for message_id in ids if entries.pop(str(message_id), None) is not None)
+
+    def xrange(self, name, min='-', max='+', count=None):
+        with self.lock:
+            entries = (self._stream(name) or Stream()).entries
+            low = (0, 0) if min == '-' else _stream_id(min)
+            high = None if max == '+' else _stream_id(max)
+            messages = [(message_id, dict(fields)) for message_id, fields in entries.items()
+                        if low <= _stream_id(message_id) and (high is None or _stream_id(message_id) <= high)]
+        return messages[:count] if count is not None else messages
+
+    def xgroup_create(self, name, groupname, id='$', mkstream=False):
+        with self.lock:
+            stream = self._stream(name)
+            if stream is None:
+                if not mkstream:
+                    raise ResponseError('ERR The XGROUP subcommand requires the key to exist')
+                stream = self._data[name] = Stream()
+            if groupname in stream.groups:
+                raise ResponseError('BUSYGROUP Consumer Group name already exists')
+            stream.groups[groupname] = {'last': stream.last if id == '$' else _stream_id(id), 'pending': {}}
+            return True
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        deadline = time.monotonic() + block / 1000 if block else None
+        with self.lock:
+            while True:
+                response = []
+                for name, start in streams.items():
+                    stream, group = self._group(name, groupname)
+                    now = time.monotonic()
+                    if start == '>':
+                        message_ids = [message_id for message_id in stream.entries
+                                       if _stream_id(message_id) > group['last']][:count]
+                        if message_ids:
+                            group['last'] = _stream_id(message_ids[-1])
+                        for message_id in message_ids if not noack else []:
+                            group['pending'][message_id] = [consumername, now, 1]
+                    else:
+                        message_ids = [message_id for message_id, (consumer, _, _)
+                                       in sorted(group['pending'].items(), key=lambda item: _stream_id(item[0]))
+                                       if consumer == consumername and _stream_id(message_id) > _stream_id(start)]
+                        message_ids = message_ids[:count]
+                        for message_id in message_ids:
+                            group['pending'][message_id][1:] = [now, group['pending'][message_id][2] + 1]
+                    if message_ids or start != '>':
+                        response.append([name, [(message_id, dict(stream.entries[message_id])
+                                                 if message_id in stream.entries else None)
+                                                for message_id in message_ids]])
+                timeout = deadline - time.monotonic() if deadline else None
+                if response or not block or timeout <= 0:
+                    return response
+                self._changed.wait(timeout)
+
+    def xack(self, name, groupname, *ids):
+        with self.lock:
+            _, group = self._group(name, groupname)
+            return sum(1 for message_id in ids if group['pending'].pop(str(message_id), None) is not None)
+
+    def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id='0-0', count=None, justid=False):
+        with self.lock:
+            stream, group = self._group(name, groupname)
+            now = time.monotonic()
+            claimed, deleted = [], []
+            for message_id in sorted(group['pending'], key=_stream_id):
+                if len(claimed) + len(deleted) >= (count or 100):
+                    break
+                pending = group['pending'][message_id]
+                if _stream_id(message_id) < _stream_id(start_id) or (now - pending[1]) * 1000 < min_idle_time:
+                    continue
+                if message_id not in stream.entries:
+                    del group['pending'][message_id]
+                    deleted.append(message_id)
+                    continue
+                group['pending'][message_id] = [consumername, now, pending[2] + 1]
+                claimed.append(message_id if justid else (message_id, dict(stream.entries[message_id])))
+            return ['0-0', claimed, deleted]
+
+    '''pipelines and scripts'''
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+    def register_script(self, source):
+        names = {script: name for name, script in KeySchema.SCRIPTS.items()}
+        return MemoryScript(self, getattr(self, '_script_' + names[source]))
+
+    def _url_activated(self, url, index_activated):
+        names = self.smembers(KeySchema._index_url(url))
+        if KeySchema._url_is_activated(self.hget(name, 'disable') for name in names):
+            self.sadd(index_activated, url)
+            return 1
+        self.srem(index_activated, url)
+        self.zrem(KeySchema.INDEX_URLS_DUE, url)
+        return 0
+
+    def _transfer_owner(self, index_chat, user_id):
+        moved = 0
+        for name in self.smembers(index_chat):
+            user_id_db, chat_id, url = KeySchema._split_name_url_chat(name)
+            name_update = KeySchema._name_url_chat(user_id, chat_id, url)
+            if name_update != name:
+                self.srem(KeySchema._index_user(user_id_db), name)
+                self.srem(KeySchema._index_url(url), name)
+                self.srem(index_chat, name)
+                self.rename(name, name_update)
+                self.hset(name_update, 'user_id', user_id)
+                self.sadd(KeySchema._index_user(user_id), name_update)
+                self.sadd(KeySchema._index_url(url), name_update)
+                self.sadd(index_chat, name_update)
+                moved += 1
+        return moved
+
+    def _script_subscribe(self, keys, args):
+        if not self.exists(keys[0]):
+            self.hset(keys[0], mapping={'last_update': args[4], 'last_url': args[5]})
+        if self.exists(keys[1]):
+            return 0
+        self.hset(keys[1], mapping={'chat_id': args[1], 'chat_name': args[2], 'user_id': args[3], 'disable': 'False'})
+        for index in keys[2:5]:
+            self.sadd(index, keys[1])
+        self.sadd(keys[5], args[0])
+        self.zadd(keys[6], {args[0]: 0}, nx=True)
+        return 1
+
+    def _script_unsubscribe(self, keys, args):
+        deleted = 0
+        for name in self.smembers(keys[0]):
+            user_id, _, url = KeySchema._split_name_url_chat(name)
+            if url == args[0]:
+                deleted += self.delete(name)
+                self.srem(keys[0], name)
+                self.srem(keys[1], name)
+                self.srem(KeySchema._index_user(user_id), name)
+        self._url_activated(args[0], keys[2])
+        if not self.scard(keys[1]):
+            self.delete(KeySchema._name_seen(args[0]))
+        return deleted
+
+    def _script_disable_chat(self, keys, args):
+        names = list(self.smembers(keys[0]))
+        for name in names:
+            self.hset(name, 'disable', 'True')
+        for url in KeySchema.extract_url_from_names(names):
+            self._url_activated(url, keys[1])
+        return names
+
+    def _script_transfer_owner(self, keys, args):
+        return self._transfer_owner(keys[0], args[0])
+
+    def _script_register_group(self, keys, args):
+        self.hset(keys[0], mapping={'chat_adm': args[0], 'chat_id': args[1], 'chat_lock': 'True',
+                                    'chat_name': args[2], 'chat_title': args[3]})
+        if args[4] == '1':
+            self._transfer_owner(keys[1], args[0])
+        return self.exists(keys[0])
+
+    def _script_pop_digests(self, keys, args):
+        digests = []
+        for chat_id in self.zrangebyscore(keys[0], '-inf', args[0]):
+            digests += [chat_id, self.lrange(args[1] + chat_id, 0, -1)]
+            self.delete(args[1] + chat_id)
+            self.zrem(keys[0], chat_id)
+        return digests
+
+    def _script_requeue_outbox(self, keys, args):
+        ids = self.zrangebyscore(keys[0], '-inf', args[0])
+        for message_id in ids:
+            fields = self.hgetall(args[1] + message_id)
+            if fields:
+                self.xadd(keys[1], fields)
+            self.delete(args[1] + message_id)
+            self.zrem(keys[0], message_id)
+        return len(ids)
+
+    def _script_reserve_rate(self, keys, args):
+        now = time.time()
+        wait = 0
+        for name, interval in zip(keys, args):
+            next_at = max(float(self.get(name) or 0), now)
+            wait = max(wait, next_at - now)
+            next_at += float(interval)
+            self.set(name, f'{next_at:.6f}', px=math.ceil((next_at - now) * 1000) + 1000)
+        return f'{wait:.6f}'
+
+    def _script_block_rate(self, keys, args):
+        until = time.time() + float(args[0])
+        for name in keys:
+            if float(self.get(name) or 0) < until:
+                self.set(name, f'{until:.6f}', px=math.ceil(float(args[0]) * 1000) + 1000)
+        return len(keys)
+
+    def _script_pop_due(self, keys, args):
+        urls = self.zrangebyscore(keys[0], '-inf', args[0])
+        self.zadd(keys[0], {url: args[1] for url in urls})
+        return urls
+
+    def _script_pop_due_shards(self, keys, args):
+        shards, owned = int(args[2]), {int(shard) for shard in args[3:]}
+        urls = [url for url in self.zrangebyscore(keys[0], '-inf', args[0])
+                if KeySchema._shard(url, shards) in owned]
+        if urls:
+            self.zadd(keys[0], {url: args[1] for url in urls})
+        return urls
+
+    def _script_renew_leases(self, keys, args):
+        owned = []
+        for name in keys:
+            owned.append(1 if self.get(name) == args[0] and self.pexpire(name, args[1]) else 0)
+        return owned
+
+    def _script_release_leases(self, keys, args):
+        return sum(self.delete(name) for name in keys if self.get(name) == args[0])
+
+
+class AsyncMemoryPipeline(object):
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def __getattr__(self, name):
+        buffer = getattr(self.pipeline, name)
+
+        def command(*args, **kwargs):
+            buffer(*args, **kwargs)
+            return self
+
+        return command
+
+    async def execute(self):
+        return self.pipeline.execute()
+
+
+class AsyncMemoryStorage(object):
+    """ MemoryStorage behind the coroutine API of redis.asyncio """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        method = getattr(self.storage, name)
+
+        async def command(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return command
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncMemoryPipeline(self.storage.pipeline(transaction, shard_hint))
+
+    def register_script(self, source):
+        script = self.storage.register_script(source)
+
+        async def call(keys=None, args=None, client=None):
+            return script(keys=keys, args=args)
+
+        return call
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        # a blocking read would stall the event loop, poll once after a short sleep instead
+        response = self.storage.xreadgroup(groupname, consumername, streams, count=count, noack=noack)
+        if not response and block is not None:
+            await asyncio.sleep(min(block or 100, 100) / 1000)
+            response = self.storage.xreadgroup(groupname, consumername, streams, count=count, noack=noack)
+        return response
+
+    async def scan_iter(self, match=None, count=None):
+        for name in self.storage.scan_iter(match, count):
+            yield name